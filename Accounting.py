@@ -58,6 +58,34 @@ def save_data(data) -> None:
     except FileNotFoundError:
         print("ERROR SAVING Accounting data!!!")
 
+def handle_message(accounts, new_message):
+    """
+    Carries out one action message against the accounts.
+    :return: the reply for the sender, or None for actions that have nothing to reply with
+    """
+
+    # Assign
+    command = new_message['action']
+
+    # take action based on the command given in the message
+
+    # --- CHECK BOOK OUT ---
+    if command == 'check_out':
+        return accounts.check_out(new_message['user'], new_message['sn'])
+
+    # --- CHECK BOOK IN ---
+    elif command == 'check_in':
+        accounts.check_in(new_message['user'], new_message['sn'])
+        return None
+
+    # --- CHECKED OUT BOOK INQUIRY ---
+    elif command == 'get_checkouts':
+        return accounts.get_check_outs(new_message['user'])
+
+    else:
+        print(f"ERROR...INVALID COMMAND ({command}) RECEIVED!")
+        return 'ERROR'
+
 def main():
     """
     ACCOUNTING MICROSERVICE
@@ -75,7 +103,9 @@ def main():
     # Instantiate a Pipeline
     pipe = Pipeline('accounting')
 
-    # Initiate main (outer) loop.  [there's an inner loop in the Pipeline.receive() function]
+    # Bind our port now and keep it open, so messages arriving early are queued rather than refused
+    pipe.listen()
+
     # ----- ACCOUNTING DATABASE INITIATE -----
     # check for existing Accounting database
     try:
@@ -87,32 +117,21 @@ def main():
     except FileNotFoundError:
         accounts = AccountData()
 
-    # Initiate main (outer) loop.  [there's an inner loop in the Pipeline.receive() function]
-    while True:
-        # execute listening (blocking action) and assign result to 'new_message'
-        new_message = pipe.receive()
-
-        # Assign
-        command = new_message['action']
-
-        # take action based on the command given in the message
-
-        # --- CHECK BOOK OUT ---
-        if command == 'check_out':
-            reply = accounts.check_out(new_message['user'], new_message['sn'])
-            pipe.send('core', reply)
+    # Initiate main loop.  The Pipeline listener queues messages as they arrive; take them one at a time
+    try:
+        for new_message in pipe.messages():
 
-        # --- CHECK BOOK IN ---
-        elif command == 'check_in':
-            accounts.check_in(new_message['user'], new_message['sn'])
+            # --- BATCH: run every action in order, answer with the list of results ---
+            if new_message['action'] == 'batch':
+                pipe.reply([handle_message(accounts, message) for message in new_message['batch']])
 
-        # --- CHECKED OUT BOOK INQUIRY ---
-        elif command == 'get_checkouts':
-            message = accounts.get_check_outs(new_message['user'])
-            pipe.send('core', message)
+            # --- SINGLE ACTION ---
+            else:
+                pipe.reply(handle_message(accounts, new_message))
 
-        else:
-            print(f"ERROR...INVALID COMMAND ({command}) RECEIVED!")
+    # Shutting down (e.g. Ctrl-C)...leave a record of this run's traffic and latencies
+    finally:
+        pipe.close(dump_stats=True)
 
 
 # Execute Program
@@ -0,0 +1,264 @@
+import asyncio
+import itertools
+import os
+import pickle
+import time
+from Pipeline import ADDRESS_BOOK, FRAME_HEADER, MAX_FRAME, ONE_WAY, encode_frame, make_batch
+from message_codec import DEFAULT_CODEC
+from pipeline_stats import PipelineStats, action_of
+
+
+class AsyncConnection:
+    """
+    One open stream to a service, shared by every coroutine talking to it.
+
+    A reader task matches each reply to the request waiting for it, so any number of requests can be in
+    flight on the connection at once.
+    """
+
+    def __init__(self, reader, writer, address, codec=DEFAULT_CODEC):
+        """ Wraps a connected asyncio stream pair and starts routing its replies. """
+        self.reader = reader
+        self.writer = writer
+        self.address = address
+        self.codec = codec
+        self.pending = {}                   # {request id: asyncio Future waiting for that reply}
+        self.closed = False
+        self.reader_task = asyncio.get_running_loop().create_task(self.read_replies())
+
+    async def send(self, data, request_id=ONE_WAY) -> int:
+        """ Encodes and writes one message, returning its size in bytes. """
+        frame = encode_frame(data, request_id, self.codec)
+        self.writer.writelines(frame)
+        await self.writer.drain()
+        return sum(len(buffer) for buffer in frame)
+
+    async def request(self, data, request_id):
+        """
+        Sends a request and waits for the reply carrying the same id.
+        :return: (reply, request size in bytes, reply size in bytes)
+        """
+        if self.closed:
+            raise ConnectionError(f"connection to {self.address} is closed")
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            size = await self.send(data, request_id)
+            reply, reply_size = await future
+            return reply, size, reply_size
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def read_replies(self) -> None:
+        """ Reads replies until the connection drops, then fails whatever is still waiting. """
+        error = ConnectionError(f"connection to {self.address} closed")
+        try:
+            while True:
+                request_id, reply, size = await read_frame(self.reader, self.codec)
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result((reply, size))
+        except (EOFError, asyncio.CancelledError):
+            pass
+        except (OSError, ValueError, pickle.UnpicklingError) as failure:
+            error = ConnectionError(f"connection to {self.address} failed: {failure}")
+        finally:
+            self.closed = True
+            self.writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending = {}
+
+    async def close(self) -> None:
+        """ Closes the stream and stops the reader task. """
+        self.closed = True
+        self.reader_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def read_frame(reader, codec=DEFAULT_CODEC) -> tuple:
+    """
+    Reads one frame from an asyncio StreamReader.
+    :return: (request id, message, frame size in bytes), or raises EOFError when the other end has hung up
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as error:
+        if not error.partial:
+            raise EOFError
+        raise ConnectionError("connection closed in the middle of a frame")
+
+    length, tag, request_id = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f"frame of {length} bytes is larger than the {MAX_FRAME} byte limit")
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("connection closed in the middle of a frame")
+    return request_id, codec.decode(tag, payload), FRAME_HEADER.size + length
+
+
+class AsyncPipeline:
+    """
+    asyncio counterpart to Pipeline.  It speaks the same wire format and uses the same address book, so a
+    service can switch to it without its clients noticing, and the reverse.
+
+    CALL:   await pipeline.send('microservice recipient name string', data payload)       [no reply]
+            await pipeline.request('microservice recipient name string', data payload)    [waits for reply]
+            await pipeline.batch('microservice recipient name string', [payload, ...])    [list of replies]
+
+    Requests to different services can run together, for example:
+            profile, checkouts = await asyncio.gather(pipeline.request('profile', {...}),
+                                                      pipeline.request('accounting', {...}))
+
+    Services run 'await pipeline.serve(handler)'.  One event loop then serves every client connection, with
+    no thread per connection.
+    """
+
+    def __init__(self, own_name, codec=DEFAULT_CODEC):
+        """ Builds the initial address book for the pipeline communication services. """
+        self.address_book = dict(ADDRESS_BOOK)
+        self.name = own_name
+        self.codec = codec              # payload encoding, see message_codec.py
+        self.connections = {}               # {(IP, PORT) or socket path: AsyncConnection}
+        self.connecting = {}                # {(IP, PORT) or socket path: asyncio Lock}, so only one connect runs per service
+        self.request_ids = itertools.count(1)
+        self.server = None
+        self.stats = PipelineStats(own_name)    # traffic and latency counters, see pipeline_stats.py
+
+    async def connect(self, destination) -> AsyncConnection:
+        """ Returns the open connection to a service by name, connecting first if needed. """
+        if destination not in self.address_book:
+            raise KeyError(f"no service named {destination!r} in the address book")
+        address = self.address_book[destination]
+
+        lock = self.connecting.setdefault(address, asyncio.Lock())
+        async with lock:
+            connection = self.connections.get(address)
+            if connection is None or connection.closed:
+                if type(address) == str:
+                    reader, writer = await asyncio.open_unix_connection(address)
+                else:
+                    reader, writer = await asyncio.open_connection(*address)
+                connection = AsyncConnection(reader, writer, address, self.codec)
+                self.connections[address] = connection
+        return connection
+
+    async def send(self, destination, data) -> bool:
+        """ Sends a one-way message to a service by name. Returns False for an unknown service. """
+        if destination not in self.address_book:
+            return False
+
+        # If a reused connection turns out to be dead, reconnect once and resend
+        action = action_of(data)
+        for attempt in range(2):
+            connection = await self.connect(destination)
+            try:
+                size = await connection.send(data)
+            except OSError:
+                await connection.close()
+                if attempt:
+                    self.stats.record_failure((destination, action))
+                    raise
+                continue
+            self.stats.record_send((destination, action), size)
+            return True
+
+    async def request(self, destination, data, timeout=None):
+        """
+        Sends a request to a service and waits for its reply.
+
+        :param timeout: seconds to wait for the reply, or None to wait forever
+        :return: whatever the service replied with
+        """
+        # ids are 32 bits on the wire and 0 is reserved for one-way messages
+        request_id = next(self.request_ids) % 0xFFFFFFFF + 1
+        action = action_of(data)
+        connection = await self.connect(destination)
+        started = time.perf_counter()
+        try:
+            reply, size_out, size_in = await asyncio.wait_for(connection.request(data, request_id), timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.stats.record_failure((destination, action))
+            raise
+        self.stats.record_request((destination, action), size_out, size_in, time.perf_counter() - started)
+        return reply
+
+    async def batch(self, destination, messages, timeout=None) -> list:
+        """
+        Sends several action messages to one service in a single round trip (see Pipeline.batch).
+        :return: list of replies, one per message, in order
+        """
+        return await self.request(destination, make_batch(messages), timeout)
+
+    async def serve(self, handler, backlog=256) -> None:
+        """
+        Listens on this service's address book port and hands every message to 'handler' until cancelled.
+
+        :param handler: function or coroutine function taking a message.  Its return value is sent back as the
+                        reply when the message was a request; replies to one-way messages are dropped.
+        :param backlog: how many not-yet-accepted connections the OS will hold for us
+        """
+
+        async def handle_client(reader, writer):
+            # Messages on one connection are handled in order, so a sender's one-way messages never overtake
+            # each other.  Separate connections are served concurrently.
+            try:
+                while True:
+                    request_id, message, size = await read_frame(reader, self.codec)
+                    arrived = time.perf_counter()
+                    action = action_of(message)
+                    if action == 'stats':
+                        # answered here for every service, like Pipeline.receive() does
+                        reply = self.stats.snapshot(self.address_book)
+                    else:
+                        reply = handler(message)
+                        if asyncio.iscoroutine(reply):
+                            reply = await reply
+                    if request_id != ONE_WAY:
+                        frame = encode_frame(reply, request_id, self.codec)
+                        writer.writelines(frame)
+                        await writer.drain()
+                        self.stats.record_answer(action, size, sum(len(buffer) for buffer in frame),
+                                                 time.perf_counter() - arrived)
+                    else:
+                        self.stats.record_receive(action, size)
+            except (EOFError, asyncio.CancelledError):
+                # client hung up, or the server is shutting down
+                pass
+            except (OSError, ValueError, pickle.UnpicklingError) as error:
+                print(f"ERROR...dropping connection after a bad frame: {error}")
+            finally:
+                writer.close()
+
+        address = self.address_book[self.name]        # sets own address based on object name
+        if type(address) == str:
+            if os.path.exists(address):
+                # left behind by an earlier run
+                os.unlink(address)
+            self.server = await asyncio.start_unix_server(handle_client, address, backlog=backlog)
+        else:
+            host, port = address
+            self.server = await asyncio.start_server(handle_client, host, port, backlog=backlog, reuse_address=True)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self, dump_stats=False) -> None:
+        """
+        Closes every open connection, and stops serving.
+        :param dump_stats: also print the traffic and latency counters, e.g. when a service shuts down
+        """
+        if dump_stats:
+            print(self.stats.report(self.address_book))
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        connections = list(self.connections.values())
+        self.connections = {}
+        for connection in connections:
+            await connection.close()
@@ -4,33 +4,69 @@
 # Description: Provides User Interface for Main Project, also serves as a mini monolith content manager
 
 # ---------- Imports ----------
+import operator
 import pickle
-import random
+import queue
 import os
+import sys
+import threading
 import time
-from Pipeline import Pipeline
+from Pipeline import Pipeline, make_batch
+from library_journal import LibraryJournal
+from library_recycle import RECYCLE_PATH, RecycleBin
+from library_search import PAGE_SIZE, BKTree, Completions, SearchResults
 from datetime import datetime as dt
 from datetime import timedelta as delta
 
 # ---------- Classes ----------
 
+def shared_text(value):
+    """ Returns the one shared copy of a string (sys.intern), so books by the same author etc. don't each
+        hold their own copy.  Anything that is not a string is returned unchanged. """
+    return sys.intern(value) if type(value) == str else value
+
 class Book:
+    # A fixed set of attributes instead of a per-book __dict__...a big library holds a lot of books
+    __slots__ = ('title', 'author', 'isbn', 'serial', 'year', 'publisher', 'price', 'rating', 'summary',
+                 'checked_out')
+    values_of = operator.attrgetter(*__slots__)     # book -> tuple of its attributes, see get_values
+
     def __init__(self, title, author, isbn, year, publisher, price):
         """initializes a new network monitor.
             All numbers EXCEPT the serial number (string) and price (float) are integers"""
 
-        self.title = title          # string
-        self.author = author        # string
+        self.title = shared_text(title)             # string
+        self.author = shared_text(author)           # string
         self.isbn = isbn            # this number is an Integer
         self.serial = None          # string which gets assigned by Library once 'added'
         self.year = year            # integer
-        self.publisher = publisher  # string
+        self.publisher = shared_text(publisher)     # string
         self.price = price          # integer
         self.rating = None          # integer
         self.summary = None         # string
         self.checked_out = False
 
+    def __setstate__(self, state):
+        """ Loads a pickled Book, either slotted (None, {attribute: value}) or from before Book had __slots__. """
+        if type(state) == tuple:
+            state = state[1]
+        for attribute, value in state.items():
+            if attribute in ('title', 'author', 'publisher'):
+                value = shared_text(value)
+            setattr(self, attribute, value)
+
+    @classmethod
+    def from_values(cls, values):
+        """ Builds a Book from the tuple get_values() returns. """
+        book = cls.__new__(cls)
+        book.__setstate__(dict(zip(cls.__slots__, values)))
+        return book
+
     # ----- METHODS -----
+    def get_values(self) -> tuple:
+        """ Returns all the book's attributes as a tuple, in __slots__ order (quicker to pickle than the Book) """
+        return self.values_of(self)
+
     def get_info(self):
         """Returns the book's main attributes as a dictionary"""
 
@@ -92,7 +128,7 @@ class Book:
         """
 
         # check that the old value is a valid book attribute
-        if old in vars(self).keys:
+        if old in self.__slots__:
             # check that the supplied new value is the same type as the old value
             if type(getattr(self, old)) == type(new):
                 setattr(self, old, new)
@@ -102,16 +138,361 @@ class Book:
         else:
             return False
 
+class SearchIndex:
+    """
+    Finds the titles (or author names) that contain a piece of text, without checking all of them.
+
+    Each title is listed under each of its words, and each distinct word under its trigrams: the 3-character
+    pieces of the word with a space added at both ends, so ' Potter ' gives ' Po', 'Pot', 'ott', 'tte', 'ter'
+    and 'er '.  A fragment like 'otte' is then only compared with the few words that contain its rarest
+    trigram, and only titles using those words are checked for the whole search term.  The spaces make the
+    start and end of a word searchable too ('Pot' at the end of a term must start a word: ' Pot').
+    """
+
+    def __init__(self):
+        """ Starts empty. """
+        self.words = {}                 # word: set of the keys containing it
+        self.trigrams = {}              # trigram: set of the words containing it
+        self.fuzzy = None               # BKTree of the keys, built by the first closest() and kept up to date
+        self.completions = None         # Completions of the keys, built by the first complete() and kept up to date
+
+    def __getstate__(self):
+        """ Pickles the index without its BK-tree and completions, which are rebuilt if needed again. """
+        state = dict(self.__dict__)
+        state['fuzzy'] = None
+        state['completions'] = None
+        return state
+
+    def __setstate__(self, state):
+        """ Loads a pickled index (from before the BK-tree and completions too). """
+        self.__dict__.update(state)
+        self.__dict__.setdefault('fuzzy', None)
+        self.__dict__.setdefault('completions', None)
+
+    def keys(self) -> set:
+        """ Every title (or author name) in the index. """
+        return set().union(*self.words.values())
+
+    @staticmethod
+    def trigrams_of(text) -> set:
+        """ The distinct 3-character pieces of a string. """
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, key) -> None:
+        """ Makes a title or author name findable.  Adding one twice does nothing. """
+        if self.fuzzy is not None:
+            self.fuzzy.add(key)
+        if self.completions is not None:
+            self.completions.add(key)
+        for word in key.split():
+            keys = self.words.get(word)
+            if keys is None:
+                keys = self.words[word] = set()
+                for trigram in self.trigrams_of(f" {word} "):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+            keys.add(key)
+
+    def add_many(self, keys) -> None:
+        """ Makes many new titles or author names findable: add() for each, with the lookups hoisted. """
+        if self.completions is not None:
+            self.completions.add_many(keys)
+        words = self.words
+        trigrams = self.trigrams
+        trigrams_of = self.trigrams_of
+        for key in keys:
+            if self.fuzzy is not None:
+                self.fuzzy.add(key)
+            for word in key.split():
+                keys_with_word = words.get(word)
+                if keys_with_word is None:
+                    keys_with_word = words[word] = set()
+                    for trigram in trigrams_of(f" {word} "):
+                        words_with_trigram = trigrams.get(trigram)
+                        if words_with_trigram is None:
+                            trigrams[trigram] = {word}
+                        else:
+                            words_with_trigram.add(word)
+                keys_with_word.add(key)
+
+    def remove(self, key) -> None:
+        """ Forgets a title or author name, and any of its words nothing else uses. """
+        if self.fuzzy is not None:
+            self.fuzzy.remove(key)
+        if self.completions is not None:
+            self.completions.remove(key)
+        for word in key.split():
+            keys = self.words.get(word)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.words[word]
+                for trigram in self.trigrams_of(f" {word} "):
+                    words = self.trigrams[trigram]
+                    words.discard(word)
+                    if not words:
+                        del self.trigrams[trigram]
+
+    def closest(self, term, k=5, max_distance=2) -> list:
+        """
+        The k titles (or author names) with the fewest typing differences from 'term', if within max_distance
+        edits, nearest first.  The first call builds the BK-tree.
+        """
+        if self.fuzzy is None:
+            self.fuzzy = BKTree(self.keys())
+        return self.fuzzy.closest(term, k, max_distance)
+
+    def complete(self, prefix, k, weight) -> list:
+        """
+        The k titles (or author names) starting with 'prefix', heaviest first (see Completions.complete).  The
+        first call builds the sorted list.
+        """
+        if self.completions is None:
+            self.completions = Completions(self.keys())
+        return self.completions.complete(prefix, k, weight)
+
+    def changed(self, key) -> None:
+        """ A key's number of books changed: its ranking among completions has to be worked out again. """
+        if self.completions is not None:
+            self.completions.changed(key)
+
+    def words_like(self, pattern) -> list:
+        """
+        The indexed words that contain 'pattern' once written with spaces around them, e.g. ' Pot' finds the
+        words starting with 'Pot'.  Uses the rarest trigram of the pattern, or looks at every word if the
+        pattern is too short to have one.
+        """
+        trigrams = self.trigrams_of(pattern)
+        if trigrams:
+            candidates = min((self.trigrams.get(trigram, ()) for trigram in trigrams), key=len)
+        else:
+            candidates = self.words
+        return [word for word in candidates if pattern in f" {word} "]
+
+    def find(self, term, catalogue) -> list:
+        """
+        Every key of a catalogue that contains 'term', the same as checking each one with 'in'.
+
+        A key containing the term must contain each of the term's words in place: the first word at the end
+        of one of its words, the last at the start of one, and those between as whole words (a single-word
+        term can be anywhere inside a word).  Only the keys listed under such words are checked.
+        :param term: the text being searched for, as typed
+        :param catalogue: the titles or authors dictionary this index covers
+        :return: the matching keys
+        """
+
+        words = term.split()
+        if not words:
+            # nothing but whitespace (or nothing at all)...no words to narrow by
+            return [key for key in catalogue if term in key]
+
+        candidates = None
+        last = len(words) - 1
+        # look up whole words first, they narrow the candidates the most for the least work
+        for position in sorted(range(len(words)), key=lambda i: not 0 < i < last):
+            word = words[position]
+            if 0 < position < last:
+                found = self.words.get(word, ())
+            else:
+                pattern = word if last == 0 else (f"{word} " if position == 0 else f" {word}")
+                found = set().union(*(self.words[known] for known in self.words_like(pattern)))
+            candidates = set(found) if candidates is None else candidates.intersection(found)
+            if not candidates:
+                return []
+
+        return [key for key in candidates if term in key]
+
 class Library:
     def __init__(self):
         """initializes a new network monitor"""
-        self.authors = {}                       # authors map to a list of serial numbers
-        self.titles = {}                        # titles map to list of serial numbers
+        self.authors = {}                       # authors map to a set of serial numbers
+        self.titles = {}                        # titles map to a set of serial numbers
         self.serials = {}                       # *** MAIN COLLECTION *** ...... serial number to book object
-        self.recycled = {}                      # keys are serial numbers, values are filename strings
+        self.recycled = {}                      # keys are serial numbers, values are the recycle file they went to
         self.banner = ""                        # Banner at main menu with admin notes and update information
+        self.title_index = SearchIndex()        # finds titles by any part of them
+        self.author_index = SearchIndex()       # finds author names by any part of them
+        self.serial_counters = {}               # serial prefix: the next number to try for it
+        self.journal = None                     # LibraryJournal recording each change, if there is one
+        self.journal_seq = 0                    # the last journal record included when this copy was saved
+        self.recycle_bin = None                 # RecycleBin holding the deleted books (opened by open_library)
+        self.checked_out = set()                # serial numbers of the books checked out
+        self.out_by_title = {}                  # title: how many of its copies are checked out (if any are)
+        self.out_by_author = {}                 # author: how many of their books are checked out (if any are)
+
+    def __getattr__(self, name):
+        """
+        Only called for a missing attribute: a Library opened from a catalogue file (library_catalogue.py) reads
+        its title and author catalogues the first time one of them is used.
+        """
+        if name not in ('titles', 'authors', 'title_index', 'author_index') or \
+                'load_catalogues' not in self.__dict__:
+            raise AttributeError(name)
+        self.__dict__.update(self.__dict__.pop('load_catalogues')())
+        return self.__dict__[name]
+
+    def __getstate__(self):
+        """
+        Pickles everything but the open journal and recycle bin (reading in all of a Library opened from a
+        catalogue file).
+        """
+        state = dict(self.__dict__)
+        if 'load_catalogues' in state:
+            del state['load_catalogues']
+            state.update({name: getattr(self, name) for name in ('titles', 'authors', 'title_index', 'author_index')})
+        if type(self.serials) != dict:
+            state['serials'] = dict(self.serials)
+        state['journal'] = None
+        state['recycle_bin'] = None
+        return state
+
+    def __setstate__(self, state):
+        """
+        Loads a pickled Library, building the search indexes and checkout counts if it was saved before they
+        existed, and turning the single serials older versions kept per title and author into sets.
+        """
+        self.__dict__.update(state)
+        self.__dict__.setdefault('serial_counters', {})
+        self.__dict__.setdefault('journal', None)
+        self.__dict__.setdefault('journal_seq', 0)
+        self.__dict__.setdefault('recycle_bin', None)
+        for catalogue in (self.titles, self.authors):
+            for key, serials in catalogue.items():
+                if type(serials) == str:
+                    catalogue[key] = {serials}
+        if 'title_index' not in state:
+            self.title_index = SearchIndex()
+            self.author_index = SearchIndex()
+            for title in self.titles:
+                self.title_index.add(title)
+            for author in self.authors:
+                self.author_index.add(author)
+        if 'checked_out' not in state:
+            self.count_checkouts()
 
     # ----- METHODS -----
+    def record(self, *change) -> None:
+        """ Passes a change to the journal (if any), so it is saved without re-pickling the whole Library. """
+        if self.journal is not None:
+            self.journal.append(change)
+
+    def apply(self, change) -> None:
+        """ Makes a change read back from the journal, the same way it was first made. """
+        kind, argument = change
+        if kind == 'insert':
+            self.insert_book(argument)
+        elif kind == 'remove':
+            self.remove_book(argument)
+        elif kind == 'checkout':
+            self.checkout(argument)
+        elif kind == 'checkin':
+            self.checkin(argument)
+        elif kind == 'banner':
+            self.set_banner(argument)
+        elif kind == 'import':
+            self.place_books([Book.from_values(values) for values in argument])
+        else:
+            raise ValueError(f"unknown library journal change {kind!r}")
+
+    @staticmethod
+    def file_under(catalogue, index, key, serial) -> None:
+        """ Lists a serial under a title or author, making the key searchable if it is new. """
+        serials = catalogue.get(key)
+        if serials is None:
+            serials = catalogue[key] = set()
+            index.add(key)
+        else:
+            index.changed(key)
+        serials.add(serial)
+
+    @staticmethod
+    def unfile(catalogue, index, key, serial) -> None:
+        """ Takes a serial off a title or author, dropping the key once no book is listed under it. """
+        serials = catalogue.get(key)
+        if serials is None:
+            return
+        serials.discard(serial)
+        if not serials:
+            del catalogue[key]
+            index.remove(key)
+        else:
+            index.changed(key)
+
+    def search_titles(self, term) -> list:
+        """
+        Finds the books whose titles contain a search term (the same matches as checking every title).
+        :param term: a title or part of one
+        :return: a list of serial numbers
+        """
+        return [serial for title in self.title_index.find(term, self.titles) for serial in self.titles[title]]
+
+    def search_authors(self, term) -> list:
+        """
+        Finds the books whose author names contain a search term (the same matches as checking every author).
+        :param term: an author name or part of one
+        :return: a list of serial numbers
+        """
+        return [serial for author in self.author_index.find(term, self.authors) for serial in self.authors[author]]
+
+    def closest_titles(self, term, k=5, max_distance=2) -> list:
+        """
+        Finds titles despite spelling mistakes.
+        :return: up to k titles within max_distance edits of the term, nearest first
+        """
+        return self.title_index.closest(term, k, max_distance)
+
+    def closest_authors(self, term, k=5, max_distance=2) -> list:
+        """
+        Finds author names despite spelling mistakes.
+        :return: up to k author names within max_distance edits of the term, nearest first
+        """
+        return self.author_index.closest(term, k, max_distance)
+
+    def complete_title(self, prefix, k=10) -> list:
+        """
+        Type-ahead for titles.
+        :return: up to k titles starting with the prefix (ignoring case), those with the most copies first
+        """
+        return self.title_index.complete(prefix, k, lambda title: len(self.titles.get(title, ())))
+
+    def complete_author(self, prefix, k=10) -> list:
+        """
+        Type-ahead for author names.
+        :return: up to k author names starting with the prefix (ignoring case), those with the most books first
+        """
+        return self.author_index.complete(prefix, k, lambda author: len(self.authors.get(author, ())))
+
+    def search_results(self, field, term, page_size=PAGE_SIZE, available=False) -> SearchResults:
+        """
+        A title or author search whose matching serials are only gathered page by page as they are shown.
+        :param field: 'title' or 'author'
+        :param term: the text being searched for
+        :param available: only find the books that are not checked out
+        :return: SearchResults, with the exact number of matches as its total
+        """
+        if field == 'title':
+            catalogue, index, out = self.titles, self.title_index, self.out_by_title
+        else:
+            catalogue, index, out = self.authors, self.author_index, self.out_by_author
+        keys = index.find(term, catalogue)
+        if not available:
+            serials = (serial for key in keys for serial in list(catalogue.get(key, ())))
+            return SearchResults(serials, sum(len(catalogue[key]) for key in keys), page_size)
+
+        def available_serials():
+            # a title (or author) with no books out is taken whole, one with all its books out is skipped, and
+            # only the rest are checked book by book
+            for key in keys:
+                books = list(catalogue.get(key, ()))
+                gone = out.get(key, 0)
+                if not gone:
+                    yield from books
+                elif gone < len(books):
+                    yield from (serial for serial in books if serial not in self.checked_out)
+
+        return SearchResults(available_serials(), sum(len(catalogue[key]) - out.get(key, 0) for key in keys),
+                             page_size)
+
     def insert_book(self, in_book):
         """
         Takes a book as a parameter, then adds the book to the collection, de-conflicting the serial as well
@@ -119,17 +500,38 @@ class Library:
         :return: None
         """
 
-        available = False
-        while not available:
-            if in_book.get_serial() not in self.serials.keys():
-                self.serials[in_book.get_serial()] = in_book
-                self.titles[in_book.get_title()] = in_book.get_serial()
-                self.authors[in_book.get_author()] = in_book.get_serial()
-                available = True
-            else:
-                new_serial = in_book.get_serial()
-                new_serial += '1'
-                in_book.edit('serial', new_serial)
+        # serial taken (or never assigned)? give the book a new one
+        if in_book.get_serial() is None or in_book.get_serial() in self.serials:
+            in_book.serial = self.new_serial(in_book)
+
+        self.serials[in_book.get_serial()] = in_book
+        self.file_under(self.titles, self.title_index, in_book.get_title(), in_book.get_serial())
+        self.file_under(self.authors, self.author_index, in_book.get_author(), in_book.get_serial())
+        self.mark_out(in_book, in_book.checked_out)
+        self.record('insert', in_book)
+
+    def new_serial(self, book) -> str:
+        """
+        Returns an unused serial number for a book: [first 2 title characters] + [first 2 author characters]
+        + [a number].  Each prefix counts up from 0, skipping numbers already in the library or recycle bin,
+        so allocating is O(1) however many books share a prefix (each taken number is skipped at most once).
+        The counters are saved with the library.
+        :param book: the Book needing a serial
+        :return: a serial number string
+        """
+
+        prefix = str(book.title[0:2] + book.author[0:2])
+        number = self.serial_counters.get(prefix, 0)
+        candidate = prefix + str(number)
+        while candidate in self.serials or candidate in self.recycled:
+            number += 1
+            candidate = prefix + str(number)
+        self.serial_counters[prefix] = number + 1
+        return candidate
+
+    def has_book(self, serial) -> bool:
+        """ True if a serial number belongs to a book in the library. """
+        return serial in self.serials
 
     def book_by_serial(self, target) -> Book:
         """
@@ -139,14 +541,14 @@ class Library:
 
     def book_by_author(self, target) -> (Book or bool):
         """
-        Takes an author name string and returns the book object, or False if an error occurs.
+        Takes an author name string and returns one of that author's books, or False if an error occurs.
         :param target: the target parameter is a string of the book author's name
         :return:
         """
 
         # check author is in the authors catalogue
         if target in self.authors.keys():
-            auth_serial = self.authors[target]
+            auth_serial = next(iter(self.authors[target]))
         else:
             return False
 
@@ -155,25 +557,31 @@ class Library:
 
     def book_by_title(self, target) -> (Book or bool):
         """
-        Takes book title string and returns the book object, or False if an error occurs.
+        Takes book title string and returns a book with that title, or False if an error occurs.
         :param target: the target parameter is a string of the book's title
         :return:
         """
 
         # check title is in the library titles catalogue
         if target in self.titles.keys():
-            title_serial = self.titles[target]
+            title_serial = next(iter(self.titles[target]))
         else:
             return False
 
         # return the book object
         return self.serials[title_serial]
 
+    def iter_books(self):
+        """ Yields every book in the library (those of a catalogue file are decoded in turn, not kept). """
+        if hasattr(self.serials, 'iter_books'):
+            return self.serials.iter_books()
+        return iter(self.serials.values())
+
     def info_by_serial(self, target) -> dict:
         """
         Returns a dictionary of all a book's information, accessed by serial number
         """
-        return dict(vars(self.serials[target]))               # returns a dictionary of book attributes
+        return self.serials[target].get_info()               # returns a dictionary of book attributes
 
     def info_by_author(self, auth) -> (dict or bool):
         """
@@ -182,12 +590,12 @@ class Library:
 
         # check the author is in the library
         if auth in self.authors.keys():
-            auth_serial = self.authors[auth]
+            auth_serial = next(iter(self.authors[auth]))
         else:
             return False
 
         # return the book information
-        return dict(vars(self.serials[auth_serial]))
+        return self.serials[auth_serial].get_info()
 
     def info_by_title(self, target_title) -> (dict or bool):
         """
@@ -196,12 +604,12 @@ class Library:
 
         # check the title is in the library
         if target_title in self.titles.keys():
-            title_serial = self.titles[target_title]
+            title_serial = next(iter(self.titles[target_title]))
         else:
             return False
 
         # return the book information
-        return dict(vars(self.serials[title_serial]))
+        return self.serials[title_serial].get_info()
 
     def add_book(self, new) -> None:
         """
@@ -212,84 +620,129 @@ class Library:
         # --- SERIAL ASSIGNMENT ---
         #       assigns a serial number to the book and stores it in the collection(serials)
 
-        # - GENERATE A NEW SERIAL -
-        #       ensure serial is unique, then assign it
-        unique = False
-        candidate_serial = None
-
-        while not unique:
-            # serial format: [first 2 title characters] + [first two author letters] + [random number up to 50k]
-            #   *** serial number is stored as a string value
-            serial_num = str(random.randint(0, 50000))
-            serial_alpha = str(new.title[0:2] + new.author[0:2])
-            candidate_serial = serial_alpha + serial_num
-
-            # has the serial been used before?
-            if candidate_serial not in self.serials.keys():
-                unique = True
-
         # - ASSIGN THE NEW SERIAL TO BOOK -
-        new.serial = candidate_serial
+        #   serial format: [first 2 title characters] + [first two author letters] + [next number for those]
+        #   *** serial number is stored as a string value
+        new.serial = self.new_serial(new)
 
         # - MAP LIBRARY SERIAL TO BOOK -
         self.serials.update({new.serial: new})
 
         # - MAP LIBRARY AUTHOR(S) TO SERIAL -
-        if new.author not in self.authors.keys():
-            self.authors.update({new.author: new.serial})
-        else:
-            self.authors[new.author].append(new.serial)
+        self.file_under(self.authors, self.author_index, new.author, new.serial)
 
         # - MAP LIBRARY TITLE(S) TO SERIAL -
-        if new.title not in self.titles.keys():
-            self.titles.update({new.title: new.serial})
-        else:
-            self.titles[new.title].append(new.serial)
+        self.file_under(self.titles, self.title_index, new.title, new.serial)
+        self.mark_out(new, new.checked_out)
+
+        # - SAVE THE CHANGE -
+        self.record('insert', new)
+
+    def add_books(self, books) -> None:
+        """
+        The bulk form of add_book: assigns each book a new serial number and adds them all to the library,
+        saved as a single change (of the books' values, which pickle much faster than the Books).
+        :param books: a list of Book objects
+        """
+        for book in books:
+            book.serial = self.new_serial(book)
+        self.place_books(books)
+        self.record('import', [book.get_values() for book in books])
+
+    def place_books(self, books) -> None:
+        """
+        Files books that already have their serial numbers under their serials, titles and authors (the bulk
+        form of file_under: new titles and authors are added to the search indexes together at the end).
+        """
+        serials, titles, authors = self.serials, self.titles, self.authors
+        new_titles = []
+        new_authors = []
+        for book in books:
+            serial = book.serial
+            serials[serial] = book
+            listed = titles.get(book.title)
+            if listed is None:
+                titles[book.title] = {serial}
+                new_titles.append(book.title)
+            else:
+                listed.add(serial)
+                self.title_index.changed(book.title)
+            listed = authors.get(book.author)
+            if listed is None:
+                authors[book.author] = {serial}
+                new_authors.append(book.author)
+            else:
+                listed.add(serial)
+                self.author_index.changed(book.author)
+            if book.checked_out:
+                self.mark_out(book, True)
+        self.title_index.add_many(new_titles)
+        self.author_index.add_many(new_authors)
 
     def delete_book(self, target) -> str:
         """
-        Removes a book from the library, and stores it in the 'Recycle_Bin' JSON file.
+        Removes a book from the library, and stores it in the recycle bin (library.recycle).
             *** takes a serial number as an input parameter
 
         :param target: must be a book's serial number
-        :return: the filename of the recycled book file
+        :return: the filename of the recycle bin
         """
 
-        # - GET THE DELETION TARGET'S TITLE AND AUTHOR STRINGS -
-        del_author = self.serials[target].author
-        del_title = self.serials[target].title
+        # - RECYCLE THE BOOK, before the deletion is recorded, so a crash can't lose it -
+        if self.recycle_bin is None:
+            self.recycle_bin = RecycleBin(RECYCLE_PATH, Book)
+        self.recycle_bin.put(self.serials[target])
 
-        # - RECYCLE THE BOOK to a PICKLE FILE-
-        #   *** Restoration NOTE: Pickle file will be named as the deleted book's serial number
+        # - TAKE THE BOOK OUT OF THE COLLECTION, AND SAVE THE CHANGE -
+        self.remove_book(target)
+        self.record('remove', target)
 
-        # create a binary output file - filename is the book serial number
-        try:
-            with open(f"{target}.pickle", 'wb') as outfile:
-                pickle.dump(self.serials[target], outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        # return the name of the recycle file
+        return self.recycle_bin.path
 
-        # $$$ TESTING $$$: provide info about errors
-        except AttributeError:
-            return 'FAIL-Attribute'
-        except EOFError:
-            return 'FAIL-EOF'
-        except IndexError:
-            return 'FAIL-Index'
+    def restore_book(self, serial):
+        """
+        Puts a book from the recycle bin back in the library (under a new serial if its own has been taken
+        since) and takes it out of the bin.
+        :param serial: the serial the book was deleted under
+        :return: the restored Book
+        """
+        book = self.recycle_bin.get(serial)
+        self.insert_book(book)
+
+        # - MAKE THE RESTORE DURABLE before the bin lets go of the book, so a crash can't lose it -
+        self.save()
+        self.recycle_bin.discard(serial)
+        return book
+
+    def recycled_serials(self) -> list:
+        """ The serial numbers of every book ever deleted (they are never given to another book). """
+        return list(self.recycled)
+
+    def remove_book(self, target) -> None:
+        """
+        The in-memory part of delete_book: takes a book out of the collection and search indexes, and lists it
+        as recycled.  (Also used to replay a deletion from the journal, where the book is already in the recycle bin.)
+        :param target: must be a book's serial number
+        """
+
+        # - GET THE DELETION TARGET'S TITLE AND AUTHOR STRINGS (and stop counting it as checked out) -
+        del_author = self.serials[target].author
+        del_title = self.serials[target].title
+        self.mark_out(self.serials[target], False)
 
         # - DELETE THE BOOK FROM COLLECTION -
         del self.serials[target]
 
-        # - REMOVE THE BOOK AUTHOR FROM LIBRARY AUTHORS -
-        del self.authors[del_author]
+        # - REMOVE THE BOOK FROM ITS AUTHOR (other books by the author stay listed) -
+        self.unfile(self.authors, self.author_index, del_author, target)
 
-        # - REMOVE THE BOOK TITLE FROM LIBRARY TITLES -
-        del self.titles[del_title]
+        # - REMOVE THE BOOK FROM ITS TITLE (other copies stay listed) -
+        self.unfile(self.titles, self.title_index, del_title, target)
 
         # - ADD THE BOOK TO THE RECYCLED LIST -
-        #       KEY: the serial number / VALUE:  the filename
-        self.recycled[target] = f"{target}.pickle"
-
-        # return the name of the recycled file
-        return f"{target}.pickle"
+        #       KEY: the serial number / VALUE:  the recycle file
+        self.recycled[target] = RECYCLE_PATH
 
     def set_banner(self, message):
         """
@@ -299,6 +752,7 @@ class Library:
         """
 
         self.banner = message
+        self.record('banner', message)
 
     def get_banner(self):
         """
@@ -316,8 +770,152 @@ class Library:
         return output
 
     def checkout(self, sn):
-        """ Updates a book in self.serials to set checkout to True. """
-        self.serials[sn].checkout = True
+        """ Updates a book in self.serials to set checked_out to True, and counts it as out. """
+        self.serials[sn].checked_out = True
+        self.mark_out(self.serials[sn], True)
+        self.record('checkout', sn)
+
+    def checkin(self, sn):
+        """ Updates a book in self.serials to set checked_out back to False, and counts it as available. """
+        self.serials[sn].checked_out = False
+        self.mark_out(self.serials[sn], False)
+        self.record('checkin', sn)
+
+    def mark_out(self, book, out) -> None:
+        """
+        Keeps the checked out serials, and the counts of checked out books per title and author, in step with a
+        book being checked out (out=True) or back in / gone from the library (out=False).  Marking a book the
+        way it already is does nothing.
+        """
+        if bool(out) == (book.serial in self.checked_out):
+            return
+        if out:
+            self.checked_out.add(book.serial)
+            step = 1
+        else:
+            self.checked_out.discard(book.serial)
+            step = -1
+        for counts, key in ((self.out_by_title, book.title), (self.out_by_author, book.author)):
+            count = counts.get(key, 0) + step
+            if count:
+                counts[key] = count
+            else:
+                del counts[key]
+
+    def count_checkouts(self) -> None:
+        """ Builds the checked out serials and counts from the books (for a library saved before they existed). """
+        self.checked_out = set()
+        self.out_by_title = {}
+        self.out_by_author = {}
+        for book in self.iter_books():
+            if book.checked_out:
+                self.mark_out(book, True)
+
+    def is_available(self, serial) -> bool:
+        """ True if a serial number belongs to a book in the library that is not checked out. """
+        return serial in self.serials and serial not in self.checked_out
+
+    def checked_out_count(self) -> int:
+        """ The number of books checked out. """
+        return len(self.checked_out)
+
+    def available_count(self) -> int:
+        """ The number of books in the library and not checked out. """
+        return len(self.serials) - len(self.checked_out)
+
+    def available_by_title(self, title) -> int:
+        """ How many copies of a title are not checked out. """
+        return len(self.titles.get(title, ())) - self.out_by_title.get(title, 0)
+
+    def available_by_author(self, author) -> int:
+        """ How many of an author's books are not checked out. """
+        return len(self.authors.get(author, ())) - self.out_by_author.get(author, 0)
+
+    def available_serials(self, field, key) -> list:
+        """
+        The serial numbers of the books with exactly this title (field='title') or author (field='author') that
+        are not checked out.
+        """
+        catalogue, out = (self.titles, self.out_by_title) if field == 'title' else (self.authors, self.out_by_author)
+        serials = catalogue.get(key, ())
+        if not out.get(key):
+            return list(serials)
+        return [serial for serial in serials if serial not in self.checked_out]
+
+    def save(self) -> None:
+        """ Makes sure every change so far is on disk (the journal's next batched fsync, done now). """
+        if self.journal is not None:
+            self.journal.sync()
+
+class LogSender:
+    """
+    Fire-and-forget delivery of log messages to the logging microservice.
+
+    log() only puts the message on a bounded queue.  A background thread takes whatever has built up and
+    sends it in one batch message, so a burst of entries costs one send rather than one each.  If the queue
+    fills (log service down or slow) further entries are dropped and counted rather than blocking the UI.
+    """
+
+    def __init__(self, pipe, max_queued=1000, max_batch=100):
+        """ Starts the sender thread for a Pipeline. """
+        self.pipe = pipe
+        self.queue = queue.Queue(max_queued)
+        self.max_batch = max_batch          # most entries coalesced into one batch message
+        self.dropped = 0                    # entries lost to a full queue or an unreachable log service
+        self.dropped_lock = threading.Lock()    # both the UI thread and the sender thread count drops
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def log(self, message) -> None:
+        """ Queues one log message for sending. """
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.count_dropped(1)
+
+    def count_dropped(self, entries) -> None:
+        """ Counts log entries that will never be delivered. """
+        with self.dropped_lock:
+            self.dropped += entries
+
+    def run(self) -> None:
+        """ Sender thread: sends queued messages, coalesced into batches, until close() is called. """
+        while True:
+            entries = [self.queue.get()]
+            while entries[-1] is not None and len(entries) < self.max_batch:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            finished = entries[-1] is None
+            if finished:
+                entries.pop()
+            if entries:
+                self.transmit(entries)
+            if finished:
+                return
+
+    def transmit(self, entries) -> None:
+        """ Sends a list of log messages, as a single message when there is only one. """
+        message = entries[0] if len(entries) == 1 else make_batch(entries)
+        try:
+            sent = self.pipe.send('log', message)
+        except OSError:
+            # log service unreachable...logging must never take the UI down with it
+            sent = False
+        if not sent:
+            self.count_dropped(len(entries))
+
+    def close(self, timeout=5.0) -> None:
+        """ Sends everything still queued, then stops the sender thread. """
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+        if self.dropped:
+            print(f"WARNING...{self.dropped} log entries could not be delivered")
 
 class Comment:
     def __init__(self, title, subject, text, question) -> (bool or None):
@@ -854,6 +1452,8 @@ def ShowMenu(choice, help_level=2):
         1) Title		        [BASIC: full or partial keyword search by book's Title]
         2) Author		        [BASIC: full or partial keyword search by book's Author]
         3) Library S/N	        [ADVANCED: exact, full serial number is required to be entered]
+        4) Available Title	[BASIC: Title search, only books not checked out]
+        5) Available Author	[BASIC: Author search, only books not checked out]
 
         #RecycleBin		[find/recover recently deleted books]
         #Help			[if you are having trouble or questions]
@@ -873,6 +1473,8 @@ def ShowMenu(choice, help_level=2):
         1) Title Search		            [BASIC: keyword search]
         2) Author Search		        [BASIC: keyword search]
         3) Library S/N Search	        [ADVANCED: full serial number search]
+        4) Available Title Search	[BASIC: keyword search, not checked out]
+        5) Available Author Search	[BASIC: keyword search, not checked out]
 
         #RecycleBin		[find/recover recently deleted books]
         #Help			[if you are having trouble or questions]
@@ -892,6 +1494,8 @@ def ShowMenu(choice, help_level=2):
         1) Title Search		        
         2) Author Search		        
         3) Library S/N Search        
+        4) Available Title Search
+        5) Available Author Search
 
         #RecycleBin / Un-delete		
         #Help			
@@ -1269,8 +1873,7 @@ def fetch_profile_printout(pipe, username) -> str:
     """Takes a username, and returns the user's profile as a string. """
 
     data = {'action': 'get_user_info', 'user_name': username}
-    pipe.send('profile', data)
-    reply = pipe.receive()
+    reply = pipe.request('profile', data)
 
     if reply == 'ERROR':
         return 'ERROR'
@@ -1280,8 +1883,7 @@ def fetch_profile_printout(pipe, username) -> str:
 def fetch_profile(pipe, username) -> dict or bool:
     """ Fetches a dictionary of all profile attributes from the profile service. """
     data = {'action': 'get_user_dict', 'user_name': username}
-    pipe.send('profile', data)
-    reply = pipe.receive()
+    reply = pipe.request('profile', data)
 
     if reply == 'ERROR':
         return False
@@ -1291,7 +1893,7 @@ def fetch_profile(pipe, username) -> dict or bool:
 def delete_profile(pipe, username) -> bool:
     """ Deletes a user profile in the profile service, returns True if successful, False if not so. """
     del_msg = {'action': 'delete_user', 'user_name': username}
-    reply = pipe.send('profile', del_msg)
+    reply = pipe.request('profile', del_msg)
     if reply == 'DELETED':
         return True
     else:
@@ -1307,8 +1909,7 @@ def check_book_out(pipe, username, serial) -> str:
     """ Checks out  a book using the Accounting microservice. """
 
     message = {'action': 'check_out', 'user': username, 'sn': serial}
-    pipe.send('accounting', message)
-    return pipe.receive()
+    return pipe.request('accounting', message)
 
 def check_book_in(pipe, username, serial) -> None:
     """ Checks out  a book using the Accounting microservice. """
@@ -1316,12 +1917,17 @@ def check_book_in(pipe, username, serial) -> None:
     message = {'action': 'check_in', 'user': username, 'sn': serial}
     pipe.send('accounting', message)
 
+def check_books_in(pipe, username, serials) -> None:
+    """ Checks several books back in with the Accounting microservice, in one round trip. """
+
+    messages = [{'action': 'check_in', 'user': username, 'sn': serial} for serial in serials]
+    pipe.batch('accounting', messages)
+
 def get_checkouts(pipe, username) -> dict:
     """ Takes a user, gets their checked out books from Accounting microservice, returns them. """
 
     message = {'action': 'get_checkouts', 'user': username}
-    pipe.send('accounting', message)
-    reply = pipe.receive()
+    reply = pipe.request('accounting', message)
     return reply
 
 def print_checkouts(pipe, username, collection) -> list:
@@ -1342,32 +1948,173 @@ def print_checkouts(pipe, username, collection) -> list:
     print("-------------------------------------------------------------")
     return checkout_list
 
+def browse_results(collection, results) -> None:
+    """
+    Shows search results a page at a time, numbering the books through all the pages ('BOOK NUMBER'), and
+    only fetching and printing the books of the page on screen.
+    """
+    page = 0
+    while True:
+        first = page * results.page_size + 1
+        for number, serial in enumerate(results.page(page), first):
+            print(f"BOOK NUMBER {number}")
+            collection.book_by_serial(serial).view()
+            print("\n")
+        print(f"--- Page {page + 1} of {results.page_count()} ({results.total:,} books) ---")
+        move = input("Type 'n' for the next page, 'p' for the previous one, or hit 'enter' when done: ")
+        if move == 'n' and results.page(page + 1):
+            page += 1
+        elif move == 'p' and page > 0:
+            page -= 1
+        elif move == '':
+            return
+
+def pick_result(results, prompt) -> str:
+    """
+    Asks for a BOOK NUMBER shown by browse_results until one within the results is entered.
+    :return: the serial of the book with that number
+    """
+    while True:
+        number = input(prompt)
+        if number.isdigit() and 1 <= int(number) <= results.total:
+            try:
+                return results[int(number) - 1]
+            except IndexError:
+                pass
+        print(f"There is no book number {number}, enter one from 1 to {results.total:,}...")
+
+def did_you_mean(collection, field, term, available=False):
+    """
+    After a title or author search that found nothing: offers the titles (or authors) closest to the term,
+    in case it was misspelled, and searches for the one the user picks.
+    :param available: only find the books that are not checked out
+    :return: the SearchResults for the pick, or None
+    """
+    close = collection.closest_titles(term) if field == 'title' else collection.closest_authors(term)
+    if not close:
+        return None
+    print(f"No exact matches...did you mean one of these {field}s?")
+    for number, key in enumerate(close, 1):
+        print(f"    {number}: {key}")
+    pick = input("Enter its number to search for it, or hit 'enter' to skip: ")
+    if not pick.isdigit() or not 1 <= int(pick) <= len(close):
+        return None
+    return collection.search_results(field, close[int(pick) - 1], available=available)
+
+def browse_recycle_bin(collection, admin=False):
+    """
+    Lists the recycle bin a page at a time, most recently deleted first, and recovers the book the user picks
+    into the collection.  An admin can also purge the books deleted more than some number of days ago.
+    :return: the recovered Book, or None
+    """
+    recycle_bin = collection.recycle_bin
+    print("You are accessing recycled books.  Recycle Bin contents are: \n")
+    page = 0
+    while True:
+        serials = recycle_bin.page(page)
+        first = page * PAGE_SIZE + 1
+        for number, serial in enumerate(serials, first):
+            book = recycle_bin.get(serial)
+            deleted = dt.fromtimestamp(recycle_bin.deleted_at(serial)).strftime('%Y-%m-%d %H:%M')
+            print(f"[Book # {number}: {book.get_title()} by {book.get_author()} ({serial}), deleted {deleted}]")
+        print(f"--- Page {page + 1} of {recycle_bin.page_count()} ({len(recycle_bin):,} books) ---")
+        prompt = "Enter Book # to select/recover a book, 'n' / 'p' for the next / previous page"
+        if admin:
+            prompt += ", 'purge' to empty out old books"
+        found = input(prompt + ", or '0' to return to Main Menu\n")
+
+        if found == 'n' and recycle_bin.page(page + 1):
+            page += 1
+        elif found == 'p' and page > 0:
+            page -= 1
+        elif found == 'purge' and admin:
+            days = input("Purge the books deleted more than how many days ago? ")
+            if days.isdigit():
+                purged = recycle_bin.purge(int(days) * 24 * 60 * 60)
+                print(f"Purged {purged:,} books from the recycle bin.")
+                page = 0
+        elif found == '0':
+            return None
+        elif found.isdigit() and first <= int(found) < first + len(serials):
+            serial = serials[int(found) - first]
+
+            # Show the book recovery candidate to the user
+            print(f"You have accessed the following book Title: \n")
+            recycle_bin.get(serial).view()
+
+            # Confirm user wishes to recover this book
+            confirm = input("To recover this book to the library, type 'recover', else hit 'enter': ")
+
+            # RECOVER RECYCLED BOOK TO COLLECTION (and take it out of the recycle bin)
+            if confirm == 'recover':
+                book = collection.restore_book(serial)
+                print("SUCCESSFUL RECOVERY!")
+                return book
+
 def save_data(data) -> None:
-    # Save the change to persistent data structure
+    # The change is already in the library journal (or database)...make sure it is on disk now
     try:
-        with open(f"library.pickle", 'wb') as outfile:
-            pickle.dump(data, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        data.save()
 
     # $$$ DEBUGGING $$$: provide info about errors
-    except FileNotFoundError:
+    except OSError:
         print("ERROR SAVING Library data!!!")
 
-def log_event(pipe, user, trigger):
-    """ Sends a user and action with date to the logging microservice to be recorded. """
-    message = {'action': 'log', 'log':{'user': user, 'trigger': trigger}}
-    pipe.send('log', message)
+def log_event(log_sender, user, trigger):
+    """ Queues a user and action to be sent to the logging microservice and recorded.  Never waits on the network. """
+    log_sender.log({'action': 'log', 'log':{'user': user, 'trigger': trigger}})
 
 def view_log(pipe, days_past) -> None:
     """ Displays the log for a day, delineated by the number of days in the past from today. """
     if type(days_past) != int:
         days_past = int(days_past)
     message = {'action': 'view', 'days_past': days_past}
-    pipe.send('log', message)
-    report = pipe.receive()
+    report = pipe.request('log', message)
     print("------------------- LOG VIEWER -------------------------")
     print(report)
     print("--------------------------------------------------------")
 
+def open_library():
+    """
+    Opens the Library with the backend named by the CS361_LIBRARY_BACKEND environment variable:
+        pickle (default): library.pickle, the last snapshot, plus library.journal, the changes since...the
+                          whole catalogue is loaded into memory
+        mapped:           library.catalogue plus library.journal...the catalogue is memory-mapped and each book
+                          read when first used (python library_catalogue.py copies library.pickle into it)
+        sqlite:           library.db, queried as needed (python library_sqlite.py copies library.pickle into it)
+    :return: (the library, the object to close() on exit)
+    """
+    backend = os.environ.get('CS361_LIBRARY_BACKEND', 'pickle')
+    if backend == 'sqlite':
+        from library_sqlite import SqliteLibrary
+        collection = SqliteLibrary('library.db', Book)
+        open_recycle_bin(collection)
+        return collection, collection
+    if backend == 'mapped':
+        from library_catalogue import CatalogueFormat
+        journal = LibraryJournal('library.catalogue', 'library.journal',
+                                 snapshot_format=CatalogueFormat(Book, Library))
+    elif backend == 'pickle':
+        journal = LibraryJournal('library.pickle', 'library.journal')
+    else:
+        raise ValueError(f"unknown CS361_LIBRARY_BACKEND {backend!r} (use 'pickle', 'mapped' or 'sqlite')")
+
+    # access and load the collection if one exists (the last snapshot plus the journal of changes since),
+    # or make a blank Library Object for it
+    collection = journal.load(Library)
+    open_recycle_bin(collection)
+    return collection, journal
+
+def open_recycle_bin(collection) -> None:
+    """
+    Opens the recycle bin (library.recycle) for a library.  The first time, the books older versions recycled
+    as one <serial>.pickle file each are moved into it.
+    """
+    fresh = not os.path.exists(RECYCLE_PATH)
+    collection.recycle_bin = RecycleBin(RECYCLE_PATH, Book)
+    if fresh:
+        collection.recycle_bin.adopt_files(collection.recycled_serials())
+
 # ---------- Main: User Interface ----------
 def main():
     """
@@ -1388,26 +2135,23 @@ def main():
     title_banner()
 
     # ----- DATA LOAD -----
-    # access and load the collection if one exists
-    try:
-        with open('library.pickle', "rb") as infile:
-            collection = pickle.load(infile)
-
-    # No library yet? make a blank Library Object for it
-    except FileNotFoundError:
-        collection = Library()
+    # open the collection with the configured backend (CS361_LIBRARY_BACKEND)...from here on each change is
+    # saved as it is made
+    collection, storage = open_library()
 
     # ----- OBJECT INSTANTIATION -----
     # Initialize the help and Microservice communications systems
     help_sys = Help()
-    pipe = Pipeline('core')
+    pipe = Pipeline('core')         # replies come back on the request's own connection, no listening needed
+    pipe.attach_ring('log')         # log entries go through shared memory if the log service offers it
+    log_sender = LogSender(pipe)    # sends log entries in the background, so the menus never wait on logging
 
     # ----- LOGIN  -----
     logged_in_user = login(pipe)
     if not logged_in_user:
         # User exited program at login screen
         return
-    log_event(pipe, logged_in_user['u_name'], 'LOGGED IN')
+    log_event(log_sender, logged_in_user['u_name'], 'LOGGED IN')
 
     # ----- PROFILE -----
     current_profile = fetch_profile(pipe, logged_in_user['u_name'])
@@ -1473,14 +2217,14 @@ def main():
 
                 # VIEW PROFILE
                 elif selection == '1':
-                    log_event(pipe, logged_in_user['u_name'], 'VIEWED PROFILE')
+                    log_event(log_sender, logged_in_user['u_name'], 'VIEWED PROFILE')
                     reply = fetch_profile_printout(pipe, logged_in_user['u_name'])
                     print(f"\n{reply}\n")
                     continue
 
                 # EDIT PROFILE
                 elif selection == '2':
-                    log_event(pipe, logged_in_user['u_name'], 'EDITED PROFILE')
+                    log_event(log_sender, logged_in_user['u_name'], 'EDITED PROFILE')
                     print("""
                     Enter the number of the setting you want to change:
                         1) first name
@@ -1549,21 +2293,25 @@ def main():
 
                 # Check book back in
                 if selection == '1':
-                    log_event(pipe, logged_in_user['u_name'], 'CHECKED IN BOOK')
+                    log_event(log_sender, logged_in_user['u_name'], 'CHECKED IN BOOK')
 
                     checked = print_checkouts(pipe, logged_in_user['u_name'], collection)
-                    in_target = int(input("Enter the number of the book to check back in..."))
-                    in_target -= 1      # adjust to align to array/list index 0
-                    if (in_target < len(checked)) and (in_target >= 0):
-                        collection.serials[checked[in_target]].checked_out = False
-                        check_book_in(pipe, logged_in_user['u_name'], checked[in_target])
+                    in_targets = input("Enter the number of the book to check back in "
+                                       "(several may be separated by commas)...")
+                    # adjust each to align to array/list index 0
+                    in_targets = [int(number) - 1 for number in in_targets.split(',') if number.strip()]
+                    if in_targets and all((0 <= in_target < len(checked)) for in_target in in_targets):
+                        returning = [checked[in_target] for in_target in in_targets]
+                        for sn in returning:
+                            collection.checkin(sn)
+                        check_books_in(pipe, logged_in_user['u_name'], returning)
                     else:
                         print("ERROR: book chosen does not exist! Try again...")
                         continue
 
                 # View checked out books
                 elif selection == '2':
-                    log_event(pipe, logged_in_user['u_name'], 'VIEWED CHECKED OUT BOOKS')
+                    log_event(log_sender, logged_in_user['u_name'], 'VIEWED CHECKED OUT BOOKS')
 
                     print_checkouts(pipe, logged_in_user['u_name'], collection)
 
@@ -1576,7 +2324,7 @@ def main():
 
         # --- SEARCH FOR BOOK---
         elif choice == '3':
-            log_event(pipe, logged_in_user['u_name'], 'SEARCHED FOR BOOK')
+            log_event(log_sender, logged_in_user['u_name'], 'SEARCHED FOR BOOK')
             # CHOICE LOOP
             while True:
                 # Show the user the Search menu
@@ -1602,78 +2350,48 @@ def main():
                 # ACCESS RECYCLE BIN
                 if selection == ('RecycleBin' or 'recyclebin' or 'Recyclebin' or '#RecycleBin'):
 
-                    pickled_files = os.listdir()
-
-                    # Find all pickled files in local directory of UI/CMS Monolith
-                    pickled_only = []
-                    for f in pickled_files:
-                        if f.endswith(".pickle"):
-                            pickled_only.append(f)
-
-                    # Present user with available recycled files
-                    print("You are accessing recycled books.  Recycle Bin contents are: \n")
-
-                    # list all pickle files
-                    counter = 0
-                    for f in pickled_only:
-                        counter += 1
-                        print(f"[File # {counter}: {f}")
-
-                    # prompt user to select a recycled book or return to main
-                    found = int(input("Enter File # to select/recover a file, or enter '0' to return to Main Menu\n"))
-                    if found == 0:
-                        continue
-                    else:
-                        # access and load the specified recycled pickle file
-                        try:
-                            with open(pickled_only[found - 1], "rb") as infile:
-                                recover_file = pickle.load(infile)
-
-                        # Provide info about errors
-                        except AttributeError:
-                            return 'FAIL-Attribute'
-                        except EOFError:
-                            return 'FAIL-EOF'
-                        except IndexError:
-                            return 'FAIL-Index'
-
-                        # Show the book recovery candidate to the user
-                        print(f"You have accessed the following book Title: \n")
-                        recover_file.view()
-
-                        # Confirm user wishes to recover this book
-                        confirm = input("To recover this book to the library, type 'recover', else hit 'enter': ")
-
-                        # RECOVER RECYCLED FILE TO COLLECTION
-                        if confirm == 'recover':
-                            log_event(pipe, logged_in_user['u_name'], 'RECOVERED A BOOK')
-
-                            # insert the book back into the collection
-                            collection.insert_book(recover_file)
-                            print("SUCCESSFUL RECOVERY!")
-
-                            # delete the recovered pickle file
-                            print(f"deleting {recover_file.get_serial()}.pickle...")
-                            os.remove(f"{recover_file.get_serial()}.pickle")
-
-                        else:
-                            continue
+                    restored = browse_recycle_bin(collection, logged_in_user['u_name'] == 'admin')
+                    if restored is not None:
+                        log_event(log_sender, logged_in_user['u_name'], 'RECOVERED A BOOK')
+                    continue
 
                 # TITLE SEARCH
                 if selection == '1':
                     search_term = input("Type the title, or partial title of the book you want to find: ")
-                    matches = [sn for titles, sn in collection.titles.items() if search_term in titles]
+                    matches = collection.search_results('title', search_term)
+                    if not matches:
+                        matches = did_you_mean(collection, 'title', search_term) or matches
 
                 # AUTHOR SEARCH
                 elif selection == '2':
                     search_term = input("Type the Author name, or partial name of the book you want to find: ")
-                    matches = [sn for authors, sn in collection.authors.items() if search_term in authors]
+                    matches = collection.search_results('author', search_term)
+                    if not matches:
+                        matches = did_you_mean(collection, 'author', search_term) or matches
+
+                # TITLE SEARCH, only the books not checked out
+                elif selection == '4':
+                    search_term = input("Type the title, or partial title of the book you want to find: ")
+                    matches = collection.search_results('title', search_term, available=True)
+                    if not matches and collection.search_results('title', search_term):
+                        print("Every book with a matching title is checked out.")
+                    elif not matches:
+                        matches = did_you_mean(collection, 'title', search_term, available=True) or matches
+
+                # AUTHOR SEARCH, only the books not checked out
+                elif selection == '5':
+                    search_term = input("Type the Author name, or partial name of the book you want to find: ")
+                    matches = collection.search_results('author', search_term, available=True)
+                    if not matches and collection.search_results('author', search_term):
+                        print("Every book by a matching author is checked out.")
+                    elif not matches:
+                        matches = did_you_mean(collection, 'author', search_term, available=True) or matches
 
                 # SERIAL SEARCH
                 elif selection == '3':
                     search_term = input("Type the exact Library serial number of the book you want to find:  ")
-                    if search_term in collection.serials.keys():
-                        match = collection.serials[search_term]
+                    if collection.has_book(search_term):
+                        match = collection.book_by_serial(search_term)
                     else:
                         input("Serial not found, press 'enter' to continue...")
                         continue
@@ -1699,7 +2417,7 @@ def main():
                         else:
                             out = input("Book is available for checkout, do you want to check it out? (1: yes, 2: no")
                             if out == '1':
-                                log_event(pipe, logged_in_user['u_name'], 'CHECKED OUT BOOK')
+                                log_event(log_sender, logged_in_user['u_name'], 'CHECKED OUT BOOK')
                                 # Update library
                                 collection.checkout(search_term)
                                 # Update Accounting Microservice
@@ -1712,27 +2430,21 @@ def main():
                 # Display matching books to user
                 print("Your search yielded the following results: \n")
 
-                # 'order' assigns a 1-up number to each book in the list to aid in identification
+                # each book is numbered 1-up through all the pages to aid in identification
 
                 # SEARCH RESULT for Title and Author search
-                order = 0
                 if matches:
-                    for i in matches:
-                        print(f"BOOK NUMBER {order + 1}")
-                        collection.book_by_serial(i).view()
-                        print("\n")
-                        order += 1
+                    browse_results(collection, matches)
 
                     found_it = int(input("Is the book you're looking for in the results? (1: yes / 2: no)  "))
                     if found_it == 1:
-                        acquired = int(input("Enter the BOOK NUMBER of the book you want to view: "))
+                        selected_serial = pick_result(matches, "Enter the BOOK NUMBER of the book you want to view: ")
                         print("This is the book title you have selected: \n")
-                        print(collection.book_by_serial(matches[acquired - 1]).get_title())
-                        selected_serial = matches[acquired - 1]
+                        print(collection.book_by_serial(selected_serial).get_title())
                         acquisition = int(input("Is this the book you want to view? (1: yes / 2: no)"))
                         if acquisition == 1:
                             print("Displaying your book information now...\n")
-                            selected_book = collection.book_by_serial(matches[acquired - 1])
+                            selected_book = collection.book_by_serial(selected_serial)
                             selected_book.view()
 
                             # --- CHECK OUT BOOK? ---
@@ -1742,7 +2454,7 @@ def main():
                                 out = input(
                                     "Book is available for checkout, do you want to check it out? (1: yes, 2: no")
                                 if out == '1':
-                                    log_event(pipe, logged_in_user['u_name'], 'CHECKED OUT BOOK')
+                                    log_event(log_sender, logged_in_user['u_name'], 'CHECKED OUT BOOK')
                                     # Update library
                                     collection.checkout(selected_serial)
                                     # Update Accounting Microservice
@@ -1783,7 +2495,7 @@ def main():
 
         # --- GET HELP ---
         elif choice == '4':
-            log_event(pipe, logged_in_user['u_name'], 'ACCESSED HELP SYSTEM')
+            log_event(log_sender, logged_in_user['u_name'], 'ACCESSED HELP SYSTEM')
             """Help Menu: 
                 This is the help menu, please select from the options below:
                     1) FAQs			            
@@ -1878,16 +2590,20 @@ def main():
 
         # --- SAVE and EXIT ---
         elif choice == '5':
-            log_event(pipe, logged_in_user['u_name'], 'PROPERLY EXITED THE SYSTEM')
-            # Save library state and exit
-
-            # Create a new library if not present
+            log_event(log_sender, logged_in_user['u_name'], 'PROPERLY EXITED THE SYSTEM')
+            # Deliver any log entries still queued before we go...the session's traffic is only reported (for
+            # debugging) when CS361_PIPELINE_STATS is set, the table means nothing to the user
+            log_sender.close()
+            pipe.close(dump_stats=bool(os.environ.get('CS361_PIPELINE_STATS')))
+
+            # Save library state and exit: sync the journal, folding it into a fresh library.pickle only if it
+            # has outgrown the last one (or close the database)
             try:
-                with open(f"library.pickle", 'wb') as outfile:
-                    pickle.dump(collection, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+                storage.close()
+                collection.recycle_bin.close()
 
             # $$$ TESTING $$$: provide info about errors
-            except FileNotFoundError:
+            except OSError:
                 print("ERROR SAVING LIBRARY!!!")
                 return False
 
@@ -1898,7 +2614,7 @@ def main():
 
         # --- ADD A BOOK ---
         if (choice == '6') and (logged_in_user['u_name'] == 'admin'):
-            log_event(pipe, logged_in_user['u_name'], 'ADDED A BOOK')
+            log_event(log_sender, logged_in_user['u_name'], 'ADDED A BOOK')
             # Book parameters: [title, author, isbn, year, publisher, price]
 
             # Print the 'Add a Book' Menu
@@ -1939,7 +2655,7 @@ def main():
 
         # --- DELETE A BOOK ---
         elif (choice == '7') and (logged_in_user['u_name'] == 'admin'):
-            log_event(pipe, logged_in_user['u_name'], 'DELETED A BOOK')
+            log_event(log_sender, logged_in_user['u_name'], 'DELETED A BOOK')
             # reference Menu for this option:
             """
             Delete a Book: 
@@ -1977,17 +2693,17 @@ def main():
                 # TITLE SEARCH
                 if selection == 1:
                     search_term = input("Type the title, or partial title: ")
-                    matches = [sn for titles, sn in collection.titles.items() if search_term in titles]
+                    matches = collection.search_results('title', search_term)
 
                 # AUTHOR SEARCH
                 elif selection == 2:
                     search_term = input("Type the Author name, or partial name: ")
-                    matches = [sn for authors, sn in collection.authors.items() if search_term in authors]
+                    matches = collection.search_results('author', search_term)
 
                 # SERIAL SEARCH
                 elif selection == 3:
                     search_term = input("Type the exact Library serial number of the book to delete:  ")
-                    match = collection.serials[search_term]
+                    match = collection.book_by_serial(search_term)
 
                 # ERROR
                 else:
@@ -2015,26 +2731,20 @@ def main():
                 # Display matching books to user
                 print("Your search yielded the following results: \n")
 
-                # 'order' assigns a 1-up number to each book in the list to aid in identification
-                order = 0
+                # each book is numbered 1-up through all the pages to aid in identification
                 if matches:
-                    for i in matches:
-                        print(f"BOOK NUMBER {order + 1}")
-
-                        collection.book_by_serial(i).view()
-                        print("\n")
-                        order += 1
+                    browse_results(collection, matches)
 
                     found_it = int(input("Is the book you're looking for in the results? (1: yes / 2: no)  "))
                     if found_it == 1:
-                        doom = int(input("Enter the BOOK NUMBER of the book you wish to delete: "))
+                        doomed_serial = pick_result(matches, "Enter the BOOK NUMBER of the book you wish to delete: ")
                         print("This is the book title you have selected: \n")
-                        print(collection.book_by_serial(matches[doom - 1]).get_title())
+                        print(collection.book_by_serial(doomed_serial).get_title())
                         recycle = int(input("Is this the book you want to delete? (1: yes / 2: no)"))
                         if recycle == 1:
                             confirm = input("Are you SURE you want to delete it? Type 'delete' to confirm:  \n")
                             if confirm == 'delete':
-                                collection.delete_book(matches[doom - 1])
+                                collection.delete_book(doomed_serial)
                                 print("Deletion confirmed!")
                                 save_data(collection)
                                 print("Book will remain in recycle bin for a limited time, and can be "
@@ -2067,7 +2777,7 @@ def main():
 
         # --- DELETE USER ACCOUNT ---
         elif (choice == '8') and (logged_in_user['u_name'] == 'admin'):
-            log_event(pipe, logged_in_user['u_name'], 'DELETED A  PROFILE')
+            log_event(log_sender, logged_in_user['u_name'], 'DELETED A  PROFILE')
             user_target = input('Enter the username of the user to delete: ')
             result1 = authenticate(f"DELETE {user_target}")
             result2 = delete_profile(pipe, user_target)
@@ -2082,7 +2792,7 @@ def main():
 
         # --- VIEW LOGS ---
         elif (choice == '9') and (logged_in_user['u_name'] == 'admin'):
-            log_event(pipe, logged_in_user['u_name'], 'ACCESSED SYSTEM LOGS')
+            log_event(log_sender, logged_in_user['u_name'], 'ACCESSED SYSTEM LOGS')
 
             print("""\n
                         CHOOSE A DAY'S LOG TO VIEW:
@@ -2098,8 +2808,7 @@ def main():
 
             past = int(input("Enter your day number: "))
             message = {'action': 'view', 'days_past': past}
-            pipe.send('log', message)
-            report = pipe.receive()
+            report = pipe.request('log', message)
             print(report)
             input("\nPress 'Enter' to continue...\n")
 
@@ -2107,7 +2816,7 @@ def main():
 
         # --- INVALID CHOICE ---
         else:
-            log_event(pipe, logged_in_user['u_name'], 'ENTERED AN INVALID MENU OPTION')
+            log_event(log_sender, logged_in_user['u_name'], 'ENTERED AN INVALID MENU OPTION')
             print("INVALID CHOICE! PLEASE CHOOSE FROM VALID OPTIONS \n")
             continue
 
@@ -1,124 +1,842 @@
+import fcntl
 import socket
 import pickle
+import itertools
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from message_codec import DEFAULT_CODEC
+from pipeline_stats import PipelineStats, action_of
+
+
+# ---------- Wire format ----------
+# Every message is one frame:  [4-byte payload length][1-byte type tag][4-byte request id][payload]
+#   the type tag says which payload encoding was used (see message_codec.py)
+#   request id 0 marks a one-way message; anything else is a request, and its reply carries the same id
+FRAME_HEADER = struct.Struct('!IBI')
+MAX_FRAME = 256 * 1024 * 1024           # refuse anything bigger than this rather than allocate it
+SMALL_FRAME = 64 * 1024                 # frames up to this size are joined to their header and sent in one go
+ONE_WAY = 0
+
+# Where every service listens.  Shared by Pipeline and AsyncPipeline, so services can be moved from one to the
+# other one at a time.
+#   An (IP, PORT) tuple means TCP.  A path string means a Unix-domain socket, which skips the TCP loopback
+#   stack for services on the same host, e.g.   'log': unix_address('log')
+ADDRESS_BOOK = {
+    'core': ('127.0.0.1', 20000),
+    'auth': ('127.0.0.1', 20001),
+    'profile': ('127.0.0.1', 20002),
+    'accounting': ('127.0.0.1', 20003),
+    'log': ('127.0.0.1', 20004)
+}
+
+
+def unix_address(name) -> str:
+    """ The Unix-domain socket path to use for a service, in the system temp directory. """
+    return os.path.join(tempfile.gettempdir(), f"cs361_{name}.sock")
+
+
+def open_socket(address, timeout=None) -> socket.socket:
+    """
+    Connects to an address book entry: TCP for an (IP, PORT) tuple, a Unix-domain socket for a path string.
+    """
+    if type(address) == str:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(address, timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(None)
+    return sock
+
+
+def encode_frame(data, request_id=ONE_WAY, codec=DEFAULT_CODEC) -> list:
+    """
+    Builds the frame for one message.
+    :param data: a string, or other message data the codec can encode
+    :param request_id: correlation id tying a request to its reply, ONE_WAY if no reply is expected
+    :param codec: the payload encoder (see message_codec.py)
+    :return: a list of buffers which, sent in order, make up the frame
+    """
+    tag, payload = codec.encode(data)
+
+    header = FRAME_HEADER.pack(len(payload), tag, request_id)
+    if len(payload) <= SMALL_FRAME:
+        return [header + payload]
+    # big payloads are not copied just to glue the header on
+    return [header, payload]
+
+
+def make_batch(messages) -> dict:
+    """ Wraps a list of action messages in a batch envelope, which a service runs in one pass. """
+    return {'action': 'batch', 'batch': list(messages)}
+
+
+class FrameReader:
+    """
+    Reads whole frames off one socket.
+
+    recv_into() fills preallocated buffers directly, so a large payload is never rebuilt by concatenating
+    chunks.  The payload buffer is kept between frames and only grows when a bigger frame arrives.
+    """
+
+    def __init__(self, sock, codec=DEFAULT_CODEC, initial_size=SMALL_FRAME):
+        """ Prepares the header and payload buffers for a connected socket. """
+        self.sock = sock
+        self.codec = codec
+        self.header = bytearray(FRAME_HEADER.size)
+        self.buffer = bytearray(initial_size)
+        self.last_size = 0                  # size on the wire of the frame read() last returned
+
+    def fill(self, view) -> bool:
+        """
+        Reads from the socket until 'view' is full.
+        :return: True once filled, False if the peer closed the connection before anything was read
+        """
+        received = 0
+        while received < len(view):
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                if received == 0:
+                    return False
+                raise ConnectionError("connection closed in the middle of a frame")
+            received += count
+        return True
+
+    def read(self) -> tuple:
+        """
+        Returns the next (request id, message) on the socket, or raises EOFError when the sender has hung up.
+        """
+        if not self.fill(memoryview(self.header)):
+            raise EOFError
+
+        length, tag, request_id = FRAME_HEADER.unpack(self.header)
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes is larger than the {MAX_FRAME} byte limit")
+        if length > len(self.buffer):
+            self.buffer = bytearray(length)
+        self.last_size = FRAME_HEADER.size + length
+
+        with memoryview(self.buffer) as view:
+            payload = view[:length]
+            if length and not self.fill(payload):
+                raise ConnectionError("connection closed in the middle of a frame")
+            try:
+                return request_id, self.codec.decode(tag, payload)
+            finally:
+                payload.release()
+
+
+class Connection:
+    """
+    One open socket shared by every thread talking to the same peer.
+
+    Frames are written under a lock so they never interleave.  Outgoing connections also run a reader
+    thread that matches each reply to the request that is waiting for it, so many requests can be in
+    flight on one connection at once and a late reply can never be handed to the wrong caller.
+    """
+
+    def __init__(self, sock, address=None, codec=DEFAULT_CODEC, stats=None):
+        """ Wraps a connected socket.  Labelled requests are counted in 'stats' (a PipelineStats) if given. """
+        self.sock = sock
+        self.address = address
+        self.codec = codec
+        self.stats = stats
+        self.send_lock = threading.Lock()
+        self.pending = {}                           # {request id: Future waiting for that reply}
+        self.pending_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.closed = False
+
+    def send_frame(self, frame) -> int:
+        """ Writes an already-encoded frame to the socket, returning its size in bytes. """
+        with self.send_lock:
+            for buffer in frame:
+                self.sock.sendall(buffer)
+        self.last_used = time.monotonic()
+        return sum(len(buffer) for buffer in frame)
+
+    def send(self, data, request_id=ONE_WAY) -> int:
+        """ Encodes and writes one message, returning its size in bytes. """
+        return self.send_frame(encode_frame(data, request_id, self.codec))
+
+    def request(self, data, request_id, label=None) -> Future:
+        """
+        Sends a request and returns a Future that the reader thread completes when its reply arrives.
+        :param label: (destination name, action) to count the request and its round trip under in self.stats
+        """
+        frame = encode_frame(data, request_id, self.codec)
+        future = Future()
+        future.label = label
+        future.size = sum(len(buffer) for buffer in frame)
+        future.started = time.perf_counter()
+        with self.pending_lock:
+            if self.closed:
+                raise ConnectionError(f"connection to {self.address} is closed")
+            self.pending[request_id] = future
+        try:
+            self.send_frame(frame)
+        except OSError:
+            self.forget(request_id)
+            raise
+        return future
+
+    def forget(self, request_id) -> None:
+        """ Stops waiting for a reply, e.g. after the caller timed out. """
+        with self.pending_lock:
+            self.pending.pop(request_id, None)
+
+    def start_reader(self) -> None:
+        """ Starts the background thread that routes replies to waiting requests. """
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    def read_replies(self) -> None:
+        """ Reads replies until the connection drops, then fails whatever is still waiting. """
+        reader = FrameReader(self.sock, self.codec)
+        error = ConnectionError(f"connection to {self.address} closed")
+        try:
+            while True:
+                request_id, reply = reader.read()
+                with self.pending_lock:
+                    future = self.pending.pop(request_id, None)
+                if future is not None:
+                    if self.stats is not None and future.label is not None:
+                        self.stats.record_request(future.label, future.size, reader.last_size,
+                                                  time.perf_counter() - future.started)
+                    future.set_result(reply)
+                else:
+                    print(f"ERROR...dropping unexpected reply (id {request_id}) from {self.address}")
+        except EOFError:
+            pass
+        except (OSError, ValueError, pickle.UnpicklingError) as failure:
+            error = ConnectionError(f"connection to {self.address} failed: {failure}")
+        finally:
+            self.close()
+            with self.pending_lock:
+                waiting = list(self.pending.values())
+                self.pending = {}
+            for future in waiting:
+                future.set_exception(error)
+
+    def close(self) -> None:
+        """ Closes the socket; the reader thread notices and stops. """
+        with self.pending_lock:
+            if self.closed:
+                return
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ConnectionPool:
+    """
+    Keeps one open, multiplexed Connection per destination so each message to a service does not pay for a
+    new TCP handshake and teardown.
+
+    A connection that has sat unused longer than 'idle_timeout' seconds is closed and replaced, and one the
+    far end has closed is replaced on the next use.
+    """
+
+    def __init__(self, idle_timeout=30.0, connect_timeout=5.0, codec=DEFAULT_CODEC, stats=None):
+        """ Sets up an empty pool.  Connection attempts are timed into 'stats' (a PipelineStats) if given. """
+        self.codec = codec
+        self.stats = stats
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.connections = {}           # {(IP, PORT): Connection}
+        self.connecting = {}            # {(IP, PORT): Lock held while connecting to it}
+        self.lock = threading.Lock()    # guards the two dictionaries, never held while connecting
+
+    def usable(self, connection) -> bool:
+        """ True unless the far end of a pooled connection hung up, or it sat idle too long. """
+        return not connection.closed and (time.monotonic() - connection.last_used) <= self.idle_timeout
+
+    def get(self, address) -> Connection:
+        """
+        Returns the open connection to the address, connecting first if there is no healthy one.
+        :param address: tuple of (IP, PORT)
+        """
+
+        with self.lock:
+            connection = self.connections.get(address)
+            if connection is not None and self.usable(connection):
+                return connection
+            connecting = self.connecting.setdefault(address, threading.Lock())
+
+        # Nothing reusable...connect a new socket holding only this address's lock, so a slow or unreachable
+        # service never holds up the others.  A thread that waited here uses the connection the one before
+        # it made
+        with connecting:
+            with self.lock:
+                connection = self.connections.get(address)
+                if connection is not None and self.usable(connection):
+                    return connection
+                stale = self.connections.pop(address, None)
+            if stale is not None:
+                stale.close()
+
+            started = time.perf_counter()
+            try:
+                sock = open_socket(address, self.connect_timeout)
+            except OSError:
+                if self.stats is not None:
+                    self.stats.record_connect(address, time.perf_counter() - started, failed=True)
+                raise
+            if self.stats is not None:
+                self.stats.record_connect(address, time.perf_counter() - started)
+            connection = Connection(sock, address, self.codec, self.stats)
+            connection.start_reader()
+            with self.lock:
+                self.connections[address] = connection
+        return connection
+
+    def discard(self, connection) -> None:
+        """ Drops a connection that failed mid-send so it is never reused. """
+        with self.lock:
+            if self.connections.get(connection.address) is connection:
+                del self.connections[connection.address]
+        connection.close()
+
+    def close(self) -> None:
+        """ Closes every pooled connection. """
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections = {}
+        for connection in connections:
+            connection.close()
+
+
+# Names of the shared-memory rings this process created (and so is responsible for removing)
+_rings_created_here = set()
+
+
+def ring_name(service) -> str:
+    """ The shared-memory block name for a service's ring. """
+    return f"cs361_{service}_ring"
+
+
+class RingInUse(RuntimeError):
+    """ Raised by SharedRing.attach when another writer already holds the ring. """
+
+
+class SharedRing:
+    """
+    Single-reader ring buffer of frames in a named shared-memory block, for one-way messages between
+    processes on the same host (the core -> log path sends the most messages of all).
+
+    Layout:  [8-byte write count][8-byte read count][8-byte shut flag][padding to 64][data...]
+    The writer only ever updates the write count and the reader only the read count, each after the data
+    they cover, so no cross-process lock is needed.  That needs there to be ONE writer: attach() takes an
+    exclusive flock on the ring's lock file (released when the writer closes the ring or its process exits),
+    so a second process trying to write into the same ring gets RingInUse.  Threads of the writing process
+    share a lock.
+    The counts are read and written through a memoryview of native 8-byte integers, so each is stored with
+    one aligned copy.  (struct.pack_into zeroes its target before writing, so the other side could see 0.)
+    """
+
+    WRITTEN, READ, SHUT = range(3)      # positions of the counts in the header
+    DATA_OFFSET = 64
+    DEFAULT_CAPACITY = 4 * 1024 * 1024
+
+    def __init__(self, block, owner, writer_lock=None):
+        """
+        Wraps an open shared-memory block.
+        :param writer_lock: the open lock file a writer holds (see attach)
+        """
+        self.block = block
+        self.buf = block.buf
+        self.counts = block.buf[:24].cast('Q')
+        self.capacity = block.size - self.DATA_OFFSET
+        self.owner = owner              # the reader created the block, and removes it on close
+        self.writer_lock = writer_lock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    @classmethod
+    def create(cls, name, capacity=DEFAULT_CAPACITY):
+        """ Creates (replacing any left over from an earlier run) the ring a service reads from. """
+        try:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        block = shared_memory.SharedMemory(name, create=True, size=cls.DATA_OFFSET + capacity)
+        _rings_created_here.add(block.name)
+        ring = cls(block, owner=True)
+        ring.counts[cls.WRITTEN] = ring.counts[cls.READ] = ring.counts[cls.SHUT] = 0
+        return ring
+
+    @staticmethod
+    def writer_lock_path(name) -> str:
+        """ The lock file whose flock marks a ring as having its writer. """
+        return os.path.join(tempfile.gettempdir(), f"{name}.writer.lock")
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Opens an existing ring to write into, as its only writer.
+        Raises FileNotFoundError if nobody has created it, and RingInUse if another writer has it.
+        """
+        writer_lock = open(cls.writer_lock_path(name), 'a')
+        try:
+            fcntl.flock(writer_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            writer_lock.close()
+            raise RingInUse(f"shared-memory ring {name} already has a writer (only one process may write into it)")
+        try:
+            block = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            writer_lock.close()
+            raise
+        if block.name in _rings_created_here:
+            # our own ring, already tracked once by create()
+            return cls(block, owner=False, writer_lock=writer_lock)
+        try:
+            # Python's resource tracker would otherwise delete the block when *this* process exits,
+            # pulling it out from under the service that owns it
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        except (ImportError, AttributeError, KeyError):
+            pass
+        return cls(block, owner=False, writer_lock=writer_lock)
+
+    def is_shut(self) -> bool:
+        """ True once the reader has closed the ring, so writers should stop using it. """
+        return self.closed or self.counts[self.SHUT] != 0
+
+    def copy_in(self, position, data) -> None:
+        """ Writes bytes at a ring position, wrapping around the end of the data area. """
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        base = self.DATA_OFFSET
+        self.buf[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.buf[base:base + len(data) - first] = data[first:]
+
+    def copy_out(self, position, length) -> bytes:
+        """ Reads bytes from a ring position, wrapping around the end of the data area. """
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        base = self.DATA_OFFSET
+        data = bytes(self.buf[base + start:base + start + first])
+        if first < length:
+            data += bytes(self.buf[base:base + length - first])
+        return data
+
+    def put(self, frame) -> bool:
+        """
+        Appends one encoded frame (list of buffers, as from encode_frame).
+        :return: False if there is not enough free space, or the reader has shut the ring
+        """
+        size = sum(len(buffer) for buffer in frame)
+        with self.lock:
+            if self.closed or self.counts[self.SHUT]:
+                return False
+            written = self.counts[self.WRITTEN]
+            if size > self.capacity - (written - self.counts[self.READ]):
+                return False
+            position = written
+            for buffer in frame:
+                self.copy_in(position, memoryview(buffer).cast('B'))
+                position += len(buffer)
+            # publish only after the data is in place
+            self.counts[self.WRITTEN] = position
+        return True
+
+    def get(self):
+        """ Removes and returns the oldest frame as bytes, or None if the ring is empty. """
+        read = self.counts[self.READ]
+        if self.counts[self.WRITTEN] == read:
+            return None
+        header = self.copy_out(read, FRAME_HEADER.size)
+        length = FRAME_HEADER.unpack(header)[0]
+        frame = header + self.copy_out(read + FRAME_HEADER.size, length)
+        # hand the space back only after the frame is copied out
+        self.counts[self.READ] = read + len(frame)
+        return frame
+
+    def close(self) -> None:
+        """
+        Stops using the ring.  A writer detaches at once; the owning reader marks the ring shut so writers
+        move back to the socket, and its drain thread then releases the block.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.owner:
+            self.counts[self.SHUT] = 1
+        else:
+            self.release()
+
+    def release(self) -> None:
+        """ Unmaps the block, and removes it from the system if we own it (a writer gives up its lock). """
+        if self.writer_lock is not None:
+            self.writer_lock.close()
+            self.writer_lock = None
+        if self.buf is None:
+            return
+        self.counts.release()
+        self.buf = None
+        self.block.close()
+        if self.owner:
+            _rings_created_here.discard(self.block.name)
+            try:
+                self.block.unlink()
+            except FileNotFoundError:
+                pass
+
 
 class Pipeline:
     """
     This structure establishes a communication pipeline between the core UI/CMS and its plugin
     microservices.
 
-    CALL:   pipeline.send('microservice recipient name string', data payload)
+    CALL:   pipeline.send('microservice recipient name string', data payload)             [no reply]
+            pipeline.request('microservice recipient name string', data payload)          [waits for reply]
+            pipeline.batch('microservice recipient name string', [payload, payload...])   [list of replies]
     RETURNS: whatever data the microservice replies with...format is ['action': string, 'data': dictionary]
 
+    Services call pipeline.listen() once, then take messages from pipeline.messages() (or receive()) and
+    answer requests with pipeline.reply().
+
     Whatever service initiates the contact must send [action, data], but responds with [reply]
     """
 
-    def __init__(self, own_name):
+    def __init__(self, own_name, pool=None, codec=DEFAULT_CODEC):
         """ Builds the initial address book for the pipeline communication services. """
-        self.address_book = {
-            'core': ('127.0.0.1', 20000),
-            'auth': ('127.0.0.1', 20001),
-            'profile': ('127.0.0.1', 20002),
-            'accounting': ('127.0.0.1', 20003),
-            'log': ('127.0.0.1', 20004)
-        }
+        self.address_book = dict(ADDRESS_BOOK)
         self.name = own_name
+        self.codec = codec              # payload encoding, see message_codec.py
+
+        # Traffic and latency counters, answered to {'action': 'stats'} (see pipeline_stats.py)
+        self.stats = PipelineStats(own_name)
+
+        # Outgoing connections are kept open and reused across sends
+        self.pool = pool if pool is not None else ConnectionPool(codec=codec, stats=self.stats)
+        self.request_ids = itertools.count(1)
+
+        # Incoming messages are queued here by the listener threads (see listen()), along with where they
+        # came from so the reply can go back the same way
+        self.listener = None
+        self.inbox = queue.Queue()
+        self.current = None             # (Connection, request id, action, size, arrival time) of the message
+                                        # last handed out by receive()
+        self.answered = True            # whether reply() has been called for it
+
+        # Optional shared-memory rings for one-way messages between processes on this host (see SharedRing)
+        self.rings = {}                 # {destination name: SharedRing we write into}
+        self.own_ring = None            # SharedRing other processes write into, drained into our inbox
+        self.ring_drainer = None        # thread doing that draining
 
     def send(self, destination, data):
         """Is passed a socket tuple and data, sends data to destination."""
 
         # Map destination to address using the address book
-        if destination == 'core':
-            destination = self.address_book['core']
-        elif destination == 'auth':
-            destination = self.address_book['auth']
-        elif destination == 'profile':
-            destination = self.address_book['profile']
-        elif destination == 'accounting':
-            destination = self.address_book['accounting']
-        elif destination == 'log':
-            destination = self.address_book['log']
-        else:
+        if destination not in self.address_book:
             return False
+        name = destination
+        destination = self.address_book[destination]
 
-        # Make an IPv4/TCP socket
-        core_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Frame the message with this pipeline's codec (what is sent where is counted in self.stats)
+        frame = encode_frame(data, ONE_WAY, self.codec)
+
+        # A shared-memory ring, where one is attached, takes one-way messages without touching a socket.
+        # If the ring is full or its reader has shut down, fall through to the socket.
+        label = (name, action_of(data))
+        ring = self.rings.get(name)
+        if ring is not None:
+            if ring.put(frame):
+                self.stats.record_send(label, sum(len(buffer) for buffer in frame))
+                return True
+            if ring.is_shut():
+                ring.close()
+                del self.rings[name]
+
+        # Send on a pooled connection.  If a reused connection turns out to be dead, reconnect once and resend.
+        for attempt in range(2):
+            # destination is a tuple: (IP, PORT), to match the socket library format, or a Unix socket path
+            try:
+                connection = self.pool.get(destination)
+            except OSError:
+                self.stats.record_failure(label)
+                raise
+            try:
+                size = connection.send_frame(frame)
+            except OSError:
+                self.pool.discard(connection)
+                if attempt:
+                    self.stats.record_failure(label)
+                    raise
+                continue
+            self.stats.record_send(label, size)
+            return True
+
+    def submit(self, destination, data) -> Future:
+        """
+        Sends a request without waiting for the reply.  Any number of requests, to any services, may be in
+        flight at once.
 
-        # Connect to destination service
+        :return: a Future whose result() is the reply
+        """
+
+        if destination not in self.address_book:
+            raise KeyError(f"no service named {destination!r} in the address book")
+        address = self.address_book[destination]
+
+        # ids are 32 bits on the wire and 0 is reserved for one-way messages
+        request_id = next(self.request_ids) % 0xFFFFFFFF + 1
+        label = (destination, action_of(data))
+
+        for attempt in range(2):
+            try:
+                connection = self.pool.get(address)
+            except OSError:
+                self.stats.record_failure(label)
+                raise
+            try:
+                # the connection counts the request and its round trip (see ConnectionPool's stats)
+                future = connection.request(data, request_id, label)
+            except OSError:
+                self.pool.discard(connection)
+                if attempt:
+                    self.stats.record_failure(label)
+                    raise
+                continue
+            future.connection = connection
+            future.request_id = request_id
+            return future
+
+    def request(self, destination, data, timeout=None):
+        """
+        Sends a request to a service and returns its reply.
+
+        :param timeout: seconds to wait for the reply, or None to wait forever
+        :return: whatever the service replied with
+        """
+
+        future = self.submit(destination, data)
         try:
-            # destination is a tuple: (IP, PORT), to match the socket library format
-            core_socket.connect(destination)
-
-            # !!!!! TESTING !!!!!
-            print(f"Transmitting data to {destination} now...")
-
-            if type(data) == str:
-                # it's a string...encode and send it
-                print(f"sending string {data}")
-                core_socket.sendall(data.encode())
-            else:
-                # it's a dictionary...pickle it and just send the bytes
-                print(f"sending dict {data}")
-                pickled_data = pickle.dumps(data)
-                core_socket.sendall(pickled_data)
+            return future.result(timeout)
+        except FutureTimeout:
+            future.connection.forget(future.request_id)
+            self.stats.record_failure(future.label)
+            raise
+        except ConnectionError:
+            self.stats.record_failure(future.label)
+            raise
 
-        finally:
-            # Close the socket.
-            core_socket.close()
+    def batch(self, destination, messages, timeout=None) -> list:
+        """
+        Sends several action messages to one service in a single round trip.  The service carries them out in
+        order and answers with the list of their results, in the same order (None for actions with no reply).
 
-    def receive(self, rec_buffer=2048, max_connect=3) -> dict:
+        :param messages: list of action dictionaries, each shaped exactly as it would be sent on its own
+        :return: list of replies, one per message
         """
-        Takes no params, listens for TCP connections, then returns any message data received.
+        return self.request(destination, make_batch(messages), timeout)
 
-        :param rec_buffer: default to 2048, this should not be changed
-        :param max_connect: generally, 1 should be the max connections, 3 is more than enough
-        :return: the action mode and the decoded message data is returned
+    def listen(self, backlog=64) -> None:
         """
+        Binds this service's address book port once and keeps it open.  Incoming connections are accepted in
+        the background and every message read from them is queued for receive()/messages().
+        Calling it again once listening does nothing.
 
-        # Prepare variables
-        address = self.address_book[self.name]  # sets own address based on object name
+        :param backlog: how many not-yet-accepted connections the OS will hold for us
+        """
 
-        # Set up a receiving IPv4/TCP socket
-        receive_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.listener is not None:
+            return
 
-        # Bind it
-        receive_socket.bind(address)
+        address = self.address_book[self.name]          # sets own address based on object name
 
-        # Start listening for messages from the Core/UI/CMS
-        receive_socket.listen(max_connect)
+        # Set up a receiving socket (IPv4/TCP, or Unix-domain for a path), bind it, and start listening
+        if type(address) == str:
+            if os.path.exists(address):
+                # left behind by an earlier run
+                os.unlink(address)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+        listener.listen(backlog)
+        self.listener = listener
 
-        # Initialize return message container at METHOD-level scope
-        message_decoded = None
+        threading.Thread(target=self.accept_loop, args=(listener,), daemon=True).start()
 
-        # Main loop: Initiate communications with the CMS/UI 'core'
+    def accept_loop(self, listener) -> None:
+        """ Accepts senders for as long as the listener is open, giving each its own reader thread. """
+        while True:
+            try:
+                sending_socket, sending_ip = listener.accept()
+            except OSError:
+                # listener was closed
+                return
 
+            if sending_socket.family == socket.AF_INET:
+                sending_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(sending_socket, sending_ip, self.codec)
+            threading.Thread(target=self.read_loop, args=(connection,), daemon=True).start()
+
+    def read_loop(self, connection) -> None:
+        """ Reads messages off one connection into the inbox until the sender hangs up. """
+        reader = FrameReader(connection.sock, self.codec)
         try:
             while True:
-                # Accept connection from sender
-                sending_socket, sending_ip = receive_socket.accept()
+                request_id, message = reader.read()
+                self.inbox.put((message, connection, request_id, reader.last_size, time.perf_counter()))
+        except EOFError:
+            # sender closed the connection
+            pass
+        except (OSError, ValueError, pickle.UnpicklingError) as error:
+            print(f"ERROR...dropping connection after a bad frame: {error}")
+        finally:
+            connection.close()
 
-                # !!!!! TESTING !!!!!
-                print(f"{sending_ip} (sender) just connected")
+    def receive(self, timeout=None):
+        """
+        Returns the next message sent to this service, blocking until one arrives.
+        Starts listening on the first call if listen() has not been called yet.
 
-                try:
-                    # transfer the socket data to the 'data' variable
-                    message = sending_socket.recv(rec_buffer)
+        {'action': 'stats'} requests are answered here with this pipeline's counters, so every service
+        supports them without any code of its own.
 
-                    # try to decode the data as a string
-                    try:
-                        message_decoded = str(message.decode())
+        :param timeout: seconds to wait before giving up and returning None, or None to wait forever
+        :return: the decoded message data, usually a dictionary with an 'action' key
+        """
 
-                    # if that fails...it's a pickled dictionary, unpickle it
-                    except:
-                        message_decoded = pickle.loads(message)
+        self.listen()
+        while True:
+            # Messages are counted when answered, or here if the last one never was
+            if not self.answered:
+                connection, request_id, action, size, arrived = self.current
+                self.stats.record_receive(action, size)
+                self.answered = True
+            try:
+                message, connection, request_id, size, arrived = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            action = action_of(message)
+            self.current = (connection, request_id, action, size, arrived)
+            self.answered = False
+            if action != 'stats':
+                return message
+            self.reply(self.stats.snapshot(self.address_book))
 
-                finally:
-                    # Close connection to core
-                    sending_socket.close()
-                    break
+    def messages(self):
+        """ Yields every message sent to this service, for use as a service main loop. """
+        while True:
+            yield self.receive()
 
+    def reply(self, data) -> bool:
+        """
+        Answers the message most recently returned by receive(), on the connection it arrived on.
+        :return: True if sent, False if that message was one-way (nobody is waiting), was already answered,
+                 or its sender is gone
+        """
+
+        if self.current is None or self.answered:
+            return False
+        connection, request_id, action, size, arrived = self.current
+        if request_id == ONE_WAY:
+            # nobody is waiting for an answer
+            return False
+        try:
+            reply_size = connection.send(data, request_id)
+        except OSError:
+            print(f"ERROR...requester at {connection.address} went away before its reply was sent")
+            return False
+        self.stats.record_answer(action, size, reply_size, time.perf_counter() - arrived)
+        self.answered = True
+        return True
+
+    def open_ring(self, capacity=SharedRing.DEFAULT_CAPACITY) -> None:
+        """
+        Offers a shared-memory ring that processes on this host can write one-way messages into, skipping
+        the socket stack entirely.  Its messages are drained into the same inbox as socket messages.
+        """
+        if self.own_ring is not None:
+            return
+        self.own_ring = SharedRing.create(ring_name(self.name), capacity)
+        self.ring_drainer = threading.Thread(target=self.drain_ring, args=(self.own_ring,), daemon=True)
+        self.ring_drainer.start()
+
+    def drain_ring(self, ring) -> None:
+        """ Moves messages from our shared-memory ring into the inbox until the ring is closed. """
+        try:
+            self.drain_frames(ring)
         finally:
-            # Close the connection
-            receive_socket.close()
+            ring.release()
+
+    def drain_frames(self, ring) -> None:
+        """ The body of drain_ring. """
+        idle = 0
+        while not ring.closed:
+            frame = ring.get()
+            if frame is None:
+                # Nothing waiting.  Just yield for a while (a busy writer is usually back within microseconds),
+                # then back off to polling once a millisecond so an idle service costs next to nothing
+                idle += 1
+                time.sleep(0 if idle < 2000 else 0.001)
+                continue
+            idle = 0
+            length, tag, request_id = FRAME_HEADER.unpack_from(frame)
+            try:
+                message = self.codec.decode(tag, memoryview(frame)[FRAME_HEADER.size:])
+            except (ValueError, pickle.UnpicklingError) as error:
+                print(f"ERROR...dropping a bad frame from the shared-memory ring: {error}")
+                continue
+            self.inbox.put((message, None, ONE_WAY, len(frame), time.perf_counter()))
 
-            # Make the response available to the calling function
-            return message_decoded
+    def attach_ring(self, destination) -> bool:
+        """
+        Sends one-way messages for a destination through its shared-memory ring from now on, if that
+        service has opened one.  Requests still go over the socket, since replies need a way back, and so
+        does any message that finds the ring full (so such a message may overtake ones still in the ring).
+        A ring takes one writing process only; if another process already writes into it, this one keeps
+        using the socket.
+        :return: True if attached, False if the service has no ring or it already has a writer (messages keep
+                 using the socket)
+        """
+        try:
+            self.rings[destination] = SharedRing.attach(ring_name(destination))
+        except (FileNotFoundError, RingInUse):
+            return False
+        return True
+
+    def close(self, dump_stats=False) -> None:
+        """
+        Closes any connections this pipeline is holding open, and stops listening.
+        :param dump_stats: also print this pipeline's traffic and latency counters, e.g. when a service shuts down
+        """
+        if dump_stats:
+            print(self.stats.report(self.address_book))
+        self.pool.close()
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            address = self.address_book[self.name]
+            if type(address) == str and os.path.exists(address):
+                os.unlink(address)
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        if self.own_ring is not None:
+            self.own_ring.close()
+            self.ring_drainer.join(1.0)
+            self.own_ring = None
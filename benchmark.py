@@ -0,0 +1,713 @@
+# benchmark.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Micro-benchmarks for the Pipeline and Library.  Run: python benchmark.py [name ...]
+
+# ---------- Imports ----------
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from MainUI import Book, Library
+from library_catalogue import CatalogueFormat
+from library_export import export_books, select_books
+from library_import import import_books
+from library_journal import LibraryJournal
+from library_recycle import PUT, RecycleBin
+from library_search import BKTree, edit_distance, pattern_masks
+from library_sqlite import SqliteLibrary
+from Pipeline import Pipeline, ConnectionPool, unix_address
+from message_codec import BinaryCodec, PickleCodec
+
+
+# ---------- Functions ----------
+def sink_server():
+    """
+    Starts a throwaway TCP server on a free loopback port that reads and discards everything sent to it.
+    Connections are held open until the client closes them.
+    :return: the (IP, PORT) address of the server
+    """
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+
+    def drain(conn):
+        with conn:
+            while conn.recv(65536):
+                pass
+
+    def accept_loop():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=drain, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()
+
+
+def free_port() -> int:
+    """ Asks the OS for a loopback port nothing is using. """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def timed(label, count, func, per_call=1) -> float:
+    """ Runs func() count times with stdout silenced and prints the rate (of per_call operations per call). """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        elapsed = time.perf_counter() - start
+    rate = count * per_call / elapsed
+    print(f"    {label:<40} {rate:>12,.0f} /s")
+    return rate
+
+
+def bench_pool(count=5000) -> None:
+    """ Compares a fresh connection per send against pooled, reused connections. """
+    print("Pipeline.send: connect-per-send vs pooled connections")
+    address = sink_server()
+    message = {'action': 'log', 'log': {'user': 'bench', 'trigger': 'BENCHMARK'}}
+
+    fresh = Pipeline('core', pool=ConnectionPool(idle_timeout=0))
+    fresh.address_book['log'] = address
+    before = timed('connect-per-send (old behaviour)', count, lambda: fresh.send('log', message))
+
+    pooled = Pipeline('core')
+    pooled.address_book['log'] = address
+    after = timed('pooled connection', count, lambda: pooled.send('log', message))
+    pooled.close()
+
+    print(f"    speedup: {after / before:.1f}x")
+
+
+def bench_listener(count=20000) -> None:
+    """ Measures the sustained rate a persistent Pipeline listener can take a burst of messages at. """
+    print("Pipeline.listen: burst of messages into one service")
+    service = Pipeline('log')
+    service.address_book['log'] = ('127.0.0.1', free_port())
+    service.listen()
+
+    sender = Pipeline('core')
+    sender.address_book['log'] = service.address_book['log']
+    message = {'action': 'log', 'log': {'user': 'bench', 'trigger': 'BENCHMARK'}}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(count):
+            sender.send('log', message)
+        for _ in range(count):
+            service.receive()
+        elapsed = time.perf_counter() - start
+    print(f"    {'send + receive':<40} {count / elapsed:>12,.0f} /s")
+    sender.close()
+    service.close()
+
+
+def echo_service(name) -> Pipeline:
+    """ Starts a Pipeline service on a free port that replies to every request with the request itself. """
+    service = Pipeline(name)
+    service.address_book[name] = ('127.0.0.1', free_port())
+    service.listen()
+
+    def serve():
+        for message in service.messages():
+            service.reply(message)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return service
+
+
+def bench_requests(count=10000, in_flight=64) -> None:
+    """ Compares one-at-a-time round trips against many multiplexed requests in flight at once. """
+    print("Pipeline.request: sequential round trips vs multiplexed in-flight requests")
+    names = ['profile', 'accounting', 'log']
+    services = [echo_service(name) for name in names]
+    client = Pipeline('core')
+    for service in services:
+        client.address_book[service.name] = service.address_book[service.name]
+    message = {'action': 'get_checkouts', 'user': 'bench'}
+
+    timed('sequential request()', count, lambda: client.request('profile', message))
+
+    def burst():
+        futures = [client.submit(names[i % len(names)], message) for i in range(in_flight)]
+        for future in futures:
+            future.result()
+
+    timed(f'{in_flight} in flight over {len(names)} services', count // in_flight, burst, per_call=in_flight)
+    client.close()
+    for service in services:
+        service.close()
+
+
+def bench_codec(count=50000) -> None:
+    """ Compares encode/decode speed and bytes per message of the binary codec against pickle. """
+    print("Payload codecs: pickle vs binary (encode+decode rate, bytes per message)")
+    samples = {
+        'check_out': {'action': 'check_out', 'user': 'jsmith', 'sn': 'HaJo41234'},
+        'get_user_dict': {'action': 'get_user_dict', 'user_name': 'jsmith'},
+        'log': {'action': 'log', 'log': {'user': 'jsmith', 'trigger': 'SEARCHED FOR BOOK'}},
+        'batch of 20 logs': {'action': 'batch', 'batch': [{'action': 'log', 'log': {'user': f'user{i}',
+                                                                                    'trigger': 'CHECKED IN BOOK'}}
+                                                          for i in range(20)]},
+        'user dict reply': {'first_name': 'Jo', 'last_name': 'Smith', 'age': '41', 'address': '1 Main St',
+                            'phone': '555-0100', 'email': 'jo@example.com', 'card': 1234567, 'assist': None},
+    }
+    for name, message in samples.items():
+        print(f"  {name}")
+        for codec in (PickleCodec(), BinaryCodec()):
+            tag, payload = codec.encode(message)
+            timed(f"{type(codec).__name__} ({len(payload)} bytes)", count,
+                  lambda: codec.decode(*codec.encode(message)))
+
+
+def transport_sender(address, use_ring, count, results) -> None:
+    """ Child process for bench_transports: sends 'count' log messages, then reports its per-send() times. """
+    sender = Pipeline('core')
+    sender.address_book['log'] = address
+    if use_ring:
+        sender.attach_ring('log')
+    message = {'action': 'log', 'log': {'user': 'bench', 'trigger': 'BENCHMARK'}}
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            start = time.perf_counter()
+            sender.send('log', message)
+            samples.append(time.perf_counter() - start)
+    sender.close()
+    samples.sort()
+    results.put((samples[len(samples) // 2], samples[int(len(samples) * 0.99)]))
+
+
+def bench_transports(count=50000) -> None:
+    """
+    Compares TCP loopback, a Unix-domain socket and the shared-memory ring for one-way core -> log messages,
+    with the sender in its own process as in the real system.  Latency is what one send() costs the sender.
+    """
+    print("Transports: one-way messages from another process, end-to-end rate and send() latency")
+    for label in ('TCP loopback', 'Unix socket', 'shared-memory ring'):
+        service = Pipeline('log')
+        if label == 'TCP loopback':
+            service.address_book['log'] = ('127.0.0.1', free_port())
+        else:
+            service.address_book['log'] = unix_address('bench_log')
+        service.listen()
+        use_ring = label == 'shared-memory ring'
+        if use_ring:
+            service.open_ring()
+
+        results = multiprocessing.Queue()
+        child = multiprocessing.Process(target=transport_sender,
+                                        args=(service.address_book['log'], use_ring, count, results))
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            child.start()
+            for _ in range(count):
+                service.receive()
+            elapsed = time.perf_counter() - start
+        median, p99 = results.get()
+        child.join()
+        print(f"    {label:<20} {count / elapsed:>10,.0f} msgs/s   send() p50 {median * 1e6:>6.1f} us"
+              f"   p99 {p99 * 1e6:>6.1f} us")
+        service.close()
+
+
+def make_words(rng, count) -> list:
+    """ Makes 'count' distinct pronounceable made-up words, capitalized like title words. """
+    syllables = ['ka', 'lo', 'mer', 'tin', 'sha', 'dor', 've', 'ri', 'pol', 'an', 'gre', 'su', 'thi', 'bo', 'wen']
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize())
+    return sorted(words)
+
+
+def make_library(count, seed=361) -> Library:
+    """
+    Builds a Library of 'count' made-up books: titles of 1-4 words from a 5,000 word vocabulary, and author
+    names from 1,000 first names and 5,000 surnames.  Serials are simply numbered, to build big ones quickly.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_words(rng, 5000)
+    first_names = vocabulary[:1000]
+    collection = Library()
+    for number in range(count):
+        title = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4)))
+        author = f"{rng.choice(first_names)} {rng.choice(vocabulary)}"
+        book = Book(title, author, 9780000000000 + number, rng.randint(1900, 2024), 'Bench House', 20)
+        book.serial = f"BK{number}"
+        collection.insert_book(book)
+    return collection
+
+
+def bench_search(sizes=(10000, 100000, 1000000), queries=20) -> None:
+    """ Compares title and author search through the search indexes against checking every key, by library size. """
+    print("Library search: linear substring scan vs word and trigram index")
+    for size in sizes:
+        start = time.perf_counter()
+        collection = make_library(size)
+        print(f"  {size:,} books ({len(collection.titles):,} titles, {len(collection.authors):,} authors, "
+              f"built in {time.perf_counter() - start:.1f} s)")
+        rng = random.Random(size)
+        titles = rng.sample(list(collection.titles), queries)
+        authors = rng.sample(list(collection.authors), queries)
+        kinds = {
+            'title, whole word': ('titles', [title.split()[0] for title in titles]),
+            'title, phrase': ('titles', [title[2:] for title in titles]),
+            'title, fragment': ('titles', [title[1:5] for title in titles]),
+            'author, full name': ('authors', authors),
+            'author, surname': ('authors', [author.split()[1] for author in authors]),
+        }
+        for label, (catalogue, terms) in kinds.items():
+            keys = getattr(collection, catalogue)
+            search = collection.search_titles if catalogue == 'titles' else collection.search_authors
+            before = time.perf_counter()
+            for term in terms:
+                scanned = [sn for key, serials in keys.items() if term in key for sn in serials]
+            scan = (time.perf_counter() - before) / queries
+            before = time.perf_counter()
+            found = 0
+            for term in terms:
+                found += len(search(term))
+            indexed = (time.perf_counter() - before) / queries
+            print(f"    {label:<20} scan {scan * 1000:>9.2f} ms   index {indexed * 1000:>8.3f} ms"
+                  f"   {scan / indexed:>7.1f}x   ({found / queries:,.0f} matches/query)")
+
+
+def bench_book_memory(count=200000) -> None:
+    """
+    Compares the memory held by 'count' books as Book (slots, shared strings) against the old layout: a
+    __dict__ per book, and its own copy of each title, author and publisher, as unpickling used to give.
+    """
+    print("Book memory: per-book __dict__ vs slots with shared strings")
+    rng = random.Random(361)
+    vocabulary = make_words(rng, 5000)
+    rows = [(' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4))),
+             f"{rng.choice(vocabulary[:1000])} {rng.choice(vocabulary[:200])}",
+             9780000000000 + number, rng.randint(1900, 2024), rng.choice(vocabulary[:50]) + ' Press', 20.0)
+            for number in range(count)]
+
+    def old_book(title, author, isbn, year, publisher, price):
+        # fresh string copies, as each book read from a pickle had
+        return types.SimpleNamespace(title=''.join(title), author=''.join(author), isbn=isbn, serial=f"S{isbn}",
+                                     year=year, publisher=''.join(publisher), price=price, rating=None,
+                                     summary=None, checked_out=False)
+
+    def new_book(title, author, isbn, year, publisher, price):
+        book = Book(''.join(title), ''.join(author), isbn, year, ''.join(publisher), price)
+        book.serial = f"S{isbn}"
+        return book
+
+    results = {}
+    for label, make in (('__dict__ per book (old)', old_book), ('__slots__ + shared strings', new_book)):
+        tracemalloc.start()
+        books = [make(*row) for row in rows]
+        results[label] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del books
+        print(f"    {label:<40} {results[label] / count:>8.0f} bytes/book   {results[label] / 2 ** 20:>8.1f} MiB")
+    before, after = results.values()
+    print(f"    saving: {1 - after / before:.0%}")
+
+
+def bench_serials(count=2000000, steps=4) -> None:
+    """
+    Stress test for serial allocation: adds 'count' books whose serials all share one prefix, checking the
+    add_book rate stays flat as the prefix fills (the old random retry loop stalled, then hung past 50,001).
+    """
+    print(f"Library.add_book: {count:,} books sharing one serial prefix")
+    collection = Library()
+    step = count // steps
+    for done in range(0, count, step):
+        books = [Book('Harry Potter', 'J. K. Rowling', 9780000000000 + done + n, 1997, 'Bloomsbury', 20.0)
+                 for n in range(step)]
+        start = time.perf_counter()
+        for book in books:
+            collection.add_book(book)
+        elapsed = time.perf_counter() - start
+        print(f"    books {done + 1:>10,} - {done + step:>10,} {step / elapsed:>12,.0f} /s")
+    assert len(collection.serials) == count
+    print(f"    last serial: {books[-1].get_serial()}")
+
+
+def bench_journal(sizes=(10000, 100000, 1000000), edits=1000) -> None:
+    """ Compares the cost of saving one admin edit: re-pickling the whole Library vs a journal record. """
+    print("Saving a Library edit: full library.pickle rewrite vs journal append (+ fsync)")
+    for size in sizes:
+        collection = make_library(size)
+        with tempfile.TemporaryDirectory() as folder:
+            snapshot = os.path.join(folder, 'library.pickle')
+            start = time.perf_counter()
+            for _ in range(3):
+                with open(snapshot, 'wb') as outfile:
+                    pickle.dump(collection, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            rewrite = (time.perf_counter() - start) / 3
+            os.remove(snapshot)
+
+            journal = LibraryJournal(snapshot, os.path.join(folder, 'library.journal'))
+            journal.load(lambda: collection)
+            books = [Book(f"Bench Title {n}", 'Bench Author', n, 2000, 'Bench House', 20.0) for n in range(edits)]
+            start = time.perf_counter()
+            for book in books[:edits // 2]:
+                collection.add_book(book)
+            append = (time.perf_counter() - start) / (edits // 2)
+            start = time.perf_counter()
+            for book in books[edits // 2:]:
+                collection.add_book(book)
+                journal.sync()
+            synced = (time.perf_counter() - start) / (edits - edits // 2)
+            journal.close(compact=False)
+        print(f"  {size:>9,} books   rewrite {rewrite * 1000:>9.1f} ms   journal {append * 1e6:>6.1f} us"
+              f"   journal + fsync {synced * 1e6:>8.1f} us")
+
+
+def bench_sqlite(sizes=(10000, 100000, 1000000), queries=1000) -> None:
+    """ Compares the pickle and SQLite backends: opening the library, and the lookups the menus make. """
+    print("Library backends: library.pickle vs library.db (startup, and per-query latency)")
+    for size in sizes:
+        collection = make_library(size)
+        rng = random.Random(size)
+        serials = rng.sample(list(collection.serials), queries)
+        titles = [collection.serials[serial].title for serial in serials]
+        words = [title.split()[0] for title in titles[:queries // 10]]
+        with tempfile.TemporaryDirectory() as folder:
+            snapshot = os.path.join(folder, 'library.pickle')
+            with open(snapshot, 'wb') as outfile:
+                pickle.dump(collection, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            database = os.path.join(folder, 'library.db')
+            target = SqliteLibrary(database, Book)
+            target.import_library(collection)
+            target.close()
+            del collection
+
+            results = {}
+            for label in ('pickle', 'sqlite'):
+                start = time.perf_counter()
+                if label == 'pickle':
+                    with open(snapshot, 'rb') as infile:
+                        library = pickle.load(infile)
+                else:
+                    library = SqliteLibrary(database, Book)
+                opened = time.perf_counter() - start
+                start = time.perf_counter()
+                for serial in serials:
+                    library.book_by_serial(serial)
+                by_serial = (time.perf_counter() - start) / queries
+                start = time.perf_counter()
+                for title in titles:
+                    library.book_by_title(title)
+                by_title = (time.perf_counter() - start) / queries
+                start = time.perf_counter()
+                for word in words:
+                    library.search_titles(word)
+                search = (time.perf_counter() - start) / len(words)
+                results[label] = (opened, by_serial, by_title, search)
+                if label == 'sqlite':
+                    library.close()
+                del library
+        print(f"  {size:,} books")
+        for label, (opened, by_serial, by_title, search) in results.items():
+            print(f"    {label:<7} open {opened * 1000:>9.1f} ms   by serial {by_serial * 1e6:>7.1f} us"
+                  f"   by title {by_title * 1e6:>7.1f} us   title search {search * 1000:>8.2f} ms")
+
+
+def bench_mapped(sizes=(10000, 100000, 1000000), lookups=1000) -> None:
+    """
+    Compares opening library.pickle against mapping a catalogue file: the time to open, and the memory held
+    once open and after looking up 'lookups' books.
+    """
+    print("Opening the Library: pickle.load vs memory-mapped catalogue (time, Python memory)")
+    catalogue_format = CatalogueFormat(Book, Library)
+    for size in sizes:
+        collection = make_library(size)
+        serials = random.Random(size).sample(list(collection.serials), lookups)
+        with tempfile.TemporaryDirectory() as folder:
+            paths = {'pickle': os.path.join(folder, 'library.pickle'),
+                     'mapped': os.path.join(folder, 'library.catalogue')}
+            with open(paths['pickle'], 'wb') as outfile:
+                pickle.dump(collection, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(paths['mapped'], 'wb') as outfile:
+                outfile.write(catalogue_format.dumps(collection))
+            del collection
+
+            print(f"  {size:,} books")
+            for label, path in paths.items():
+                def open_library():
+                    if label == 'mapped':
+                        return catalogue_format.load(path)
+                    with open(path, 'rb') as infile:
+                        return pickle.load(infile)
+
+                # timed first, then again under tracemalloc (which slows everything down) for the memory
+                start = time.perf_counter()
+                library = open_library()
+                opened = time.perf_counter() - start
+                start = time.perf_counter()
+                for serial in serials:
+                    library.book_by_serial(serial)
+                looked_up = (time.perf_counter() - start) / lookups
+                del library
+                tracemalloc.start()
+                library = open_library()
+                open_memory = tracemalloc.get_traced_memory()[0]
+                for serial in serials:
+                    library.book_by_serial(serial)
+                used_memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                del library
+                print(f"    {label:<7} open {opened * 1000:>9.2f} ms   {open_memory / 2 ** 20:>8.1f} MiB"
+                      f"   {lookups:,} lookups {looked_up * 1e6:>6.1f} us each   {used_memory / 2 ** 20:>8.1f} MiB")
+
+
+def bench_import(count=500000) -> None:
+    """ Bulk-imports 'count' made-up books from CSV and from JSON lines into a journaled Library. """
+    print("Bulk import: rows/s from CSV and JSON lines, into a Library saved to a journal")
+    rng = random.Random(361)
+    vocabulary = make_words(rng, 5000)
+    rows = [{'title': ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4))),
+             'author': f"{rng.choice(vocabulary[:1000])} {rng.choice(vocabulary)}",
+             'isbn': 9780000000000 + number, 'year': rng.randint(1900, 2024), 'publisher': 'Bench House',
+             'price': 20.0} for number in range(count)]
+    with tempfile.TemporaryDirectory() as folder:
+        files = {'csv': os.path.join(folder, 'books.csv'), 'jsonl': os.path.join(folder, 'books.jsonl')}
+        with open(files['csv'], 'w', newline='') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        with open(files['jsonl'], 'w') as outfile:
+            outfile.writelines(json.dumps(row) + '\n' for row in rows)
+        del rows
+
+        for label, path in files.items():
+            journal = LibraryJournal(os.path.join(folder, f"{label}.pickle"), os.path.join(folder, f"{label}.journal"))
+            collection = journal.load(Library)
+            start = time.perf_counter()
+            imported, rejected = import_books(collection, [path], Book, report=None)
+            elapsed = time.perf_counter() - start
+            journal.close(compact=False)
+            assert imported == len(collection.serials) == count and not rejected
+            print(f"    {label:<6} {count:,} books in {elapsed:.2f} s   {count / elapsed:>10,.0f} rows/s")
+
+
+def bench_export(count=200000) -> None:
+    """ Exports a catalogue file of 'count' books, measuring rows/s and the peak Python memory it takes. """
+    print("Streaming export from a mapped catalogue: rows/s, peak Python memory")
+    catalogue_format = CatalogueFormat(Book, Library)
+    collection = make_library(count)
+    with tempfile.TemporaryDirectory() as folder:
+        catalogue = os.path.join(folder, 'library.catalogue')
+        with open(catalogue, 'wb') as outfile:
+            outfile.write(catalogue_format.dumps(collection))
+        del collection
+        for name in ('books.csv', 'books.csv.gz', 'books.jsonl.gz'):
+            for year_range in ((None, None), (2000, 2024)):
+                library = catalogue_format.load(catalogue)
+                start = time.perf_counter()
+                written = export_books(select_books(library, *year_range), os.path.join(folder, name))
+                elapsed = time.perf_counter() - start
+                library = catalogue_format.load(catalogue)
+                tracemalloc.start()
+                export_books(select_books(library, *year_range), os.path.join(folder, name))
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                label = f"{name}, years {year_range[0]}-{year_range[1]}" if year_range[0] else name
+                print(f"    {label:<32} {written:>9,} books {written / elapsed:>10,.0f} rows/s"
+                      f"   peak {peak / 2 ** 20:>6.2f} MiB")
+
+
+def bench_fuzzy(sizes=(100000, 1000000), queries=50) -> None:
+    """ Looks up misspelled author names in a BK-tree of 'size' distinct names, against checking every name. """
+    print("Fuzzy author lookup: top-5 within 1 or 2 edits, BK-tree vs comparing with every name")
+    rng = random.Random(361)
+    vocabulary = make_words(rng, 5000)
+    for size in sizes:
+        names = set()
+        while len(names) < size:
+            names.add(f"{rng.choice(vocabulary)} {rng.choice(vocabulary)}")
+        names = list(names)
+        start = time.perf_counter()
+        tree = BKTree(names)
+        print(f"  {size:,} names (tree built in {time.perf_counter() - start:.1f} s)")
+        # each query is a name with one letter changed
+        terms = []
+        for name in rng.sample(names, queries):
+            position = rng.randrange(len(name))
+            terms.append(name[:position] + rng.choice('aeiourst') + name[position + 1:])
+        start = time.perf_counter()
+        for term in terms[:5]:
+            masks = pattern_masks(term.casefold())
+            sorted(names, key=lambda name: edit_distance(masks, len(term), name.casefold()))[:5]
+        scan = (time.perf_counter() - start) / 5
+        print(f"    scan every name         {1 / scan:>10,.1f} lookups/s")
+        for max_distance in (1, 2):
+            start = time.perf_counter()
+            found = sum(len(tree.closest(term, 5, max_distance)) for term in terms)
+            elapsed = (time.perf_counter() - start) / queries
+            print(f"    BK-tree, within {max_distance} edit{'s' if max_distance > 1 else ' '}  {1 / elapsed:>10,.1f} "
+                  f"lookups/s   {scan / elapsed:>7.1f}x   ({found / queries:.1f} found/query)")
+
+
+def bench_complete(size=1000000, queries=200) -> None:
+    """ Completes title prefixes of 1-6 characters, Library.complete_title against scanning every title. """
+    print("Title completion: top-10 by copies, sorted list + bisect vs scanning every title")
+    collection = make_library(size)
+    titles = list(collection.titles)
+    start = time.perf_counter()
+    collection.complete_title('')
+    collection.title_index.completions.clear_cache()
+    print(f"  {size:,} books, {len(titles):,} titles (sorted list built in {time.perf_counter() - start:.1f} s)")
+    rng = random.Random(size)
+    samples = rng.sample(titles, queries)
+    for length in (1, 2, 3, 4, 6):
+        prefixes = [title[:length].casefold() for title in samples]
+        before = time.perf_counter()
+        expected = [sorted((title for title in titles if title.casefold().startswith(prefix)),
+                           key=lambda title: (-len(collection.titles[title]), title.casefold(), title))[:10]
+                    for prefix in prefixes[:3]]
+        scan = (time.perf_counter() - before) / 3
+        timings = []
+        for _ in range(2):
+            # the first round ranks each prefix, the second finds the rankings kept
+            before = time.perf_counter()
+            for prefix in prefixes:
+                collection.complete_title(prefix)
+            timings.append((time.perf_counter() - before) / queries)
+        assert [collection.complete_title(prefix) for prefix in prefixes[:3]] == expected
+        print(f"    prefix of {length}   scan {scan * 1000:>8.1f} ms   complete {timings[0] * 1e6:>8.1f} us"
+              f" ({scan / timings[0]:>5.0f}x)   again {timings[1] * 1e6:>6.2f} us ({scan / timings[1]:>7.0f}x)")
+
+
+def bench_recycle(sizes=(10000, 100000), restores=100) -> None:
+    """
+    Compares the recycle bin as one <serial>.pickle file per deleted book (listing scans the directory) with
+    the indexed library.recycle file.
+    """
+    print("Recycle bin: one .pickle file per book vs the indexed library.recycle")
+    for size in sizes:
+        books = [Book(f"Recycled Title {n}", f"Author {n % 500}", n, 2000, 'Bench House', 20.0) for n in range(size)]
+        for n, book in enumerate(books):
+            book.serial = f"ReAu{n}"
+        with tempfile.TemporaryDirectory() as folder:
+            for book in books:
+                with open(os.path.join(folder, f"{book.serial}.pickle"), 'wb') as outfile:
+                    pickle.dump(book, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            start = time.perf_counter()
+            listed = sorted(name for name in os.listdir(folder) if name.endswith('.pickle'))
+            with open(os.path.join(folder, listed[0]), 'rb') as infile:
+                pickle.load(infile)
+            files = time.perf_counter() - start
+
+            # build the file directly, rather than one fsync'd put() per book
+            path = os.path.join(folder, 'library.recycle')
+            with open(path, 'wb') as outfile:
+                now = time.time()
+                for book in books:
+                    outfile.write(RecycleBin.encode(PUT, book.serial, now, pickle.dumps(book.get_values())))
+            start = time.perf_counter()
+            recycle_bin = RecycleBin(path, Book)
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            for serial in recycle_bin.page(0):
+                recycle_bin.get(serial)
+            listing = time.perf_counter() - start
+            start = time.perf_counter()
+            for book in books[:restores]:
+                recycle_bin.take(book.serial)
+            restore = (time.perf_counter() - start) / restores
+            start = time.perf_counter()
+            recycle_bin.purge(0)
+            purge = time.perf_counter() - start
+            recycle_bin.close()
+        print(f"  {size:>8,} books   listdir + load {files * 1000:>8.1f} ms   open {opened * 1000:>7.1f} ms"
+              f"   page {listing * 1000:>5.2f} ms   restore {restore * 1000:>5.2f} ms (with fsync)"
+              f"   purge all {purge * 1000:>6.1f} ms")
+
+
+def bench_availability(sizes=(100000, 1000000), out_share=0.1, queries=200) -> None:
+    """
+    Compares circulation questions answered by visiting every Book with the Library's checked out serials and
+    per-title / per-author counts.
+    """
+    print("Availability: checking every Book vs the checked out set and counts")
+    for size in sizes:
+        collection = make_library(size)
+        rng = random.Random(size)
+        for serial in rng.sample(list(collection.serials), int(size * out_share)):
+            collection.checkout(serial)
+        authors = rng.sample(list(collection.authors), queries)
+
+        start = time.perf_counter()
+        sum(1 for book in collection.serials.values() if book.checked_out)
+        scan_count = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(queries):
+            collection.checked_out_count()
+        count = (time.perf_counter() - start) / queries
+
+        start = time.perf_counter()
+        for author in authors[:5]:
+            [book.serial for book in collection.serials.values() if book.author == author and not book.checked_out]
+        scan_author = (time.perf_counter() - start) / 5
+        start = time.perf_counter()
+        for author in authors:
+            collection.available_serials('author', author)
+            collection.available_by_author(author)
+        by_author = (time.perf_counter() - start) / queries
+
+        serials = rng.sample(list(collection.serials), queries)
+        start = time.perf_counter()
+        for serial in serials:
+            collection.checkout(serial)
+            collection.checkin(serial)
+        circulate = (time.perf_counter() - start) / (2 * queries)
+        print(f"  {size:>9,} books   books out: scan {scan_count * 1000:>7.1f} ms, count {count * 1e6:>5.2f} us"
+              f"   an author's available books: scan {scan_author * 1000:>7.1f} ms,"
+              f" index {by_author * 1e6:>5.1f} us   checkout/checkin {circulate * 1e6:>5.2f} us")
+
+
+BENCHMARKS = {
+    'pool': bench_pool,
+    'listener': bench_listener,
+    'requests': bench_requests,
+    'codec': bench_codec,
+    'transports': bench_transports,
+    'search': bench_search,
+    'book_memory': bench_book_memory,
+    'serials': bench_serials,
+    'journal': bench_journal,
+    'sqlite': bench_sqlite,
+    'mapped': bench_mapped,
+    'import': bench_import,
+    'export': bench_export,
+    'fuzzy': bench_fuzzy,
+    'complete': bench_complete,
+    'recycle': bench_recycle,
+    'availability': bench_availability,
+}
+
+
+def main():
+    """ Runs the benchmarks named on the command line, or all of them. """
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
+
+
+# Execute Program
+if __name__ == '__main__':
+    main()
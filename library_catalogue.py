@@ -0,0 +1,267 @@
+# library_catalogue.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Memory-mapped catalogue file for the Library.  Opening one costs the same however many books
+#              it holds: the file is mapped, not read, and each Book is decoded the first time it is used.
+#              Run this file to copy an existing library.pickle into library.catalogue:
+#                   python library_catalogue.py [library.pickle] [library.catalogue]
+
+# ---------- Imports ----------
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+from collections.abc import MutableMapping
+
+# ---------- Constants ----------
+# A catalogue file is:
+#   [header]
+#   [book records]      each [2-byte serial length][serial, UTF-8][pickled tuple of the Book's slot values]
+#   [serial index]      one [8-byte record offset][4-byte record length] per book, sorted by serial
+#   [library settings]  pickled dict: banner, recycled, serial_counters, journal_seq, and the checked out
+#                       serials and counts
+#   [catalogues]        pickled dict: titles, authors, title_index, author_index...read on first use
+HEADER = struct.Struct('!8sIQQQQ')      # magic, version, book count, index offset, settings offset, catalogues offset
+INDEX_ENTRY = struct.Struct('!QI')
+SERIAL_LENGTH = struct.Struct('!H')
+MAGIC = b'CS361CAT'
+VERSION = 1
+
+SETTINGS = ('banner', 'recycled', 'serial_counters', 'journal_seq', 'checked_out', 'out_by_title', 'out_by_author')
+CATALOGUES = ('titles', 'authors', 'title_index', 'author_index')
+
+
+# ---------- Classes ----------
+class MappedBooks(MutableMapping):
+    """
+    The serial: Book mapping of a Library opened from a catalogue file (Library.serials).
+
+    Looking a serial up binary-searches the file's index, and the Book is decoded and kept the first time it
+    is asked for, so memory grows with the books actually used.  Books added or deleted since the file was
+    written are kept in memory on top of it.
+    """
+
+    def __init__(self, buffer, count, index_offset, book_class):
+        """
+        :param buffer: the mapped catalogue file
+        :param count: the number of books in the file
+        :param index_offset: where its serial index starts
+        :param book_class: the Book class to decode into (MainUI.Book)
+        """
+        self.buffer = buffer
+        self.count = count
+        self.index_offset = index_offset
+        self.book_class = book_class
+        self.loaded = {}                # serial: Book, for every book decoded or added since opening
+        self.removed = set()            # serials in the file that have since been deleted
+        self.size = count
+
+    def entry(self, position) -> tuple:
+        """ The (serial, record offset, record length) of the position'th book in serial order. """
+        offset, length = INDEX_ENTRY.unpack_from(self.buffer, self.index_offset + position * INDEX_ENTRY.size)
+        serial_length, = SERIAL_LENGTH.unpack_from(self.buffer, offset)
+        start = offset + SERIAL_LENGTH.size
+        return self.buffer[start:start + serial_length], offset, length
+
+    def find(self, serial) -> int:
+        """ The index position of a serial in the file, or -1 if the file does not have it. """
+        if type(serial) != str:
+            return -1
+        target = serial.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.entry(low)[0] == target:
+            return low
+        return -1
+
+    def raw_book(self, position) -> bytes:
+        """ The encoded slot values of the position'th book, straight from the file. """
+        serial, offset, length = self.entry(position)
+        return self.buffer[offset + SERIAL_LENGTH.size + len(serial):offset + length]
+
+    def decode(self, raw):
+        """ Builds a Book from its encoded slot values. """
+        book = self.book_class.__new__(self.book_class)
+        book.__setstate__(dict(zip(self.book_class.__slots__, pickle.loads(raw))))
+        return book
+
+    def __getitem__(self, serial):
+        book = self.loaded.get(serial)
+        if book is not None:
+            return book
+        position = -1 if serial in self.removed else self.find(serial)
+        if position < 0:
+            raise KeyError(serial)
+        book = self.loaded[serial] = self.decode(self.raw_book(position))
+        return book
+
+    def __contains__(self, serial) -> bool:
+        return serial in self.loaded or (serial not in self.removed and self.find(serial) >= 0)
+
+    def __setitem__(self, serial, book) -> None:
+        if serial not in self:
+            self.size += 1
+        self.removed.discard(serial)
+        self.loaded[serial] = book
+
+    def __delitem__(self, serial) -> None:
+        if serial not in self:
+            raise KeyError(serial)
+        self.loaded.pop(serial, None)
+        if self.find(serial) >= 0:
+            self.removed.add(serial)
+        self.size -= 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        """ The serials in the file (in serial order), then those added since. """
+        for position in range(self.count):
+            serial = self.entry(position)[0].decode()
+            if serial not in self.removed:
+                yield serial
+        for serial in list(self.loaded):
+            if self.find(serial) < 0:
+                yield serial
+
+    def iter_books(self):
+        """
+        Yields every Book, decoding those not already in memory without keeping them, so walking the whole
+        catalogue (an export, say) does not load all of it.
+        """
+        for position in range(self.count):
+            serial = self.entry(position)[0].decode()
+            if serial in self.loaded:
+                yield self.loaded[serial]
+            elif serial not in self.removed:
+                yield self.decode(self.raw_book(position))
+        for serial, book in list(self.loaded.items()):
+            if self.find(serial) < 0:
+                yield book
+
+    def unchanged_records(self):
+        """ (serial, encoded book) for each book in the file that has not been decoded, replaced or deleted. """
+        for position in range(self.count):
+            serial = self.entry(position)[0].decode()
+            if serial not in self.loaded and serial not in self.removed:
+                yield serial, self.raw_book(position)
+
+
+class CatalogueFormat:
+    """
+    Reads and writes Library snapshots as catalogue files, for LibraryJournal(snapshot_format=...).  load()
+    maps the file and returns a Library whose serials are MappedBooks and whose title and author catalogues
+    are only read when first used (see Library.__getattr__).
+    """
+
+    def __init__(self, book_class, library_class):
+        """
+        :param book_class: the Book class (MainUI.Book)
+        :param library_class: the Library class (MainUI.Library)
+        """
+        self.book_class = book_class
+        self.library_class = library_class
+
+    def encode_book(self, book) -> bytes:
+        """ A Book's slot values, encoded for its record. """
+        return pickle.dumps(tuple(getattr(book, name) for name in self.book_class.__slots__),
+                            protocol=pickle.HIGHEST_PROTOCOL)
+
+    def dumps(self, library) -> bytes:
+        """
+        Encodes a Library as a catalogue file.  Books of a mapped Library that were never decoded are copied
+        from the old file as they are.
+        """
+        serials = library.serials
+        if isinstance(serials, MappedBooks):
+            records = serials.unchanged_records()
+            changed = serials.loaded.items()
+        else:
+            records = ()
+            changed = serials.items()
+
+        parts = []
+        entries = []
+        offset = HEADER.size
+        for serial, raw in records:
+            encoded = serial.encode()
+            parts.append(SERIAL_LENGTH.pack(len(encoded)) + encoded + raw)
+            entries.append((encoded, offset, len(parts[-1])))
+            offset += len(parts[-1])
+        for serial, book in changed:
+            encoded = serial.encode()
+            parts.append(SERIAL_LENGTH.pack(len(encoded)) + encoded + self.encode_book(book))
+            entries.append((encoded, offset, len(parts[-1])))
+            offset += len(parts[-1])
+
+        entries.sort()
+        index_offset = offset
+        parts.extend(INDEX_ENTRY.pack(start, length) for _, start, length in entries)
+        settings = pickle.dumps({name: getattr(library, name) for name in SETTINGS},
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        settings_offset = index_offset + len(entries) * INDEX_ENTRY.size
+        parts.append(settings)
+        catalogues_offset = settings_offset + len(settings)
+        parts.append(pickle.dumps({name: getattr(library, name) for name in CATALOGUES},
+                                  protocol=pickle.HIGHEST_PROTOCOL))
+        header = HEADER.pack(MAGIC, VERSION, len(entries), index_offset, settings_offset, catalogues_offset)
+        return header + b''.join(parts)
+
+    def load(self, path):
+        """ Opens a catalogue file as a Library (FileNotFoundError if there is none). """
+        with open(path, 'rb') as infile:
+            buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset, settings_offset, catalogues_offset = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} library catalogue")
+
+        library = self.library_class.__new__(self.library_class)
+        library.__dict__.update(pickle.loads(buffer[settings_offset:catalogues_offset]))
+        library.serials = MappedBooks(buffer, count, index_offset, self.book_class)
+        library.journal = None
+        library.recycle_bin = None
+        library.load_catalogues = lambda: pickle.loads(buffer[catalogues_offset:])
+        if 'checked_out' not in library.__dict__:
+            library.count_checkouts()       # a file written before the counts were kept
+        return library
+
+
+# ---------- Functions ----------
+def convert(pickle_path='library.pickle', catalogue_path='library.catalogue') -> None:
+    """ Writes library.pickle (and any journal of changes since it was saved) as a catalogue file. """
+    from MainUI import Book, Library
+    from library_journal import LibraryJournal, fsync_directory
+
+    start = time.perf_counter()
+    journal_path = os.path.join(os.path.dirname(pickle_path), 'library.journal')
+    journal = LibraryJournal(pickle_path, journal_path)
+    library = journal.load(Library)
+    journal.close(compact=False)
+    library.journal_seq = journal.seq       # the journal's records are all in the catalogue now
+
+    temporary = catalogue_path + '.tmp'
+    with open(temporary, 'wb') as outfile:
+        outfile.write(CatalogueFormat(Book, Library).dumps(library))
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temporary, catalogue_path)
+    fsync_directory(catalogue_path)
+    print(f"Wrote {len(library.serials):,} books from {pickle_path} to {catalogue_path} "
+          f"in {time.perf_counter() - start:.1f} s")
+    print("Set CS361_LIBRARY_BACKEND=mapped to use it.")
+
+
+# Execute Program
+if __name__ == '__main__':
+    # library.pickle refers to the Library classes as __main__.*, since MainUI.py is run as a script...make the
+    # names resolvable from this script too
+    from MainUI import Book, Library, SearchIndex
+    convert(*sys.argv[1:3])
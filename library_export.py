@@ -0,0 +1,119 @@
+# library_export.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Streaming catalogue export.  Writes the books of the Library (whichever backend
+#              CS361_LIBRARY_BACKEND selects) to CSV or JSON lines one at a time, so even a huge catalogue is
+#              exported in constant memory.  Output ending in .gz is gzipped; library_import.py reads it back.
+#                   python library_export.py books.csv.gz [--from-year N] [--to-year N] [--author NAME]
+#                                                          [--checked-out | --available]
+
+# ---------- Imports ----------
+import argparse
+import csv
+import gzip
+import json
+import operator
+import os
+import time
+
+# ---------- Constants ----------
+FIELDS = ('serial', 'title', 'author', 'isbn', 'year', 'publisher', 'price', 'rating', 'summary', 'checked_out')
+values_of = operator.attrgetter(*FIELDS)      # book -> its FIELDS, in order
+
+
+# ---------- Functions ----------
+def open_output(path, compress):
+    """ Opens a file for writing as text, gzipping it if 'compress' """
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def select_books(library, from_year=None, to_year=None, author=None, checked_out=None):
+    """
+    Yields the books of a Library that pass every filter given.  A Library's author catalogue means an author
+    filter only visits that author's books, and its set of checked out serials that a checked out filter only
+    visits those.
+    :param from_year: earliest publication year
+    :param to_year: latest publication year
+    :param author: exact author name
+    :param checked_out: True for only checked out books, False for only available ones
+    """
+    if author is not None and 'authors' in getattr(library, '__dict__', {}):
+        books = (library.book_by_serial(serial) for serial in library.authors.get(author, ()))
+    elif checked_out and 'checked_out' in getattr(library, '__dict__', {}):
+        books = (library.book_by_serial(serial) for serial in list(library.checked_out))
+    else:
+        books = library.iter_books()
+    for book in books:
+        if from_year is not None and (book.year is None or book.year < from_year):
+            continue
+        if to_year is not None and (book.year is None or book.year > to_year):
+            continue
+        if author is not None and book.author != author:
+            continue
+        if checked_out is not None and bool(book.checked_out) != checked_out:
+            continue
+        yield book
+
+
+def export_books(books, path) -> int:
+    """
+    Writes books to a CSV (*.csv, *.csv.gz) or JSON-lines file (anything else), replacing the file only once
+    it is complete.
+    :return: the number of books written
+    """
+    temporary = path + '.tmp'
+    written = 0
+    with open_output(temporary, path.endswith('.gz')) as outfile:
+        if path.endswith(('.csv', '.csv.gz')):
+            writer = csv.writer(outfile)
+            writer.writerow(FIELDS)
+            for book in books:
+                writer.writerow(values_of(book))
+                written += 1
+        else:
+            for book in books:
+                outfile.write(json.dumps(dict(zip(FIELDS, values_of(book)))) + '\n')
+                written += 1
+    os.replace(temporary, path)
+    return written
+
+
+def main():
+    """ Exports the configured Library to the file named on the command line. """
+    from MainUI import open_library
+
+    parser = argparse.ArgumentParser(description="Export the Library catalogue to CSV or JSON lines.")
+    parser.add_argument('path', help="output file: *.csv or *.jsonl, with .gz to compress")
+    parser.add_argument('--from-year', type=int, help="only books published in or after this year")
+    parser.add_argument('--to-year', type=int, help="only books published in or before this year")
+    parser.add_argument('--author', help="only books by this author (exact name)")
+    state = parser.add_mutually_exclusive_group()
+    state.add_argument('--checked-out', dest='checked_out', action='store_const', const=True,
+                       help="only checked out books")
+    state.add_argument('--available', dest='checked_out', action='store_const', const=False,
+                       help="only books not checked out")
+    options = parser.parse_args()
+
+    collection, storage = open_library()
+    start = time.perf_counter()
+    try:
+        written = export_books(select_books(collection, options.from_year, options.to_year, options.author,
+                                            options.checked_out), options.path)
+    finally:
+        if storage is collection:
+            storage.close()                 # SQLite
+        else:
+            storage.close(compact=False)    # nothing changed, so the snapshot can stay as it is
+    elapsed = time.perf_counter() - start
+    print(f"Exported {written:,} books to {options.path} in {elapsed:.1f} s "
+          f"({written / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+# Execute Program
+if __name__ == '__main__':
+    # library.pickle refers to the Library classes as __main__.*, since MainUI.py is run as a script...make the
+    # names resolvable from this script too
+    from MainUI import Book, Library, SearchIndex
+    main()
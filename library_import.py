@@ -0,0 +1,158 @@
+# library_import.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Bulk book import.  Streams books from CSV or JSON-lines files into the Library (whichever
+#              backend CS361_LIBRARY_BACKEND selects) in batches, each batch saved as one change.
+#                   python library_import.py books.csv [more.jsonl ...]
+#              A CSV file needs a header row; both formats use the fields title, author, isbn, year,
+#              publisher, price, and optionally rating and summary.  Files ending in .gz are decompressed.
+
+# ---------- Imports ----------
+import contextlib
+import csv
+import gc
+import gzip
+import itertools
+import json
+import sys
+import time
+
+# ---------- Constants ----------
+BATCH_SIZE = 10000                      # books added (and saved) together
+REQUIRED = ('title', 'author', 'isbn', 'year', 'publisher', 'price')
+
+
+# ---------- Functions ----------
+def open_text(path):
+    """ Opens a file for reading as text, decompressing it if it ends in .gz """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_rows(path):
+    """
+    Yields (line number, {field: value}) for each record of a CSV or JSON-lines file, one at a time.
+    Files named *.csv (or *.csv.gz) are CSV, anything else is JSON lines.
+    """
+    with open_text(path) as infile:
+        if path.endswith(('.csv', '.csv.gz')):
+            reader = csv.DictReader(infile)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(infile, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as error:
+                        yield number, error
+
+
+def parse_books(rows, book_class, rejected):
+    """
+    Turns rows into Books, checking each field.  Rows that fail are left out and added to 'rejected' as
+    (line number, reason).
+    :param rows: (line number, row) pairs, as read_rows yields
+    :param book_class: the Book class (MainUI.Book)
+    :param rejected: a list to add bad rows to
+    """
+    for number, row in rows:
+        if not isinstance(row, dict):
+            rejected.append((number, f"not a record: {row}"))
+            continue
+        missing = [field for field in REQUIRED if row.get(field) in (None, '')]
+        if missing:
+            rejected.append((number, f"missing {', '.join(missing)}"))
+            continue
+        try:
+            book = book_class(str(row['title']).strip(), str(row['author']).strip(), int(row['isbn']),
+                              int(row['year']), str(row['publisher']).strip(), float(row['price']))
+            if row.get('rating') not in (None, ''):
+                book.rating = int(row['rating'])
+            if row.get('summary') not in (None, ''):
+                book.summary = str(row['summary'])
+        except (TypeError, ValueError) as error:
+            rejected.append((number, str(error)))
+            continue
+        if not book.title or not book.author:
+            rejected.append((number, "blank title or author"))
+            continue
+        yield book
+
+
+def batches(items, size):
+    """ Yields lists of up to 'size' items at a time. """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_books(library, paths, book_class, batch_size=BATCH_SIZE, report=print) -> tuple:
+    """
+    Adds every valid book in some files to a Library: each batch goes in through Library.add_books (new
+    serials, all the indexes) and is saved with one save(), so memory holds one batch at a time.  A journaled
+    Library compacts once, at the end, and the garbage collector is paused meanwhile (the import only makes
+    objects that stay, which it would otherwise keep re-scanning).
+    :param library: a Library or SqliteLibrary
+    :param paths: the files to import
+    :param book_class: the Book class (MainUI.Book)
+    :param batch_size: books per batch
+    :param report: prints progress (None for quiet)
+    :return: (books imported, [(file, line number, reason) for each rejected row])
+    """
+    imported = 0
+    rejected = []
+    journal = getattr(library, 'journal', None)
+    collecting = gc.isenabled()
+    gc.disable()
+    start = time.perf_counter()
+    try:
+        with journal.holding_compaction() if journal else contextlib.nullcontext():
+            for path in paths:
+                bad = []
+                for batch in batches(parse_books(read_rows(path), book_class, bad), batch_size):
+                    library.add_books(batch)
+                    library.save()
+                    imported += len(batch)
+                    if report:
+                        elapsed = time.perf_counter() - start
+                        report(f"  {imported:>12,} books   {imported / elapsed:>10,.0f} rows/s", end='\r')
+                rejected.extend((path, number, reason) for number, reason in bad)
+    finally:
+        if collecting:
+            gc.enable()
+    if report:
+        elapsed = time.perf_counter() - start
+        report(f"Imported {imported:,} books in {elapsed:.1f} s ({imported / max(elapsed, 1e-9):,.0f} rows/s), "
+               f"rejected {len(rejected):,} rows")
+    return imported, rejected
+
+
+def main():
+    """ Imports the files named on the command line into the configured Library. """
+    from MainUI import Book, open_library
+
+    if len(sys.argv) < 2:
+        print("usage: python library_import.py books.csv [more.jsonl ...]")
+        return
+    collection, storage = open_library()
+    try:
+        _, rejected = import_books(collection, sys.argv[1:], Book)
+    finally:
+        storage.close()
+    for path, number, reason in rejected[:20]:
+        print(f"  {path} line {number}: {reason}")
+    if len(rejected) > 20:
+        print(f"  ...and {len(rejected) - 20:,} more")
+
+
+# Execute Program
+if __name__ == '__main__':
+    # library.pickle refers to the Library classes as __main__.*, since MainUI.py is run as a script...make the
+    # names resolvable from this script too
+    from MainUI import Book, Library, SearchIndex
+    main()
@@ -0,0 +1,291 @@
+# library_journal.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Write-ahead journal for the Library.  Each change to the catalogue is appended to
+#              library.journal instead of re-pickling the whole Library, and library.pickle becomes a snapshot
+#              that is rewritten in the background once the journal has grown.
+
+# ---------- Imports ----------
+import contextlib
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+# ---------- Constants ----------
+# Every journal record is [4-byte payload length][4-byte CRC-32 of the payload][payload], the payload being
+# a pickled (sequence number, change) pair.  A record cut short by a crash fails its length or CRC check, and
+# it and anything after it are dropped
+RECORD_HEADER = struct.Struct('!II')
+
+SYNC_INTERVAL = 0.05                    # seconds between batched fsyncs of the journal
+COMPACT_MIN = 1 << 20                   # never compact a journal smaller than this (bytes)...
+COMPACT_RATIO = 0.5                     # ...or smaller than this fraction of the snapshot
+
+
+# ---------- Functions ----------
+def fsync_directory(path) -> None:
+    """ Makes a rename or new file in a directory durable (a no-op where directories can't be opened). """
+    try:
+        descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def read_records(path) -> tuple:
+    """
+    Reads the intact records of a journal file.
+    :return: ([(sequence number, change)...], the length of the file up to the end of the last intact record)
+    """
+    records = []
+    good = 0
+    try:
+        with open(path, 'rb') as infile:
+            data = infile.read()
+    except FileNotFoundError:
+        return records, good
+
+    while good + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, good)
+        start = good + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        records.append(pickle.loads(payload))
+        good = start + length
+    return records, good
+
+
+# ---------- Classes ----------
+class PickleFormat:
+    """ Library snapshots as one pickle of the whole Library (library.pickle). """
+
+    @staticmethod
+    def dumps(library) -> bytes:
+        """ Encodes a Library as a snapshot. """
+        return pickle.dumps(library, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """ Reads a snapshot back as a Library (FileNotFoundError if there is none). """
+        with open(path, 'rb') as infile:
+            return pickle.load(infile)
+
+
+class LibraryJournal:
+    """
+    Keeps a Library on disk as a snapshot (library.pickle) plus a journal of every change since it was taken.
+
+    The Library calls append() with each change it makes (see Library.record).  Appends are buffered and
+    fsync'd by a background thread every SYNC_INTERVAL seconds, so a burst of edits shares one fsync; sync()
+    forces it.  When the journal outgrows COMPACT_MIN and COMPACT_RATIO of the snapshot, compact() moves the
+    journal aside and a background thread builds the new snapshot from the old one plus that journal, never
+    touching the live Library, so the cost of an edit does not depend on the size of the catalogue.  (The
+    thread holds a second copy of the Library while it works, and shares the interpreter with the editing
+    thread, so a very large catalogue can still slow edits made during a compaction.)
+
+    Records are numbered, and each snapshot remembers the last record it includes (Library.journal_seq), so
+    loading never applies a change twice, whichever step of a compaction a crash interrupts.
+    """
+
+    def __init__(self, snapshot_path='library.pickle', journal_path='library.journal',
+                 sync_interval=SYNC_INTERVAL, snapshot_format=PickleFormat):
+        """
+        Sets up the journal for a snapshot file; load() opens it.
+        :param snapshot_format: reads and writes the snapshot file (PickleFormat, or a CatalogueFormat)
+        """
+        self.snapshot_path = snapshot_path
+        self.snapshot_format = snapshot_format
+        self.journal_path = journal_path
+        self.frozen_path = journal_path + '.old'    # the journal being folded into a snapshot
+        self.sync_interval = sync_interval
+        self.library = None
+        self.file = None
+        self.seq = 0                    # number of the last record written
+        self.size = 0                   # bytes in the current journal file
+        self.snapshot_size = 0
+        self.dirty = False              # written but not yet fsync'd
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.syncer = None
+        self.compactor = None
+        self.compaction_held = False    # set during a bulk import, which compacts once at the end
+
+    def load(self, new_library):
+        """
+        Loads the last snapshot, or makes an empty library with new_library() if there is none, and replays
+        the journal onto it.  From then on the library's changes are recorded here.
+        :return: the Library
+        """
+
+        try:
+            library = self.snapshot_format.load(self.snapshot_path)
+            self.snapshot_size = os.path.getsize(self.snapshot_path)
+        except FileNotFoundError:
+            library = new_library()
+        self.seq = library.journal_seq
+
+        # a frozen journal means the last compaction never finished...its records come first
+        interrupted = os.path.exists(self.frozen_path)
+        for path in (self.frozen_path, self.journal_path):
+            records, good = read_records(path)
+            for seq, change in records:
+                if seq > self.seq:
+                    library.apply(change)
+                    self.seq = seq
+            if path == self.journal_path and os.path.exists(path) and good < os.path.getsize(path):
+                # drop a torn record left by a crash, so new records follow the last intact one
+                with open(path, 'r+b') as torn:
+                    torn.truncate(good)
+
+        self.library = library
+        self.file = open(self.journal_path, 'ab')
+        self.size = self.file.tell()
+        library.journal = self
+
+        self.syncer = threading.Thread(target=self.sync_loop, daemon=True)
+        self.syncer.start()
+        if interrupted:
+            self.compact(wait=True)
+        return library
+
+    def append(self, change) -> None:
+        """ Adds a change to the journal.  It reaches the disk within sync_interval, or at the next sync(). """
+        with self.lock:
+            self.seq += 1
+            payload = pickle.dumps((self.seq, change), protocol=pickle.HIGHEST_PROTOCOL)
+            self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            self.file.write(payload)
+            self.size += RECORD_HEADER.size + len(payload)
+            self.dirty = True
+        if self.needs_compaction():
+            self.compact()
+
+    def needs_compaction(self) -> bool:
+        """ True if the journal has outgrown the snapshot and no compaction is running or held off. """
+        return self.size > max(COMPACT_MIN, self.snapshot_size * COMPACT_RATIO) and not self.compacting() and \
+            not self.compaction_held
+
+    @contextlib.contextmanager
+    def holding_compaction(self):
+        """
+        Holds off compaction for a bulk change, which would otherwise re-encode the growing Library several
+        times over, then compacts once if the journal has outgrown the snapshot.
+        """
+        self.compaction_held = True
+        try:
+            yield
+        finally:
+            self.compaction_held = False
+        if self.needs_compaction():
+            self.compact()
+
+    def sync(self) -> None:
+        """ Writes and fsyncs everything appended so far. """
+        with self.lock:
+            if self.dirty:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.dirty = False
+
+    def sync_loop(self) -> None:
+        """ Background thread: fsyncs the journal every sync_interval while there is something to sync. """
+        while not self.stopping.wait(self.sync_interval):
+            try:
+                self.sync()
+            except (OSError, ValueError):
+                # the file was closed under us...close() does the last sync itself
+                pass
+
+    def compacting(self) -> bool:
+        """ True while a new snapshot is being written. """
+        return self.compactor is not None and self.compactor.is_alive()
+
+    def compact(self, wait=False) -> None:
+        """
+        Starts a new snapshot: moves the journal aside and starts a fresh one, then (in the background, or
+        before returning if 'wait') replays the moved journal onto a copy of the last snapshot and writes that
+        as the new one.  The editing thread only pays for the rename and an fsync.
+        """
+
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.lock:
+            # a frozen journal still here means its snapshot was never written...it must not be overwritten,
+            # so encode the live Library now and leave the journal where it is (its records are all in it).
+            # The same goes for the very first snapshot, with no earlier one to build on.  Only happens on
+            # recovery after a crash during a compaction, or once for a new library
+            rotate = not os.path.exists(self.frozen_path) and os.path.exists(self.snapshot_path)
+            if not rotate:
+                self.library.journal_seq = self.seq
+                data = self.snapshot_format.dumps(self.library)
+            else:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                os.replace(self.journal_path, self.frozen_path)
+                self.file = open(self.journal_path, 'ab')
+                self.size = 0
+                self.dirty = False
+                seq = self.seq
+                # not journaled (they are only hints for new_serial), so carry them over as they are now
+                counters = dict(self.library.serial_counters)
+        if not rotate:
+            self.write_snapshot(data)
+            return
+        fsync_directory(self.journal_path)
+
+        self.compactor = threading.Thread(target=self.rebuild_snapshot, args=(seq, counters), daemon=True)
+        self.compactor.start()
+        if wait:
+            self.compactor.join()
+
+    def rebuild_snapshot(self, seq, counters) -> None:
+        """
+        Background thread: loads the last snapshot, applies the frozen journal's records to it (up to record
+        'seq') and writes the result as the new snapshot.
+        """
+        library = self.snapshot_format.load(self.snapshot_path)
+        for record_seq, change in read_records(self.frozen_path)[0]:
+            if library.journal_seq < record_seq <= seq:
+                library.apply(change)
+        library.journal_seq = seq
+        library.serial_counters = counters
+        self.write_snapshot(self.snapshot_format.dumps(library))
+
+    def write_snapshot(self, data) -> None:
+        """ Replaces the snapshot file with 'data' (atomically), then deletes the journal it makes redundant. """
+        temporary = self.snapshot_path + '.tmp'
+        with open(temporary, 'wb') as outfile:
+            outfile.write(data)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temporary, self.snapshot_path)
+        fsync_directory(self.snapshot_path)
+        if os.path.exists(self.frozen_path):
+            os.remove(self.frozen_path)
+        self.snapshot_size = len(data)
+
+    def close(self, compact=True) -> None:
+        """
+        Stops the background threads and syncs the journal.  If 'compact', the journal is first folded into a
+        new snapshot when it has outgrown the last one (or there is no snapshot yet, or a compaction was cut
+        short); otherwise it is left to be replayed on the next open, so closing after a few edits is cheap.
+        """
+        if self.compactor is not None:
+            self.compactor.join()
+        if compact and (self.needs_compaction() or os.path.exists(self.frozen_path)
+                        or not os.path.exists(self.snapshot_path)):
+            self.compact(wait=True)
+        self.stopping.set()
+        self.syncer.join()
+        self.sync()
+        self.file.close()
+        self.library.journal = None
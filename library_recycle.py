@@ -0,0 +1,228 @@
+# library_recycle.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: The recycle bin: deleted books kept in one append-only file, library.recycle, instead of a
+#              <serial>.pickle file each.  An index of the file by serial (in deletion order) is built when it
+#              is opened, so listing a page, restoring a book or purging old ones never scans the directory.
+
+# ---------- Imports ----------
+import itertools
+import mmap
+import os
+import pickle
+import struct
+import time
+import zlib
+
+from library_journal import fsync_directory
+
+# ---------- Constants ----------
+# Every record is [header][serial, UTF-8][payload].  The header holds the payload's length and CRC-32, the
+# time of the deletion, what the record does (PUT: a deleted book, its payload the pickled Book.get_values();
+# TAKE: the book was restored, no payload) and the serial's length.  Opening the file reads the headers and
+# serials only; a payload is read, and its CRC checked, when its book is asked for
+RECORD_HEADER = struct.Struct('!IIdBH')
+PUT = 1
+TAKE = 0
+
+RECYCLE_PATH = 'library.recycle'
+PAGE_SIZE = 10                          # recycled books listed per page
+REWRITE_MIN = 1000                      # restored books left in the file before it is rewritten without them
+
+
+# ---------- Classes ----------
+class RecycleBin:
+    """
+    The books deleted from a Library, until they are restored or purged.
+
+    'index' maps each recycled serial to (record offset, record length, deletion time), in the order the books
+    were deleted, so a restore is one seek and read, and listing newest first walks the index backwards.
+    Records of restored books stay in the file until they outnumber the books still in it (or a purge), when
+    the file is rewritten.
+    """
+
+    def __init__(self, path=RECYCLE_PATH, book_class=None):
+        """
+        Opens (or creates) a recycle file, indexing the records in it.  A record cut short by a crash is
+        dropped.
+        :param path: the recycle file
+        :param book_class: the Book class to restore into (MainUI.Book)
+        """
+        self.path = path
+        self.book_class = book_class
+        self.index = {}                 # serial: (offset, length, deleted at), oldest deletion first
+        self.dead = 0                   # records in the file for books no longer in the bin
+        good = self.scan()
+        self.file = open(path, 'ab')
+        if self.file.tell() != good:
+            self.file.truncate(good)
+            self.file.seek(good)
+
+    # ----- METHODS -----
+    def scan(self) -> int:
+        """ Builds the index from the record headers.  :return: the length of the intact part of the file """
+        good = 0
+        try:
+            infile = open(self.path, 'rb')
+        except FileNotFoundError:
+            return good
+        with infile:
+            size = os.fstat(infile.fileno()).st_size
+            if not size:
+                return good
+            buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        with buffer:
+            while good + RECORD_HEADER.size <= size:
+                length, _, deleted_at, kind, serial_length = RECORD_HEADER.unpack_from(buffer, good)
+                start = good + RECORD_HEADER.size
+                end = start + serial_length + length
+                # only the last record can have been torn by a crash...check it in full
+                if end > size or (end == size and self.read_record(good, end - good) is None):
+                    break
+                serial = buffer[start:start + serial_length].decode()
+                if serial in self.index:
+                    self.dead += 1
+                    del self.index[serial]
+                if kind == PUT:
+                    self.index[serial] = (good, end - good, deleted_at)
+                else:
+                    self.dead += 1
+                good = end
+        return good
+
+    def read_record(self, offset, length):
+        """ The (serial, payload) of the record at 'offset', or None if it fails its CRC check. """
+        with open(self.path, 'rb') as infile:
+            infile.seek(offset)
+            data = infile.read(length)
+        if len(data) < RECORD_HEADER.size:
+            return None
+        payload_length, checksum, _, _, serial_length = RECORD_HEADER.unpack_from(data)
+        start = RECORD_HEADER.size + serial_length
+        payload = data[start:start + payload_length]
+        if len(payload) < payload_length or zlib.crc32(data[RECORD_HEADER.size:start] + payload) != checksum:
+            return None
+        return data[RECORD_HEADER.size:start].decode(), payload
+
+    @staticmethod
+    def encode(kind, serial, deleted_at, payload=b'') -> bytes:
+        """ A whole record. """
+        encoded = serial.encode()
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(encoded + payload), deleted_at, kind,
+                                  len(encoded)) + encoded + payload
+
+    def append(self, record) -> int:
+        """ Writes a record durably at the end of the file.  :return: its offset """
+        offset = self.file.tell()
+        self.file.write(record)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return offset
+
+    def put(self, book, deleted_at=None) -> None:
+        """ Recycles a book (replacing any older copy with the same serial). """
+        deleted_at = time.time() if deleted_at is None else deleted_at
+        record = self.encode(PUT, book.get_serial(), deleted_at,
+                             pickle.dumps(book.get_values(), protocol=pickle.HIGHEST_PROTOCOL))
+        if book.get_serial() in self.index:
+            self.dead += 1
+            del self.index[book.get_serial()]
+        self.index[book.get_serial()] = (self.append(record), len(record), deleted_at)
+
+    def get(self, serial):
+        """ The recycled book with a serial, left in the bin (KeyError if there is none). """
+        offset, length, _ = self.index[serial]
+        record = self.read_record(offset, length)
+        if record is None:
+            raise ValueError(f"the recycled record of {serial} in {self.path} is damaged")
+        return self.book_class.from_values(pickle.loads(record[1]))
+
+    def discard(self, serial) -> None:
+        """ Takes a book out of the bin (once it has been restored), if it is there. """
+        if serial not in self.index:
+            return
+        self.append(self.encode(TAKE, serial, time.time()))
+        del self.index[serial]
+        self.dead += 2
+        if self.dead > max(REWRITE_MIN, len(self.index)):
+            self.rewrite(self.index)
+
+    def take(self, serial):
+        """ Removes a book from the bin and returns it (KeyError if there is none). """
+        book = self.get(serial)
+        self.discard(serial)
+        return book
+
+    def __contains__(self, serial) -> bool:
+        return serial in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def deleted_at(self, serial) -> float:
+        """ When the book with a serial was recycled (time.time() seconds). """
+        return self.index[serial][2]
+
+    def page(self, number, page_size=PAGE_SIZE) -> list:
+        """ The serials on a page (numbered from 0) of the bin's books, most recently deleted first. """
+        return list(itertools.islice(reversed(self.index), number * page_size, (number + 1) * page_size))
+
+    def page_count(self, page_size=PAGE_SIZE) -> int:
+        """ The number of pages the bin's books fill. """
+        return max(1, -(-len(self.index) // page_size))
+
+    def purge(self, older_than) -> int:
+        """
+        Permanently deletes the books recycled more than 'older_than' seconds ago, with one rewrite of the file.
+        :return: the number of books purged
+        """
+        cutoff = time.time() - older_than
+        keep = {serial: entry for serial, entry in self.index.items() if entry[2] >= cutoff}
+        purged = len(self.index) - len(keep)
+        if purged:
+            self.rewrite(keep)
+        return purged
+
+    def rewrite(self, keep) -> None:
+        """ Replaces the file with one holding only the records in 'keep' (a slice of the index). """
+        temporary = self.path + '.tmp'
+        index = {}
+        with open(self.path, 'rb') as infile, open(temporary, 'wb') as outfile:
+            for serial, (offset, length, deleted_at) in keep.items():
+                infile.seek(offset)
+                index[serial] = (outfile.tell(), length, deleted_at)
+                outfile.write(infile.read(length))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        self.file.close()
+        os.replace(temporary, self.path)
+        fsync_directory(self.path)
+        self.file = open(self.path, 'ab')
+        self.index = index
+        self.dead = 0
+
+    def adopt_files(self, serials) -> int:
+        """
+        Moves books recycled by older versions, one <serial>.pickle file each, into the bin.  Only the files of
+        serials the library lists as recycled are read (library.pickle and the other data files are not).
+        :param serials: the serials of the library's recycled books
+        :return: the number of files moved
+        """
+        moved = 0
+        for serial in serials:
+            filename = f"{serial}.pickle"
+            try:
+                with open(filename, 'rb') as infile:
+                    book = pickle.load(infile)
+                deleted_at = os.path.getmtime(filename)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+                continue
+            if serial not in self.index:
+                self.put(book, deleted_at)
+            os.remove(filename)
+            moved += 1
+        return moved
+
+    def close(self) -> None:
+        """ Closes the file. """
+        self.file.close()
@@ -0,0 +1,331 @@
+# library_search.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Search helpers: results fetched as they are needed, for showing a large search a page at a
+#              time, and a BK-tree for finding titles and authors despite spelling mistakes.
+
+# ---------- Imports ----------
+import bisect
+import heapq
+import itertools
+
+# ---------- Constants ----------
+PAGE_SIZE = 10                          # books shown per page of results
+COMPLETION_SCAN = 2000                  # most keys a prefix can match and still be ranked by reading them all
+COMPLETION_CACHE = 50000                # most prefixes whose ranked completions are kept
+
+
+# ---------- Classes ----------
+class SearchResults:
+    """
+    The serial numbers a title or author search matched, taken from the search only as far as the pages
+    looked at need.  results[n] is the n'th serial (fetching up to it), so the results can stand in for the
+    list of serials the search_* methods return.
+    """
+
+    def __init__(self, serials, total, page_size=PAGE_SIZE):
+        """
+        :param serials: an iterable of the matching serials, read lazily
+        :param total: how many there are (or an estimate)
+        :param page_size: serials per page
+        """
+        self.pending = iter(serials)
+        self.fetched = []
+        self.total = total
+        self.page_size = page_size
+        self.exhausted = False
+
+    # ----- METHODS -----
+    def fetch(self, count) -> None:
+        """ Reads serials from the search until 'count' have been fetched, or there are no more. """
+        if count > len(self.fetched) and not self.exhausted:
+            self.fetched.extend(itertools.islice(self.pending, count - len(self.fetched)))
+            if len(self.fetched) < count:
+                self.exhausted = True
+                self.total = len(self.fetched)
+
+    def page(self, number) -> list:
+        """ The serials on a page of results (numbered from 0), empty past the last one. """
+        start = number * self.page_size
+        self.fetch(start + self.page_size)
+        return self.fetched[start:start + self.page_size]
+
+    def page_count(self) -> int:
+        """ The number of pages the results (are expected to) fill. """
+        return max(1, -(-self.total // self.page_size))
+
+    def __getitem__(self, index):
+        """ The serial at a position in the results (IndexError past the end). """
+        if index < 0:
+            raise IndexError(index)
+        self.fetch(index + 1)
+        return self.fetched[index]
+
+    def __bool__(self) -> bool:
+        self.fetch(1)
+        return bool(self.fetched)
+
+
+class BKTree:
+    """
+    A BK-tree: finds the keys (titles or author names) within a few typing mistakes of a search term without
+    comparing the term with all of them.
+
+    Each node's children are filed by their edit distance from it.  By the triangle inequality a key within
+    'r' of the term can only be under a child whose distance from its parent is within 'r' of the parent's own
+    distance from the term, so most branches are never visited.  Distances ignore case.  Removed keys are only
+    marked as gone, and the tree is rebuilt once they outnumber the rest.
+    """
+
+    def __init__(self, keys=()):
+        """ Builds a tree of some keys. """
+        self.root = None                # [key, casefolded key, {distance: child node}, still in the tree?]
+        self.size = 0                   # keys in the tree
+        self.removed = 0                # nodes kept for keys since removed
+        for key in keys:
+            self.add(key)
+
+    # ----- METHODS -----
+    def find_node(self, key, folded, masks):
+        """ Walks to the node of a key.  :return: (the node or None, the last node visited, its distance) """
+        node, distance = self.root, None
+        while node is not None:
+            distance = edit_distance(masks, len(folded), node[1])
+            if distance == 0 and node[0] == key:
+                return node, node, 0
+            child = node[2].get(distance)
+            if child is None:
+                return None, node, distance
+            node = child
+        return None, None, distance
+
+    def add(self, key) -> None:
+        """ Puts a key in the tree.  Adding one already there does nothing. """
+        folded = key.casefold()
+        found, parent, distance = self.find_node(key, folded, pattern_masks(folded))
+        if found is not None:
+            if not found[3]:
+                found[3] = True
+                self.removed -= 1
+                self.size += 1
+            return
+        node = [key, folded, {}, True]
+        if parent is None:
+            self.root = node
+        else:
+            parent[2][distance] = node
+        self.size += 1
+
+    def remove(self, key) -> None:
+        """ Takes a key out of the tree, if it is there. """
+        folded = key.casefold()
+        found = self.find_node(key, folded, pattern_masks(folded))[0]
+        if found is None or not found[3]:
+            return
+        found[3] = False
+        self.size -= 1
+        self.removed += 1
+        if self.removed > self.size:
+            self.__init__(list(self))
+
+    def changed(self, key) -> None:
+        """ A key's books changed...distances don't depend on them, so there is nothing to do. """
+
+    def __iter__(self):
+        """ The keys in the tree. """
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            if node[3]:
+                yield node[0]
+            stack.extend(node[2].values())
+
+    def __len__(self) -> int:
+        return self.size
+
+    def closest(self, term, k=5, max_distance=2) -> list:
+        """
+        The k keys closest to a term, at most max_distance edits away, nearest first (among keys at the same
+        distance, which ones make the k is arbitrary).
+        Once k keys are found the search only looks for closer ones.
+        """
+        folded = term.casefold()
+        masks = pattern_masks(folded)
+        length = len(folded)
+        best = []                       # heap of (-distance, key): the furthest of the best k on top
+        radius = max_distance
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            children = node[2]
+            # a distance beyond every child's edge + radius rules them all out, whatever its exact value
+            limit = radius + (max(children) if children else 0)
+            if abs(len(node[1]) - length) > limit:
+                continue
+            distance = edit_distance(masks, length, node[1])
+            if node[3] and distance <= radius:
+                heapq.heappush(best, (-distance, node[0]))
+                if len(best) > k:
+                    heapq.heappop(best)
+                if len(best) == k:
+                    radius = -best[0][0]
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return [key for _, key in sorted((-negative, key) for negative, key in best)]
+
+
+class Completions:
+    """
+    Type-ahead completion of titles or author names: the keys in a list sorted by their casefolded form, so
+    those starting with a prefix are found by bisection next to each other.
+
+    A prefix matching up to COMPLETION_SCAN keys is ranked by weighing them all, and the ranking is kept until
+    a key starting with it is added, removed or changes weight (changed()).  A prefix matching more keeps its
+    leaders instead: its k heaviest keys, ranked once by weighing every match, plus the keys touched since.
+    Asking again weighs just the touched keys and merges them in, so a short prefix costs a bisection and
+    O(touched + k) however many keys it matches; only a leader getting lighter (or removed) means ranking the
+    prefix again from scratch, since the key that takes its place may be any of the others.
+    """
+
+    def __init__(self, keys=()):
+        """ Builds the sorted list of some keys. """
+        self.entries = sorted((key.casefold(), key) for key in keys)
+        self.ranked = {}                # casefolded prefix: (k, its k best completions)
+        self.leaders = {}               # casefolded prefix matching many keys: [k, its k best, keys touched since]
+
+    # ----- METHODS -----
+    def changed(self, key) -> None:
+        """ Forgets the ranked completions of every prefix of a key (its weight or presence changed). """
+        if self.ranked or self.leaders:
+            folded = key.casefold()
+            for length in range(len(folded) + 1):
+                self.ranked.pop(folded[:length], None)
+                leaders = self.leaders.get(folded[:length])
+                if leaders is not None:
+                    leaders[2].add(key)
+                    if len(leaders[2]) > COMPLETION_SCAN:
+                        del self.leaders[folded[:length]]
+
+    def clear_cache(self) -> None:
+        """ Forgets every ranking kept, so each prefix is ranked from scratch when next completed. """
+        self.ranked.clear()
+        self.leaders.clear()
+
+    def add(self, key) -> None:
+        """ Adds a key, unless it is there already (either way its weight may have changed). """
+        self.changed(key)
+        entry = (key.casefold(), key)
+        position = bisect.bisect_left(self.entries, entry)
+        if position == len(self.entries) or self.entries[position] != entry:
+            self.entries.insert(position, entry)
+
+    def add_many(self, keys) -> None:
+        """ Adds new keys: more than a few at once are merged in with one sort instead of one insert each. """
+        if len(keys) < 100:
+            for key in keys:
+                self.add(key)
+        else:
+            self.clear_cache()
+            self.entries.extend((key.casefold(), key) for key in keys)
+            self.entries.sort()
+
+    def remove(self, key) -> None:
+        """ Takes a key out, if it is there. """
+        self.changed(key)
+        entry = (key.casefold(), key)
+        position = bisect.bisect_left(self.entries, entry)
+        if position < len(self.entries) and self.entries[position] == entry:
+            del self.entries[position]
+
+    def __contains__(self, key) -> bool:
+        entry = (key.casefold(), key)
+        position = bisect.bisect_left(self.entries, entry)
+        return position < len(self.entries) and self.entries[position] == entry
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def complete(self, prefix, k, weight) -> list:
+        """
+        The k keys starting with 'prefix' (ignoring case) that weigh the most, ties alphabetically.
+        :param weight: key -> its relevance, e.g. how many books have that title
+        """
+        folded = prefix.casefold()
+        known = self.ranked.get(folded)
+        if known is not None and known[0] >= k:
+            return known[1][:k]
+        start = bisect.bisect_left(self.entries, (folded,))
+        end = bisect.bisect_left(self.entries, (folded + '\U0010ffff',), start)
+        if end - start > COMPLETION_SCAN:
+            return [key for _, _, key in self.lead(folded, k, weight, start, end)[:k]]
+        ranked = heapq.nsmallest(k, self.entries[start:end], key=lambda entry: (-weight(entry[1]), entry))
+        if len(self.ranked) >= COMPLETION_CACHE:
+            self.ranked.clear()
+        self.ranked[folded] = (k, [key for _, key in ranked])
+        return self.ranked[folded][1]
+
+    def lead(self, folded, k, weight, start, end) -> list:
+        """
+        The leaders of a prefix matching many keys (entries[start:end]) as (-weight, casefolded, key), brought
+        up to date with the keys touched since they were ranked, or ranked again if that cannot be done.
+        """
+        leaders = self.leaders.get(folded)
+        if leaders is not None and leaders[0] >= k and leaders[2]:
+            kept, ranked, touched = leaders
+            members = {leader[2]: leader for leader in ranked}
+            for key in touched:
+                old = members.get(key)
+                new = (-weight(key), key.casefold(), key) if key in self else None
+                if old is not None and len(ranked) == kept and (new is None or new > old):
+                    leaders = None
+                    break
+                if new is None:
+                    members.pop(key, None)
+                else:
+                    members[key] = new
+            else:
+                leaders[1] = heapq.nsmallest(kept, members.values())
+                touched.clear()
+        if leaders is None or leaders[0] < k:
+            ranked = heapq.nsmallest(k, ((-weight(key), casefolded, key)
+                                         for casefolded, key in self.entries[start:end]))
+            leaders = self.leaders[folded] = [k, ranked, set()]
+        return leaders[1]
+
+
+# ---------- Functions ----------
+def pattern_masks(text) -> dict:
+    """ For edit_distance: each character of 'text' mapped to a bit mask of the positions it is at. """
+    masks = {}
+    for position, character in enumerate(text):
+        masks[character] = masks.get(character, 0) | (1 << position)
+    return masks
+
+
+def edit_distance(masks, length, other) -> int:
+    """
+    The Levenshtein distance between a text (given as its pattern_masks and length) and 'other', by Myers'
+    bit-parallel algorithm: a whole column of the distance table is updated with a few integer operations
+    per character of 'other'.
+    """
+    if not length:
+        return len(other)
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    positive, negative, score = full, 0, length
+    for character in other:
+        match = masks.get(character, 0)
+        vertical = match | negative
+        horizontal = (((match & positive) + positive) ^ positive) | match
+        up = negative | ~(horizontal | positive)
+        down = positive & horizontal
+        if up & last:
+            score += 1
+        elif down & last:
+            score -= 1
+        up = (up << 1) | 1
+        down <<= 1
+        positive = (down | ~(vertical | up)) & full
+        negative = up & vertical & full
+    return score
@@ -0,0 +1,448 @@
+# library_sqlite.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: SQLite storage for the Library catalogue.  The books live in indexed tables in library.db and
+#              are queried as needed, so the catalogue no longer has to fit in memory or be loaded at startup.
+#              Run this file to copy an existing library.pickle into library.db:
+#                   python library_sqlite.py [library.pickle] [library.db]
+
+# ---------- Imports ----------
+import os
+import re
+import sqlite3
+import sys
+import time
+from library_recycle import RECYCLE_PATH, RecycleBin
+from library_search import PAGE_SIZE, BKTree, Completions, SearchResults
+
+# ---------- Constants ----------
+COUNT_SINGLY = 20                       # values a completion counts one query each before counting them all at once
+
+# Book attributes, in table column order
+COLUMNS = ('serial', 'title', 'author', 'isbn', 'year', 'publisher', 'price', 'rating', 'summary', 'checked_out')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    serial TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    isbn INTEGER,
+    year INTEGER,
+    publisher TEXT,
+    price REAL,
+    rating INTEGER,
+    summary TEXT,
+    checked_out INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS books_title ON books (title);
+CREATE INDEX IF NOT EXISTS books_author ON books (author);
+CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+CREATE INDEX IF NOT EXISTS books_year ON books (year);
+CREATE INDEX IF NOT EXISTS books_checked_out ON books (author, title) WHERE checked_out;
+CREATE INDEX IF NOT EXISTS books_title_nocase ON books (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_author_nocase ON books (author COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS recycled (serial TEXT PRIMARY KEY, filename TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS serial_counters (prefix TEXT PRIMARY KEY, next INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value);
+"""
+
+# Trigram full-text index over titles and authors, kept in step with 'books' by triggers, so partial-word
+# search does not read every row.  Needs SQLite 3.34+; without it search falls back to scanning the table
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_text USING fts5(
+    title, author, content='books', content_rowid='rowid', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS books_text_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_text (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_text_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_text (books_text, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_text_update AFTER UPDATE OF title, author ON books BEGIN
+    INSERT INTO books_text (books_text, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+    INSERT INTO books_text (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+END;
+"""
+
+
+# ---------- Classes ----------
+class SqliteLibrary:
+    """
+    A Library kept in an SQLite database instead of in memory.  It offers the same methods the menus use on a
+    Library (add_book, insert_book, delete_book, book_by_*, info_by_*, search_*, checkout, checkin, banner...),
+    each one an indexed query or a single committed transaction.
+
+    Books come back as new Book objects built from their rows, so change them through these methods, not by
+    setting their attributes.
+    """
+
+    def __init__(self, path='library.db', book_class=None):
+        """
+        Opens (or creates) a library database.
+        :param path: the database file
+        :param book_class: the Book class to build results with (MainUI.Book)
+        """
+        self.path = path
+        self.book_class = book_class
+        # (BKTree or Completions, column): that index of the column's distinct values, built on first use
+        self.key_indexes = {}
+        self.recycle_bin = None         # RecycleBin holding the deleted books (opened by MainUI.open_library)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(SEARCH_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False
+        self.db.commit()
+
+    # ----- METHODS -----
+    def make_book(self, row):
+        """ Builds a Book from a row of the books table. """
+        book = self.book_class.__new__(self.book_class)
+        state = dict(zip(COLUMNS, row))
+        state['checked_out'] = bool(state['checked_out'])
+        book.__setstate__(state)
+        return book
+
+    def first_book(self, query, value):
+        """ The first book a query finds, or False if there is none. """
+        row = self.db.execute(query, (value,)).fetchone()
+        if row is None:
+            return False
+        return self.make_book(row)
+
+    def has_book(self, serial) -> bool:
+        """ True if a serial number belongs to a book in the library. """
+        return self.db.execute("SELECT 1 FROM books WHERE serial = ?", (serial,)).fetchone() is not None
+
+    def book_count(self) -> int:
+        """ The number of books in the library. """
+        return self.db.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def book_by_serial(self, target):
+        """ Returns a book object based on serial number (KeyError if there is none, as with a Library). """
+        book = self.first_book(f"SELECT {', '.join(COLUMNS)} FROM books WHERE serial = ?", target)
+        if book is False:
+            raise KeyError(target)
+        return book
+
+    def book_by_author(self, target):
+        """ Returns one of an author's books, or False if the author has none. """
+        return self.first_book(f"SELECT {', '.join(COLUMNS)} FROM books WHERE author = ? LIMIT 1", target)
+
+    def book_by_title(self, target):
+        """ Returns a book with a title, or False if there is none. """
+        return self.first_book(f"SELECT {', '.join(COLUMNS)} FROM books WHERE title = ? LIMIT 1", target)
+
+    def iter_books(self):
+        """ Yields every book in the library, a row at a time. """
+        for row in self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM books"):
+            yield self.make_book(row)
+
+    def info_by_serial(self, target) -> dict:
+        """ Returns a dictionary of all a book's information, accessed by serial number """
+        return self.book_by_serial(target).get_info()
+
+    def info_by_author(self, auth) -> (dict or bool):
+        """ Returns a dictionary of all a book's information, accessed by author name, or False """
+        book = self.book_by_author(auth)
+        return book.get_info() if book else False
+
+    def info_by_title(self, target_title) -> (dict or bool):
+        """ Returns a dictionary of all a book's information, accessed by title, or False """
+        book = self.book_by_title(target_title)
+        return book.get_info() if book else False
+
+    def search_query(self, column, term, available=False) -> tuple:
+        """
+        The query for the serials of the books whose 'column' (title or author) contains 'term', exactly as
+        Python's 'in' would match it.  The trigram index finds candidates (it ignores case), then instr() checks
+        them.
+        :param available: only the books that are not checked out
+        :return: (SQL, parameters)
+        """
+        condition = " AND NOT books.checked_out" if available else ""
+        if self.full_text and len(term) >= 3:
+            phrase = '"' + term.replace('"', '""') + '"'
+            return (f"SELECT books.serial FROM books_text JOIN books ON books.rowid = books_text.rowid "
+                    f"WHERE books_text MATCH ? AND instr(books.{column}, ?) > 0{condition}",
+                    (f"{column} : {phrase}", term))
+        return f"SELECT serial FROM books WHERE instr({column}, ?) > 0{condition}", (term,)
+
+    def search(self, column, term) -> list:
+        """ The serials of the books whose 'column' (title or author) contains 'term'. """
+        return [row[0] for row in self.db.execute(*self.search_query(column, term))]
+
+    def search_results(self, field, term, page_size=PAGE_SIZE, available=False) -> SearchResults:
+        """
+        A title or author search ('field'), counted first and then read from the database a page at a time.
+        :param available: only find the books that are not checked out
+        """
+        query, parameters = self.search_query(field, term, available)
+        total = self.db.execute(f"SELECT COUNT(*) FROM ({query})", parameters).fetchone()[0]
+        return SearchResults((row[0] for row in self.db.execute(query, parameters)), total, page_size)
+
+    def closest(self, column, term, k=5, max_distance=2) -> list:
+        """
+        Up to k distinct values of 'column' (title or author) within max_distance edits of 'term', nearest
+        first.  The column's BK-tree is built from the table the first time.
+        """
+        return self.key_index(BKTree, column).closest(term, k, max_distance)
+
+    def key_index(self, kind, column):
+        """ The BKTree or Completions of a column's distinct values, building it from the table the first time. """
+        if (kind, column) not in self.key_indexes:
+            self.key_indexes[kind, column] = kind(
+                [row[0] for row in self.db.execute(f"SELECT DISTINCT {column} FROM books")])
+        return self.key_indexes[kind, column]
+
+    def complete(self, column, prefix, k=10) -> list:
+        """
+        Up to k values of 'column' (title or author) starting with 'prefix', those with the most books first.
+        The first few values weighed (e.g. those changed since the prefix was last ranked) are counted one
+        query each; past COUNT_SINGLY, every value starting with the prefix is counted in one grouped query,
+        a range of the NOCASE index.  A value it misses (one whose casefolded form starts with the prefix but
+        not ignoring ASCII case, as LIKE does) is still counted on its own.
+        """
+        counts = None
+        weighed = 0
+
+        def weight(key):
+            nonlocal counts, weighed
+            weighed += 1
+            if counts is None and weighed > COUNT_SINGLY:
+                pattern = re.sub(r'([\\%_])', r'\\\1', prefix) + '%'
+                counts = dict(self.db.execute(f"SELECT {column}, COUNT(*) FROM books WHERE {column} LIKE ? "
+                                              f"ESCAPE '\\' GROUP BY {column}", (pattern,)))
+            if counts is not None and key in counts:
+                return counts[key]
+            return self.db.execute(f"SELECT COUNT(*) FROM books WHERE {column} = ?", (key,)).fetchone()[0]
+
+        return self.key_index(Completions, column).complete(prefix, k, weight)
+
+    def complete_title(self, prefix, k=10) -> list:
+        """ Type-ahead for titles: up to k starting with the prefix (ignoring case), most copies first. """
+        return self.complete('title', prefix, k)
+
+    def complete_author(self, prefix, k=10) -> list:
+        """ Type-ahead for author names: up to k starting with the prefix (ignoring case), most books first. """
+        return self.complete('author', prefix, k)
+
+    def closest_titles(self, term, k=5, max_distance=2) -> list:
+        """ Finds titles despite spelling mistakes: up to k within max_distance edits, nearest first. """
+        return self.closest('title', term, k, max_distance)
+
+    def closest_authors(self, term, k=5, max_distance=2) -> list:
+        """ Finds author names despite spelling mistakes: up to k within max_distance edits, nearest first. """
+        return self.closest('author', term, k, max_distance)
+
+    def search_titles(self, term) -> list:
+        """ Finds the books whose titles contain a search term, returning their serial numbers. """
+        return self.search('title', term)
+
+    def search_authors(self, term) -> list:
+        """ Finds the books whose author names contain a search term, returning their serial numbers. """
+        return self.search('author', term)
+
+    def new_serial(self, book) -> str:
+        """
+        Returns an unused serial number for a book: [first 2 title characters] + [first 2 author characters]
+        + [the next number for that prefix], skipping numbers already in the library or recycle bin.
+        """
+        prefix = str(book.title[0:2] + book.author[0:2])
+        row = self.db.execute("SELECT next FROM serial_counters WHERE prefix = ?", (prefix,)).fetchone()
+        number = row[0] if row else 0
+        while True:
+            candidate = prefix + str(number)
+            if not self.has_book(candidate) and \
+                    self.db.execute("SELECT 1 FROM recycled WHERE serial = ?", (candidate,)).fetchone() is None:
+                break
+            number += 1
+        self.db.execute("INSERT OR REPLACE INTO serial_counters (prefix, next) VALUES (?, ?)", (prefix, number + 1))
+        return candidate
+
+    def write_book(self, book) -> None:
+        """ Adds a book's row.  Call inside a transaction. """
+        self.db.execute(f"INSERT INTO books ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                        [getattr(book, column) for column in COLUMNS])
+        for (_, column), index in self.key_indexes.items():
+            index.add(getattr(book, column))
+
+    def insert_book(self, in_book) -> None:
+        """ Adds a book keeping its serial number, or giving it a new one if that is taken (or missing). """
+        with self.db:
+            if in_book.get_serial() is None or self.has_book(in_book.get_serial()):
+                in_book.serial = self.new_serial(in_book)
+            self.write_book(in_book)
+
+    def add_book(self, new) -> None:
+        """ Assigns a book a new serial number and adds it to the library. """
+        with self.db:
+            new.serial = self.new_serial(new)
+            self.write_book(new)
+
+    def add_books(self, books) -> None:
+        """ Assigns each of a list of books a new serial number and adds them all, in one transaction. """
+        with self.db:
+            for book in books:
+                book.serial = self.new_serial(book)
+            self.db.executemany(
+                f"INSERT INTO books ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [[getattr(book, column) for column in COLUMNS] for book in books])
+            for (_, column), index in self.key_indexes.items():
+                for book in books:
+                    index.add(getattr(book, column))
+
+    def delete_book(self, target) -> str:
+        """
+        Removes a book from the library, putting it in the recycle bin (library.recycle).
+        :param target: must be a book's serial number
+        :return: the filename of the recycle bin
+        """
+        if self.recycle_bin is None:
+            self.recycle_bin = RecycleBin(RECYCLE_PATH, self.book_class)
+        self.recycle_bin.put(self.book_by_serial(target))
+        self.remove_book(target)
+        return self.recycle_bin.path
+
+    def restore_book(self, serial):
+        """ Puts a book from the recycle bin back in the library and takes it out of the bin.  :return: the Book """
+        book = self.recycle_bin.get(serial)
+        self.insert_book(book)
+        self.recycle_bin.discard(serial)
+        return book
+
+    def recycled_serials(self) -> list:
+        """ The serial numbers of every book ever deleted (they are never given to another book). """
+        return [row[0] for row in self.db.execute("SELECT serial FROM recycled")]
+
+    def remove_book(self, target) -> None:
+        """ Takes a book out of the library and lists it as recycled. """
+        row = self.db.execute("SELECT title, author FROM books WHERE serial = ?", (target,)).fetchone()
+        keys = dict(zip(('title', 'author'), row or ()))
+        with self.db:
+            self.db.execute("DELETE FROM books WHERE serial = ?", (target,))
+            self.db.execute("INSERT OR REPLACE INTO recycled (serial, filename) VALUES (?, ?)",
+                            (target, RECYCLE_PATH))
+        for (_, column), index in self.key_indexes.items():
+            # the title (or author) stays findable while another book has it
+            if column not in keys:
+                continue
+            if self.db.execute(f"SELECT 1 FROM books WHERE {column} = ?", (keys[column],)).fetchone() is None:
+                index.remove(keys[column])
+            else:
+                index.changed(keys[column])
+
+    def set_banner(self, message) -> None:
+        """ Sets the current banner to the 'message' parameter passed to this method """
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('banner', ?)", (message,))
+
+    def get_banner(self):
+        """ Returns the current banner formatted with line boxing, or False if there is none """
+        row = self.db.execute("SELECT value FROM settings WHERE name = 'banner'").fetchone()
+        if row and row[0]:
+            output = '-----------------------------------------------------------------------------------\n'
+            output += row[0]
+            output += '-----------------------------------------------------------------------------------\n'
+        else:
+            output = False
+        return output
+
+    def checkout(self, sn) -> None:
+        """ Marks a book as checked out. """
+        with self.db:
+            self.db.execute("UPDATE books SET checked_out = 1 WHERE serial = ?", (sn,))
+
+    def checkin(self, sn) -> None:
+        """ Marks a book as back in the library. """
+        with self.db:
+            self.db.execute("UPDATE books SET checked_out = 0 WHERE serial = ?", (sn,))
+
+    def is_available(self, serial) -> bool:
+        """ True if a serial number belongs to a book in the library that is not checked out. """
+        return self.db.execute("SELECT 1 FROM books WHERE serial = ? AND NOT checked_out",
+                               (serial,)).fetchone() is not None
+
+    def checked_out_count(self) -> int:
+        """ The number of books checked out (read from the partial index of checked out books). """
+        return self.db.execute("SELECT COUNT(*) FROM books WHERE checked_out").fetchone()[0]
+
+    def available_count(self) -> int:
+        """ The number of books in the library and not checked out. """
+        return self.book_count() - self.checked_out_count()
+
+    def available_by_title(self, title) -> int:
+        """ How many copies of a title are not checked out. """
+        return self.db.execute("SELECT COUNT(*) FROM books WHERE title = ?", (title,)).fetchone()[0] - \
+            self.db.execute("SELECT COUNT(*) FROM books WHERE title = ? AND checked_out", (title,)).fetchone()[0]
+
+    def available_by_author(self, author) -> int:
+        """ How many of an author's books are not checked out. """
+        return self.db.execute("SELECT COUNT(*) FROM books WHERE author = ?", (author,)).fetchone()[0] - \
+            self.db.execute("SELECT COUNT(*) FROM books WHERE author = ? AND checked_out", (author,)).fetchone()[0]
+
+    def available_serials(self, field, key) -> list:
+        """ The serial numbers of the books with exactly this title or author ('field') that are not checked out. """
+        column = 'title' if field == 'title' else 'author'
+        return [row[0] for row in
+                self.db.execute(f"SELECT serial FROM books WHERE {column} = ? AND NOT checked_out", (key,))]
+
+    def save(self) -> None:
+        """ Every change is committed as it is made...nothing to do. """
+
+    def close(self) -> None:
+        """ Closes the database. """
+        self.db.close()
+
+    def import_library(self, library, batch=10000) -> int:
+        """
+        Copies every book, recycle bin entry, serial counter and the banner of an in-memory Library into this
+        database, in one transaction.  A book already in the database is updated in place (an upsert, not
+        INSERT OR REPLACE, whose silent delete would skip the trigger keeping the full-text index in step).
+        :return: the number of books copied
+        """
+        rows = ([getattr(book, column) for column in COLUMNS] for book in library.serials.values())
+        insert = (f"INSERT INTO books ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                  f"ON CONFLICT (serial) DO UPDATE SET "
+                  f"{', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:])}")
+        with self.db:
+            while True:
+                chunk = [row for _, row in zip(range(batch), rows)]
+                if not chunk:
+                    break
+                self.db.executemany(insert, chunk)
+            self.db.executemany("INSERT OR REPLACE INTO recycled (serial, filename) VALUES (?, ?)",
+                                library.recycled.items())
+            self.db.executemany("INSERT OR REPLACE INTO serial_counters (prefix, next) VALUES (?, ?)",
+                                library.serial_counters.items())
+            self.db.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('banner', ?)", (library.banner,))
+        self.key_indexes.clear()        # rebuilt from the new rows when next used
+        return len(library.serials)
+
+
+# ---------- Functions ----------
+def migrate(pickle_path='library.pickle', db_path='library.db') -> None:
+    """ Copies library.pickle (and any journal of changes since it was saved) into an SQLite library. """
+    from MainUI import Book, Library
+    from library_journal import LibraryJournal
+
+    start = time.perf_counter()
+    journal_path = os.path.join(os.path.dirname(pickle_path), 'library.journal')
+    journal = LibraryJournal(pickle_path, journal_path)
+    library = journal.load(Library)
+    journal.close(compact=False)
+
+    target = SqliteLibrary(db_path, Book)
+    copied = target.import_library(library)
+    target.close()
+    print(f"Copied {copied:,} books from {pickle_path} to {db_path} in {time.perf_counter() - start:.1f} s")
+    print("Set CS361_LIBRARY_BACKEND=sqlite to use it.")
+
+
+# Execute Program
+if __name__ == '__main__':
+    # library.pickle refers to the Library classes as __main__.*, since MainUI.py is run as a script...make the
+    # names resolvable from this script too
+    from MainUI import Book, Library, SearchIndex
+    migrate(*sys.argv[1:3])
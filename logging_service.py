@@ -65,6 +65,30 @@ def generate_rpt(past) -> str:
             report += f"{line}\n"
     return report
 
+def handle_message(buffer, new_message):
+    """
+    Carries out one action message.
+    :return: the reply for the sender, or None for actions that have nothing to reply with
+    """
+
+    # Assign
+    command = new_message['action']
+
+    # take action based on the command given in the message
+
+    # --- RECORD INCOMING LOG  ---
+    if command == 'log':
+        buffer.append(new_message['log'])
+        return None
+
+    # --- REQUEST TO VIEW LOGS  ---
+    elif command == 'view':
+        return generate_rpt(new_message['days_past'])
+
+    # --- ERROR ---
+    else:
+        return 'ERROR'
+
 def main():
     """
     LOGGING MICROSERVICE
@@ -74,6 +98,12 @@ def main():
     # Instantiate a Pipeline called 'pipe'
     pipe = Pipeline('log')
 
+    # Bind our port now and keep it open, so messages arriving early are queued rather than refused
+    pipe.listen()
+
+    # Also take log entries from processes on this host through shared memory, no socket involved
+    pipe.open_ring()
+
     # ----- LOG SUB-FOLDER: INITIATE -----
     # Initialize logs dictionary
     if os.path.exists('logs'):
@@ -95,27 +125,21 @@ def main():
     threading.Thread(target=del_old, daemon=True).start()
 
     # --- MAIN MESSAGE HANDLER LOOP ---
-    while True:
-        # execute listening (blocking action) and assign result to 'new_message'
-        new_message = pipe.receive()
-
-        # Assign
-        command = new_message['action']
-
-        # take action based on the command given in the message
+    # The Pipeline listener queues messages as they arrive; take them one at a time
+    try:
+        for new_message in pipe.messages():
 
-        # --- RECORD INCOMING LOG  ---
-        if command == 'log':
-            buffer.append(new_message['log'])
+            # --- BATCH: run every action in order, answer with the list of results ---
+            if new_message['action'] == 'batch':
+                pipe.reply([handle_message(buffer, message) for message in new_message['batch']])
 
-        # --- REQUEST TO VIEW LOGS  ---
-        elif command == 'view':
-            report = generate_rpt(new_message['days_past'])
-            pipe.send('core', report)
+            # --- SINGLE ACTION ---
+            else:
+                pipe.reply(handle_message(buffer, new_message))
 
-        # --- ERROR ---
-        else:
-            pipe.send('core', 'ERROR')
+    # Shutting down (e.g. Ctrl-C)...leave a record of this run's traffic and latencies
+    finally:
+        pipe.close(dump_stats=True)
 
 
 # Execute Program
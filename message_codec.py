@@ -0,0 +1,536 @@
+# message_codec.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Encodes Pipeline message payloads.  The binary codec packs the known message shapes without
+#              field names, and never unpickles anything it did not ask for.
+
+# ---------- Imports ----------
+import itertools
+import operator
+import pickle
+import struct
+
+# ---------- Constants ----------
+# Frame type tags (the 1-byte tag in every Pipeline frame header)
+TAG_TEXT = 1                            # payload is a UTF-8 string
+TAG_PICKLE = 2                          # payload is a pickled object (dictionary, list...)
+TAG_BINARY = 3                          # payload is BinaryCodec output
+
+# Bump this whenever the binary layout below changes; it is the first byte of every binary payload.  Versions
+# in READABLE_VERSIONS can still be decoded (version 2 only added T_PACKED and T_PACKED_LIST)
+BINARY_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+
+# Value type markers used inside a binary payload
+(T_NONE, T_TRUE, T_FALSE, T_INT, T_FLOAT, T_STR, T_BYTES, T_LIST, T_TUPLE, T_DICT, T_MESSAGE, T_PACKED,
+ T_PACKED_LIST) = range(13)
+
+# The known message shapes.  A message whose keys are exactly 'action' plus these fields is sent as
+# [T_MESSAGE][schema number][field values...], with no key names.  A field written as (name, (subfields))
+# holds a dictionary with exactly those keys, packed the same way.
+# When every field value is a string of under 256 bytes (nearly always) the message is sent as
+# [T_PACKED][schema number][one length byte per value][the strings, back to back], and a list of such messages
+# of one schema (a batch of logs) as [T_PACKED_LIST][schema number][count][all the lengths][all the strings].
+#   ***  Only ever ADD to the end of this list, the position of each entry is its number on the wire  ***
+SCHEMAS = [
+    ('check_out', ('user', 'sn')),
+    ('check_in', ('user', 'sn')),
+    ('get_checkouts', ('user',)),
+    ('create_user', ('u_name', 'first_name', 'last_name', 'age', 'address', 'phone', 'email')),
+    ('delete_user', ('user_name',)),
+    ('get_user_dict', ('user_name',)),
+    ('get_user_info', ('user_name',)),
+    ('edit_user', ('user_name', 'attribute', 'new_value')),
+    ('log', (('log', ('user', 'trigger')),)),
+    ('view', ('days_past',)),
+    ('batch', ('batch',)),
+    ('stats', ()),
+]
+
+_FLOAT = struct.Struct('!d')
+
+
+# ---------- Functions ----------
+def _key_set(fields) -> frozenset:
+    """ The keys a dictionary must have, exactly, to match a list of schema fields. """
+    return frozenset(field if type(field) == str else field[0] for field in fields)
+
+
+def _count_fields(fields) -> int:
+    """ The number of values a schema's fields hold, counting each nested field's own. """
+    return sum(1 if type(field) == str else _count_fields(field[1]) for field in fields)
+
+
+def _schema_functions(fields, action=None) -> tuple:
+    """
+    The two functions a schema (or a nested field, with no action) needs, walking its fields:
+        flatten(message) -> the tuple of its field values in schema order, or None if it is not this shape
+        build(*values) -> the message holding them
+    A nested field gets its own pair, which the outer pair calls for its part of the values.
+    """
+    keys = _key_set(fields) | ({'action'} if action is not None else set())
+    start = {'action': action} if action is not None else {}
+
+    if all(type(field) == str for field in fields):
+        # itemgetter returns a tuple of two or more items, but one item alone (and needs at least one field)
+        values_of = operator.itemgetter(*fields) if len(fields) > 1 else \
+            lambda message: tuple([message[field] for field in fields])
+
+        def flatten(message):
+            if type(message) is not dict or message.keys() != keys:
+                return None
+            return values_of(message)
+
+        def build(*values):
+            message = start.copy()
+            message.update(zip(fields, values))
+            return message
+
+        def build_nested(*values):
+            return dict(zip(fields, values))
+
+        return flatten, build if action is not None else build_nested
+
+    parts = []                          # (name, number of values, the nested field's functions or None)
+    for field in fields:
+        if type(field) == str:
+            parts.append((field, 1, None, None))
+        else:
+            parts.append((field[0], _count_fields(field[1])) + _schema_functions(field[1]))
+
+    def flatten(message):
+        if type(message) is not dict or message.keys() != keys:
+            return None
+        values = []
+        for name, _, flatten_nested, _ in parts:
+            if flatten_nested is None:
+                values.append(message[name])
+            else:
+                nested = flatten_nested(message[name])
+                if nested is None:
+                    return None
+                values += nested
+        return tuple(values)
+
+    def build(*values):
+        message = start.copy()
+        position = 0
+        for name, width, _, build_nested in parts:
+            message[name] = values[position] if build_nested is None else \
+                build_nested(*values[position:position + width])
+            position += width
+        return message
+
+    return flatten, build
+
+
+class _Schema:
+    """ One entry of SCHEMAS, with the functions encoding and decoding it made once. """
+
+    def __init__(self, number, action, fields):
+        self.number = number
+        self.action = action
+        self.width = _count_fields(fields)                          # field values, nested ones included
+        self.header = bytes((T_PACKED, number))
+        self.payload_header = bytes((BINARY_VERSION, T_PACKED, number))  # a whole payload of just this message
+        self.flatten, self.build = _schema_functions(fields, action)
+
+
+_SCHEMAS = [_Schema(number, action, fields) for number, (action, fields) in enumerate(SCHEMAS)]
+_BY_ACTION = {schema.action: schema for schema in _SCHEMAS}
+
+
+def _write_varint(out, number) -> None:
+    """ Appends an unsigned integer, 7 bits per byte, low bits first. """
+    while number > 0x7F:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _read_varint(buf, pos) -> tuple:
+    """ Reads an unsigned varint, returning (number, next position). """
+    number = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def _write_str(out, value) -> None:
+    data = value.encode()
+    if len(data) < 0x80:
+        out += _SHORT_STR[len(data)]
+    else:
+        out.append(T_STR)
+        _write_varint(out, len(data))
+    out += data
+
+
+_SHORT_STR = [bytes((T_STR, length)) for length in range(0x80)]     # T_STR headers of strings < 128 bytes
+
+
+def _write_none(out, value) -> None:
+    out.append(T_NONE)
+
+
+def _write_bool(out, value) -> None:
+    out.append(T_TRUE if value else T_FALSE)
+
+
+def _write_int(out, value) -> None:
+    out.append(T_INT)
+    # zigzag, so small negative numbers stay small
+    _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+
+def _write_float(out, value) -> None:
+    out.append(T_FLOAT)
+    out += _FLOAT.pack(value)
+
+
+def _write_bytes(out, value) -> None:
+    out.append(T_BYTES)
+    _write_varint(out, len(value))
+    out += value
+
+
+def _write_dict(out, value) -> None:
+    schema = _BY_ACTION.get(value.get('action'))
+    if schema is not None:
+        values = schema.flatten(value)
+        if values is not None:
+            _write_message(out, schema, values)
+            return
+    out.append(T_DICT)
+    _write_varint(out, len(value))
+    for key, item in value.items():
+        # string keys (and values) are nearly all there is...write the short ones inline
+        if type(key) is str and len(key) < 0x80 and key.isascii():
+            out += _SHORT_STR[len(key)]
+            out += key.encode()
+        else:
+            _WRITERS.get(type(key), _write_unknown)(out, key)
+        if type(item) is str and len(item) < 0x80 and item.isascii():
+            out += _SHORT_STR[len(item)]
+            out += item.encode()
+        else:
+            _WRITERS.get(type(item), _write_unknown)(out, item)
+
+
+def _pack_strings(values):
+    """ ([length byte per value], the values' UTF-8 back to back), or None unless all are strings < 256 bytes. """
+    for value in values:
+        if type(value) is not str:
+            return None
+    data = [value.encode() for value in values]
+    try:
+        return bytes(map(len, data)), b''.join(data)
+    except ValueError:
+        return None                     # a string of 256+ bytes
+
+
+def _write_message(out, schema, values) -> None:
+    """ Appends a message of a known schema: T_PACKED if every value is a short string, else T_MESSAGE. """
+    packed = _pack_strings(values)
+    if packed is not None:
+        out += schema.header
+        out += packed[0]
+        out += packed[1]
+        return
+    out += bytes((T_MESSAGE, schema.number))
+    for value in values:
+        _WRITERS.get(type(value), _write_unknown)(out, value)
+
+
+def _write_sequence(out, value) -> None:
+    if type(value) == list and len(value) > 1 and _write_message_list(out, value):
+        return
+    out.append(T_LIST if type(value) == list else T_TUPLE)
+    _write_varint(out, len(value))
+    for item in value:
+        _WRITERS.get(type(item), _write_unknown)(out, item)
+
+
+def _write_message_list(out, messages) -> bool:
+    """ Appends a list of messages of one schema as T_PACKED_LIST, if they all pack.  :return: True if done """
+    first = messages[0]
+    if type(first) is not dict:
+        return False
+    schema = _BY_ACTION.get(first.get('action'))
+    if schema is None or not schema.width:
+        return False
+    flatten = schema.flatten
+    values = []
+    for message in messages:
+        if type(message) is not dict:
+            return False
+        fields = flatten(message)
+        if fields is None:
+            return False
+        values.extend(fields)
+    packed = _pack_strings(values)
+    if packed is None:
+        return False
+    out += bytes((T_PACKED_LIST, schema.number))
+    _write_varint(out, len(messages))
+    out += packed[0]
+    out += packed[1]
+    return True
+
+
+def _write_unknown(out, value) -> None:
+    raise TypeError(f"{type(value).__name__} has no binary encoding")
+
+
+# value type: the function appending its tagged encoding
+_WRITERS = {str: _write_str, type(None): _write_none, bool: _write_bool, int: _write_int, float: _write_float,
+            bytes: _write_bytes, dict: _write_dict, list: _write_sequence, tuple: _write_sequence}
+
+
+def _write_value(out, value) -> None:
+    """ Appends one tagged value.  Raises TypeError for anything without a binary form. """
+    _WRITERS.get(type(value), _write_unknown)(out, value)
+
+
+def _read_str(buf, pos) -> tuple:
+    length = buf[pos]
+    if length < 0x80:
+        pos += 1
+    else:
+        length, pos = _read_varint(buf, pos)
+    return str(buf[pos:pos + length], 'utf-8'), pos + length
+
+
+def _read_none(buf, pos) -> tuple:
+    return None, pos
+
+
+def _read_true(buf, pos) -> tuple:
+    return True, pos
+
+
+def _read_false(buf, pos) -> tuple:
+    return False, pos
+
+
+def _read_int(buf, pos) -> tuple:
+    number, pos = _read_varint(buf, pos)
+    return (number >> 1) if not number & 1 else -((number + 1) >> 1), pos
+
+
+def _read_float(buf, pos) -> tuple:
+    return _FLOAT.unpack_from(buf, pos)[0], pos + 8
+
+
+def _read_bytes(buf, pos) -> tuple:
+    length, pos = _read_varint(buf, pos)
+    return bytes(buf[pos:pos + length]), pos + length
+
+
+def _read_items(buf, pos) -> tuple:
+    """ Reads a count and that many values, returning ([values], next position). """
+    count, pos = _read_varint(buf, pos)
+    items = []
+    for _ in range(count):
+        item, pos = _READERS[buf[pos]](buf, pos + 1)
+        items.append(item)
+    return items, pos
+
+
+def _read_list(buf, pos) -> tuple:
+    return _read_items(buf, pos)
+
+
+def _read_tuple(buf, pos) -> tuple:
+    items, pos = _read_items(buf, pos)
+    return tuple(items), pos
+
+
+def _read_dict(buf, pos) -> tuple:
+    count, pos = _read_varint(buf, pos)
+    result = {}
+    for _ in range(count):
+        # short strings inline, as _write_dict writes them
+        if buf[pos] == T_STR and buf[pos + 1] < 0x80:
+            end = pos + 2 + buf[pos + 1]
+            key = str(buf[pos + 2:end], 'utf-8')
+            pos = end
+        else:
+            key, pos = _READERS[buf[pos]](buf, pos + 1)
+        if buf[pos] == T_STR and buf[pos + 1] < 0x80:
+            end = pos + 2 + buf[pos + 1]
+            result[key] = str(buf[pos + 2:end], 'utf-8')
+            pos = end
+        else:
+            result[key], pos = _READERS[buf[pos]](buf, pos + 1)
+    return result, pos
+
+
+def _read_message(buf, pos) -> tuple:
+    schema = _SCHEMAS[buf[pos]]
+    pos += 1
+    values = []
+    for _ in range(schema.width):
+        value, pos = _READERS[buf[pos]](buf, pos + 1)
+        values.append(value)
+    return schema.build(*values), pos
+
+
+def _unpack_strings(buf, pos, count) -> tuple:
+    """ Reads what _pack_strings wrote for 'count' values, returning ([the strings], next position). """
+    lengths = bytes(buf[pos:pos + count])
+    pos += count
+    end = pos + sum(lengths)
+    data = bytes(buf[pos:end])
+    if len(data) < end - pos:
+        raise IndexError(end)
+    if data.isascii():
+        # one decode for them all: character and byte offsets are the same
+        text = data.decode()
+        ends = list(itertools.accumulate(lengths))
+        return [text[start:stop] for start, stop in zip([0] + ends, ends)], end
+    values = []
+    start = 0
+    for length in lengths:
+        values.append(str(data[start:start + length], 'utf-8'))
+        start += length
+    return values, end
+
+
+def _read_packed(buf, pos) -> tuple:
+    schema = _SCHEMAS[buf[pos]]
+    width = schema.width
+    pos += 1 + width
+    values = []
+    for length in buf[pos - width:pos]:
+        values.append(str(buf[pos:pos + length], 'utf-8'))
+        pos += length
+    if pos > len(buf):
+        raise IndexError(pos)
+    return schema.build(*values), pos
+
+
+def _read_packed_list(buf, pos) -> tuple:
+    schema = _SCHEMAS[buf[pos]]
+    count, pos = _read_varint(buf, pos + 1)
+    width = schema.width
+    if not width:
+        raise ValueError(f"message schema {schema.action!r} has no fields to pack")
+    values, pos = _unpack_strings(buf, pos, count * width)
+    return list(map(schema.build, *[values[field::width] for field in range(width)])), pos
+
+
+def _read_unknown(buf, pos):
+    raise ValueError(f"unknown binary value type {buf[pos - 1]}")
+
+
+# value type marker: the function reading that value, (buf, position after the marker) -> (value, next position)
+_READERS = [_read_none, _read_true, _read_false, _read_int, _read_float, _read_str, _read_bytes, _read_list,
+            _read_tuple, _read_dict, _read_message, _read_packed, _read_packed_list] + [_read_unknown] * 243
+
+
+def _read_value(buf, pos) -> tuple:
+    """ Reads one tagged value, returning (value, next position). """
+    return _READERS[buf[pos]](buf, pos + 1)
+
+
+# ---------- Classes ----------
+class PickleCodec:
+    """
+    The original payload format: strings go as UTF-8 text, everything else is pickled.
+    Only use it between processes that trust each other, since unpickling can run arbitrary code.
+    """
+
+    def encode(self, data) -> tuple:
+        """ Returns (frame type tag, payload bytes) for a message. """
+        if type(data) == str:
+            return TAG_TEXT, data.encode()
+        return TAG_PICKLE, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, tag, payload):
+        """ Turns a frame payload (bytes or memoryview) back into the object that was sent. """
+        if tag == TAG_TEXT:
+            return str(payload, 'utf-8')
+        elif tag == TAG_PICKLE:
+            return pickle.loads(payload)
+        elif tag == TAG_BINARY:
+            return BinaryCodec.decode_binary(payload)
+        else:
+            raise ValueError(f"unknown frame type tag {tag}")
+
+
+class BinaryCodec(PickleCodec):
+    """
+    Compact, versioned binary payloads for the plain data the services exchange: strings, numbers, None,
+    booleans, bytes, lists, tuples and dictionaries, with the known message shapes in SCHEMAS packed
+    without their key names.
+
+    Anything else (e.g. a class instance) is refused, and so are incoming pickle frames, so nothing from the
+    network is ever unpickled.  Between processes that trust each other, allow_pickle=True pickles such
+    values instead and accepts pickle frames.
+    """
+
+    def __init__(self, allow_pickle=False):
+        """ Chooses whether pickle is accepted (explicitly opted into) for values the binary format cannot hold. """
+        self.allow_pickle = allow_pickle
+
+    def encode(self, data) -> tuple:
+        """ Returns (frame type tag, payload bytes) for a message. """
+        if type(data) == str:
+            return TAG_TEXT, data.encode()
+
+        # most messages are one of SCHEMAS holding only short strings...build those in one go
+        if type(data) == dict:
+            schema = _BY_ACTION.get(data.get('action'))
+            if schema is not None:
+                values = schema.flatten(data)
+                packed = None if values is None else _pack_strings(values)
+                if packed is not None:
+                    return TAG_BINARY, schema.payload_header + packed[0] + packed[1]
+
+        out = bytearray((BINARY_VERSION,))
+        try:
+            _write_value(out, data)
+        except TypeError:
+            if not self.allow_pickle:
+                raise
+            return TAG_PICKLE, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        return TAG_BINARY, out
+
+    def decode(self, tag, payload):
+        """ Turns a frame payload (bytes or memoryview) back into the object that was sent. """
+        if tag == TAG_PICKLE and not self.allow_pickle:
+            raise ValueError("refusing a pickled payload (allow_pickle is off)")
+        return super().decode(tag, payload)
+
+    @staticmethod
+    def decode_binary(payload):
+        """
+        Decodes a TAG_BINARY payload, checking its version byte first.  A malformed payload (empty, truncated,
+        nested too deeply...) raises ValueError, which the Pipeline readers handle, and nothing else.
+        """
+        if not len(payload):
+            raise ValueError("binary payload is empty")
+        if payload[0] not in READABLE_VERSIONS:
+            raise ValueError(f"binary payload version {payload[0]} is not supported (expected {BINARY_VERSION})")
+        try:
+            value, end = _read_value(payload, 1)
+        except (IndexError, struct.error):
+            raise ValueError("binary payload is truncated, or names an unknown message schema")
+        except RecursionError:
+            raise ValueError("binary payload is nested too deeply")
+        except TypeError as error:
+            raise ValueError(f"binary payload is malformed ({error})")   # e.g. a list as a dictionary key
+        if end != len(payload):
+            raise ValueError("binary payload has trailing bytes")
+        return value
+
+
+# The codec a Pipeline uses unless it is given another: every message the services exchange is plain data,
+# so pickle is never needed (or accepted) on the wire
+DEFAULT_CODEC = BinaryCodec(allow_pickle=False)
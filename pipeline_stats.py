@@ -0,0 +1,245 @@
+# pipeline_stats.py
+# Author: Philip Sheridan
+# Class: CS361 / Oregon State University
+# Description: Traffic and latency counters for Pipeline, per destination and per action, so the slow hop
+#              between services can be found.  Every service answers {'action': 'stats'} with a snapshot.
+
+# ---------- Imports ----------
+import threading
+import time
+
+# ---------- Constants ----------
+# Each power of two of microseconds is split into this many equal buckets, so a recorded latency is off by
+# at most 1/32 (about 3%) of its value, from 1 us up to hours, in a few hundred counters
+SUB_BUCKETS = 32
+SUB_BITS = 5                            # log2(SUB_BUCKETS)
+
+# The percentiles shown in snapshots and reports
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+# ---------- Functions ----------
+def bucket_of(micros) -> int:
+    """ The histogram bucket a whole number of microseconds falls in. """
+    if micros < SUB_BUCKETS:
+        return micros
+    shift = micros.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (micros >> shift) - SUB_BUCKETS
+
+
+def bucket_floor(bucket) -> int:
+    """ The smallest number of microseconds that lands in a bucket. """
+    if bucket < SUB_BUCKETS:
+        return bucket
+    shift = bucket // SUB_BUCKETS - 1
+    return (bucket % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+def action_of(message) -> str:
+    """ The action name of a message, for grouping counters. """
+    if type(message) == dict:
+        return str(message.get('action'))
+    return type(message).__name__
+
+
+# ---------- Classes ----------
+class LatencyHistogram:
+    """
+    HDR-style latency histogram: log-linear buckets with fixed relative precision, so recording is O(1) and
+    the memory used does not grow with the number of samples.
+    """
+
+    def __init__(self):
+        """ Starts empty. """
+        self.buckets = {}               # {bucket number: samples}
+        self.count = 0
+        self.total = 0.0                # seconds
+        self.max = 0.0                  # seconds
+
+    def record(self, seconds) -> None:
+        """ Adds one sample. """
+        micros = int(seconds * 1000000)
+        if micros < SUB_BUCKETS:
+            bucket = micros
+        else:
+            # bucket_of(), inlined since this runs for every request
+            shift = micros.bit_length() - SUB_BITS - 1
+            bucket = (shift + 1) * SUB_BUCKETS + (micros >> shift) - SUB_BUCKETS
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent) -> float:
+        """ The latency in seconds that 'percent' of the samples were at or below (to bucket precision). """
+        if not self.count:
+            return 0.0
+        wanted = self.count * percent / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                return bucket_floor(bucket) / 1000000
+        return self.max
+
+    def snapshot(self) -> dict:
+        """ Summary suitable for sending in a message: count, mean, max and percentiles, in microseconds. """
+        summary = {'count': self.count, 'mean_us': round(self.total / self.count * 1000000) if self.count else 0,
+                   'max_us': round(self.max * 1000000)}
+        for percent in PERCENTILES:
+            summary[f"p{percent}_us"] = round(self.percentile(percent) * 1000000)
+        return summary
+
+
+class TrafficCounters:
+    """ Message and byte counts for one destination or action, with a latency histogram. """
+
+    def __init__(self):
+        """ Starts at zero. """
+        self.messages = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.failures = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self) -> dict:
+        """ The counters as a plain dictionary. """
+        return {'messages': self.messages, 'bytes_out': self.bytes_out, 'bytes_in': self.bytes_in,
+                'failures': self.failures, 'latency': self.latency.snapshot()}
+
+
+class PipelineStats:
+    """
+    Everything one Pipeline has seen since it started:
+        outgoing    - per destination service: messages sent, bytes out, reply bytes in, failures,
+                      and request round-trip time
+        sent        - the same, per action sent
+        received    - per action received: messages, bytes in, reply bytes out, and the time from a message
+                      arriving to its reply going out
+        connects    - per destination: connections opened, failed attempts, and time to connect
+
+    Safe to update from any thread.  Outgoing traffic is counted once per (destination, action) pair and only
+    totalled up by destination and by action when a snapshot is taken, to keep recording cheap.
+    """
+
+    def __init__(self, service):
+        """ Starts counting for a named service. """
+        self.service = service
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.outgoing = {}              # {(destination name, action): TrafficCounters}
+        self.received = {}              # {action: TrafficCounters}
+        self.connects = {}              # {address: TrafficCounters}, latency is time to connect
+
+    @staticmethod
+    def counters(table, key) -> TrafficCounters:
+        """ The counters for a key, created on first use.  Call with the lock held. """
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = TrafficCounters()
+        return entry
+
+    def record_send(self, label, size) -> None:
+        """ A one-way message of 'size' bytes went out.  'label' is its (destination name, action). """
+        with self.lock:
+            entry = self.counters(self.outgoing, label)
+            entry.messages += 1
+            entry.bytes_out += size
+
+    def record_request(self, label, size_out, size_in, seconds) -> None:
+        """ A request of 'size_out' bytes was answered with 'size_in' bytes, 'seconds' after it was sent. """
+        with self.lock:
+            entry = self.counters(self.outgoing, label)
+            entry.messages += 1
+            entry.bytes_out += size_out
+            entry.bytes_in += size_in
+            entry.latency.record(seconds)
+
+    def record_failure(self, label) -> None:
+        """ A send or request failed, or timed out waiting for its reply (it is not counted as a message). """
+        with self.lock:
+            self.counters(self.outgoing, label).failures += 1
+
+    def record_receive(self, action, size) -> None:
+        """ A message of 'size' bytes arrived at this service, and was not answered. """
+        with self.lock:
+            entry = self.counters(self.received, action)
+            entry.messages += 1
+            entry.bytes_in += size
+
+    def record_answer(self, action, size_in, size_out, seconds) -> None:
+        """ A message of 'size_in' bytes was answered with 'size_out' bytes, 'seconds' after it arrived. """
+        with self.lock:
+            entry = self.counters(self.received, action)
+            entry.messages += 1
+            entry.bytes_in += size_in
+            entry.bytes_out += size_out
+            entry.latency.record(seconds)
+
+    def record_connect(self, address, seconds, failed=False) -> None:
+        """ A connection attempt to an address took 'seconds'. """
+        with self.lock:
+            entry = self.counters(self.connects, address)
+            if failed:
+                entry.failures += 1
+            else:
+                entry.messages += 1
+                entry.latency.record(seconds)
+
+    @staticmethod
+    def totals(entries) -> dict:
+        """ Adds a group of TrafficCounters together into one snapshot. """
+        combined = TrafficCounters()
+        for entry in entries:
+            combined.messages += entry.messages
+            combined.bytes_out += entry.bytes_out
+            combined.bytes_in += entry.bytes_in
+            combined.failures += entry.failures
+            latency = combined.latency
+            for bucket, count in entry.latency.buckets.items():
+                latency.buckets[bucket] = latency.buckets.get(bucket, 0) + count
+            latency.count += entry.latency.count
+            latency.total += entry.latency.total
+            latency.max = max(latency.max, entry.latency.max)
+        return combined.snapshot()
+
+    def snapshot(self, address_book=None) -> dict:
+        """
+        All counters as plain data, the reply to a 'stats' action.
+        :param address_book: used to show connection counters by service name instead of address
+        """
+        names = {address: name for name, address in (address_book or {}).items()}
+        with self.lock:
+            by_destination = {}
+            by_action = {}
+            for (destination, action), entry in self.outgoing.items():
+                by_destination.setdefault(destination, []).append(entry)
+                by_action.setdefault(action, []).append(entry)
+            return {
+                'service': self.service,
+                'uptime': round(time.time() - self.started, 1),
+                'outgoing': {name: self.totals(entries) for name, entries in by_destination.items()},
+                'sent': {action: self.totals(entries) for action, entries in by_action.items()},
+                'received': {action: entry.snapshot() for action, entry in self.received.items()},
+                'connects': {names.get(address, str(address)): entry.snapshot()
+                             for address, entry in self.connects.items()},
+            }
+
+    def report(self, address_book=None) -> str:
+        """ The snapshot laid out as a table for printing. """
+        snapshot = self.snapshot(address_book)
+        lines = [f"----- PIPELINE STATS: {snapshot['service']} (up {snapshot['uptime']} s) -----"]
+        headings = {'outgoing': 'TO SERVICE', 'sent': 'ACTION SENT', 'received': 'ACTION RECEIVED',
+                    'connects': 'CONNECTIONS TO'}
+        for section, heading in headings.items():
+            if not snapshot[section]:
+                continue
+            lines.append(f"{heading:<18}{'msgs':>9}{'out B':>12}{'in B':>12}{'fail':>6}"
+                         f"{'p50 us':>9}{'p99 us':>9}{'max us':>10}")
+            for key, entry in sorted(snapshot[section].items()):
+                latency = entry['latency']
+                lines.append(f"  {key:<16}{entry['messages']:>9}{entry['bytes_out']:>12}{entry['bytes_in']:>12}"
+                             f"{entry['failures']:>6}{latency['p50_us']:>9}{latency['p99_us']:>9}"
+                             f"{latency['max_us']:>10}")
+        return '\n'.join(lines)
@@ -8,6 +8,9 @@ import pickle
 import random
 from Pipeline import Pipeline
 
+# Actions that change the profiles database, which must be saved after them
+CHANGES_DATA = ('create_user', 'delete_user', 'edit_user')
+
 
 # ---------- Classes ----------
 
@@ -120,6 +123,86 @@ def save_data(data) -> None:
     except FileNotFoundError:
         print("ERROR SAVING Profile data!!!")
 
+def handle_message(profiles, new_message):
+    """
+    Carries out one action message against the profiles.  Does not save; the caller saves once per message
+    or batch (see CHANGES_DATA).
+    :return: the reply for the sender, or None for actions that have nothing to reply with
+    """
+
+    # Assign
+    print(f'new message is {new_message}')
+    command = new_message['action']
+    data = new_message                      # workaround to fuse original code convention with later one
+
+    # <<< DEBUGGING >>>
+    print(f" INCOMING...command is {command} and data is {data}!")
+
+    # take action based on the command given in the message
+
+    # --- CREATE NEW USER PROFILE ---
+    # * Tested and confirmed working *
+    if command == 'create_user':
+        u_name = data['u_name']
+        # data format: dictionary with keys: [first_name, last_name, age, address, phone, email]
+        f = data['first_name']
+        last = data['last_name']
+        age = data['age']
+        addr = data['address']
+        p = data['phone']
+        e = data['email']
+        new = User(f, last, age, addr, p, e)
+        profiles.add_user(u_name, new)
+        return None
+
+    # --- DELETE EXISTING USER PROFILE---
+    elif command == 'delete_user':
+        # data format {'user_name': username}
+
+        # delete the user if it exists...
+        if data['user_name'] in profiles.users.keys():
+            del profiles.users[data['user_name']]
+            del profiles.lib_cards[data['user_name']]
+            return 'DELETED'
+        # ...if not, let the UI know what happened
+        else:
+            return 'ERROR: user not found!'
+
+    # --- GET USER PROFILE DICTIONARY ---
+    elif command == 'get_user_dict':
+        # data format {'user_name': username}
+        uname = data['user_name']
+        if uname in profiles.users.keys():
+            return profiles.users[uname].get_dict()
+        else:
+            print("Get user info has encountered an error!")
+            return 'ERROR'
+
+    # --- GET USER PROFILE INFO ---
+    elif command == 'get_user_info':
+        # data format {'user_name': username}
+        uname = data['user_name']
+        if uname in profiles.users.keys():
+            print(f"Get user info has found user {uname}, sending info to core...")
+            print(f"sending THIS {profiles.users[uname].get_info()}")
+            return profiles.users[uname].get_info()
+        else:
+            print("Get user info has encountered an error!")
+            return 'ERROR'
+
+    # --- EDIT USER ---
+    elif command == 'edit_user':
+        # data format {'user_name': username, 'attribute': a user attr. , 'new_value': new attr. value}
+        uname = data['user_name']
+        attribute = data['attribute']
+        new_value = data['new_value']
+        profiles.users[uname].edit(attribute, new_value)
+        return None
+
+    # --- ERROR ---
+    else:
+        return "{'error': 'bad command'}"
+
 def main():
     """
     PROFILE MICROSERVICE
@@ -131,6 +214,9 @@ def main():
     # Instantiate a Pipeline called 'pipe'
     pipe = Pipeline('profile')
 
+    # Bind our port now and keep it open, so messages arriving early are queued rather than refused
+    pipe.listen()
+
     # ----- PROFILE DATABASE INITIATE -----
     # check for existing Profiles database
 
@@ -143,92 +229,27 @@ def main():
     except FileNotFoundError:
         profiles = ProfileData()
 
-    # Initiate main (outer) loop.  [there's an inner loop in the Pipeline.receive() function]
-    while True:
-        # execute listening (blocking action) and assign result to 'new_message'
-        new_message = pipe.receive()
-
-        # Assign
-        print(f'new message is {new_message}')
-        command = new_message['action']
-        data = new_message                      # workaround to fuse original code convention with later one
-
-        # <<< DEBUGGING >>>
-        print(f" INCOMING...command is {command} and data is {data}!")
-
-        # take action based on the command given in the message
-
-        # --- CREATE NEW USER PROFILE ---
-        # * Tested and confirmed working *
-        if command == 'create_user':
-            u_name = data['u_name']
-            # data format: dictionary with keys: [first_name, last_name, age, address, phone, email]
-            f = data['first_name']
-            last = data['last_name']
-            age = data['age']
-            addr = data['address']
-            p = data['phone']
-            e = data['email']
-            new = User(f, last, age, addr, p, e)
-            profiles.add_user(u_name, new)
-
-            # Write change to database
-            save_data(profiles)
-
-            continue
-
-        # --- DELETE EXISTING USER PROFILE---
-        elif command == 'delete_user':
-            # data format {'user_name': username}
-
-            # delete the user if it exists...
-            if data['user_name'] in profiles.users.keys():
-                del profiles.users[data['user_name']]
-                del profiles.lib_cards[data['user_name']]
-                pipe.send('core', 'DELETED')
-            # ...if not, let the UI know what happened
-            else:
-                pipe.send('core', 'ERROR: user not found!')
+    # Initiate main loop.  The Pipeline listener queues messages as they arrive; take them one at a time
+    try:
+        for new_message in pipe.messages():
 
-            # Write change to database
-            save_data(profiles)
+            # --- BATCH: run every action in order, answer with the list of results ---
+            if new_message['action'] == 'batch':
+                actions = new_message['batch']
+                pipe.reply([handle_message(profiles, message) for message in actions])
 
-        # --- GET USER PROFILE DICTIONARY ---
-        elif command == 'get_user_dict':
-            # data format {'user_name': username}
-            uname = data['user_name']
-            if uname in profiles.users.keys():
-                pipe.send('core', profiles.users[uname].get_dict())
-            else:
-                print("Get user info has encountered an error!")
-                pipe.send('core', 'ERROR')
-
-        # --- GET USER PROFILE INFO ---
-        elif command == 'get_user_info':
-            # data format {'user_name': username}
-            uname = data['user_name']
-            if uname in profiles.users.keys():
-                print(f"Get user info has found user {uname}, sending info to core...")
-                print(f"sending THIS {profiles.users[uname].get_info()}")
-                pipe.send('core', profiles.users[uname].get_info())
+            # --- SINGLE ACTION ---
             else:
-                print("Get user info has encountered an error!")
-                pipe.send('core', 'ERROR')
-
-        # --- EDIT USER ---
-        elif command == 'edit_user':
-            # data format {'user_name': username, 'attribute': a user attr. , 'new_value': new attr. value}
-            uname = data['user_name']
-            attribute = data['attribute']
-            new_value = data['new_value']
-            profiles.users[uname].edit(attribute, new_value)
-            save_data(profiles)
-            continue
-
-        # --- ERROR ---
-        else:
-            pipe.send('core', "{'error': 'bad command'}")
-            continue
+                actions = [new_message]
+                pipe.reply(handle_message(profiles, new_message))
+
+            # Write any changes to database, once for the whole message
+            if any(message['action'] in CHANGES_DATA for message in actions):
+                save_data(profiles)
+
+    # Shutting down (e.g. Ctrl-C)...leave a record of this run's traffic and latencies
+    finally:
+        pipe.close(dump_stats=True)
 
 
 # Execute Program